@@ -1,11 +1,21 @@
 """Voice Streaming Integration for Home Assistant."""
 import asyncio
 import logging
+import os
+import time
+from urllib.parse import quote
+import aiohttp
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import HomeAssistantError
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.util import slugify
 
 DOMAIN = "voice_streaming"
+CONF_SERVER_URL = "server_url"
+DEFAULT_SERVER_URL = "http://localhost:8080"
+# The server reads at most a few minutes of history from memory
+HISTORY_TIMEOUT = 30
 _LOGGER = logging.getLogger(__name__)
 
 async def async_setup(hass: HomeAssistant, config: dict):
@@ -50,6 +60,12 @@ class VoiceStreamingCoordinator:
             self.stop_recording
         )
         
+        self.hass.services.async_register(
+            DOMAIN, 
+            "save_last_seconds", 
+            self.save_last_seconds
+        )
+        
     async def start_recording(self, call):
         """Start voice recording service."""
         _LOGGER.info("Starting voice recording")
@@ -60,6 +76,67 @@ class VoiceStreamingCoordinator:
         _LOGGER.info("Stopping voice recording")
         self.hass.bus.async_fire("voice_streaming.recording_stopped")
 
+    async def save_last_seconds(self, call):
+        """Save the last seconds of a stream from the server's in-memory history."""
+        stream_id = call.data["stream_id"]
+        seconds = call.data.get("seconds", 10)
+        fmt = call.data.get("format", "wav")
+        extension = "wav" if fmt == "wav" else "ogg"
+        filename = call.data.get("filename")
+        if not filename:
+            # The stream id comes from the caller; keep it inside DOMAIN/
+            filename = self.hass.config.path(
+                DOMAIN, f"{slugify(stream_id) or 'stream'}-{int(time.time())}.{extension}"
+            )
+        elif not self.hass.config.is_allowed_path(filename):
+            raise HomeAssistantError(
+                f"Cannot write to {filename}: add its directory to allowlist_external_dirs"
+            )
+
+        server_url = self.entry.data.get(CONF_SERVER_URL, DEFAULT_SERVER_URL).rstrip("/")
+        session = async_get_clientsession(self.hass)
+        try:
+            async with session.get(
+                f"{server_url}/api/streams/{quote(stream_id, safe='')}/history",
+                params={"seconds": seconds, "format": fmt},
+                timeout=aiohttp.ClientTimeout(total=HISTORY_TIMEOUT),
+            ) as response:
+                if response.status != 200:
+                    raise HomeAssistantError(
+                        f"Could not fetch history for {stream_id}: "
+                        f"{response.status} {await response.text()}"
+                    )
+                start_time = float(response.headers.get("X-Start-Time", 0))
+                duration = float(response.headers.get("X-Duration", 0))
+                body = await response.read()
+        except asyncio.TimeoutError as err:
+            raise HomeAssistantError(
+                f"Voice streaming server at {server_url} did not answer "
+                f"within {HISTORY_TIMEOUT} s"
+            ) from err
+        except aiohttp.ClientError as err:
+            raise HomeAssistantError(
+                f"Could not reach the voice streaming server at {server_url}: {err}"
+            ) from err
+
+        await self.hass.async_add_executor_job(_write_file, filename, body)
+        _LOGGER.info("Saved %.1f s of %s to %s", duration, stream_id, filename)
+        self.hass.bus.async_fire(
+            "voice_streaming.snapshot_saved",
+            {
+                "stream_id": stream_id,
+                "filename": filename,
+                "start_time": start_time,
+                "duration": duration,
+            },
+        )
+
+
+def _write_file(filename: str, body: bytes):
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    with open(filename, "wb") as file:
+        file.write(body)
+
 class VoiceStreamingWebSocketView:
     """WebSocket view for voice streaming."""
     
@@ -70,4 +147,4 @@ class VoiceStreamingWebSocketView:
         """Handle WebSocket connection."""
         # This is a simplified implementation
         # In a real implementation, you would handle the WebRTC connection here
-        return "WebSocket connection established"
\ No newline at end of file
+        return "WebSocket connection established"
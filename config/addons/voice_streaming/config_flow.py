@@ -0,0 +1,53 @@
+"""Config flow for Voice Streaming."""
+import asyncio
+import logging
+
+import aiohttp
+import voluptuous as vol
+from homeassistant import config_entries
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+
+from . import CONF_SERVER_URL, DEFAULT_SERVER_URL, DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+CHECK_TIMEOUT = 10
+
+
+class VoiceStreamingConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
+    """Ask for the voice streaming server's URL and check that it answers."""
+
+    VERSION = 1
+
+    async def async_step_user(self, user_input=None):
+        """Handle the step started from the integrations page."""
+        errors = {}
+        if user_input is not None:
+            server_url = user_input[CONF_SERVER_URL].rstrip("/")
+            await self.async_set_unique_id(server_url)
+            self._abort_if_unique_id_configured()
+            try:
+                await self._check_server(server_url)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                _LOGGER.warning("Could not reach %s: %s", server_url, err)
+                errors["base"] = "cannot_connect"
+            else:
+                return self.async_create_entry(
+                    title=server_url, data={CONF_SERVER_URL: server_url}
+                )
+
+        return self.async_show_form(
+            step_id="user",
+            data_schema=vol.Schema(
+                {vol.Required(CONF_SERVER_URL, default=DEFAULT_SERVER_URL): str}
+            ),
+            errors=errors,
+        )
+
+    async def _check_server(self, server_url: str):
+        session = async_get_clientsession(self.hass)
+        async with session.get(
+            f"{server_url}/health",
+            timeout=aiohttp.ClientTimeout(total=CHECK_TIMEOUT),
+        ) as response:
+            response.raise_for_status()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark the spectral-subtraction noise suppressor. Reports the share of
+one core a 16 kHz mono stream needs, how much a steady noise floor is
+attenuated, and the wall time to process many streams inline versus on a
+worker pool. Exits nonzero if one stream needs more than --max-cpu.
+"""
+
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.noise_suppression import SpectralSubtractor
+
+SAMPLE_RATE = 16000
+FRAME_MS = 20
+FRAME = SAMPLE_RATE * FRAME_MS // 1000
+
+
+def test_signal(seconds: int) -> np.ndarray:
+    """Two seconds of white noise, then a tone burst once a second over it"""
+    rng = np.random.default_rng(0)
+    t = np.arange(SAMPLE_RATE * seconds) / SAMPLE_RATE
+    tone = np.sin(2 * np.pi * 300 * t) * np.sin(2 * np.pi * t).clip(0) * 6000
+    tone[:2 * SAMPLE_RATE] = 0
+    noise = rng.standard_normal(t.size) * 800
+    return (tone + noise).clip(-32768, 32767).astype(np.int16)
+
+
+def cpu_share(signal: np.ndarray) -> float:
+    """CPU seconds per second of audio for one stream"""
+    suppressor = SpectralSubtractor(SAMPLE_RATE)
+    start = time.process_time()
+    for offset in range(0, signal.size, FRAME):
+        suppressor.process(signal[offset:offset + FRAME])
+    return (time.process_time() - start) / (signal.size / SAMPLE_RATE)
+
+
+def noise_reduction(signal: np.ndarray) -> float:
+    """Attenuation in dB of the noise-only second second of the signal"""
+    suppressor = SpectralSubtractor(SAMPLE_RATE)
+    output = np.concatenate([
+        suppressor.process(signal[offset:offset + FRAME]).copy()
+        for offset in range(0, signal.size, FRAME)
+    ]).astype(np.float64)
+    delay = suppressor.frame_size
+    before = signal[SAMPLE_RATE:2 * SAMPLE_RATE].astype(np.float64)
+    after = output[SAMPLE_RATE + delay:2 * SAMPLE_RATE + delay]
+    return 20 * np.log10(before.std() / after.std())
+
+
+def many_streams(signal: np.ndarray, streams: int, workers: int) -> float:
+    """Wall seconds to process one second of audio on every stream"""
+    suppressors = [SpectralSubtractor(SAMPLE_RATE) for _ in range(streams)]
+    frames = [signal[offset:offset + FRAME] for offset in range(0, SAMPLE_RATE, FRAME)]
+
+    def run(suppressor):
+        for frame in frames:
+            suppressor.process(frame)
+
+    start = time.perf_counter()
+    if workers:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(run, suppressors))
+    else:
+        for suppressor in suppressors:
+            run(suppressor)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=int, default=10,
+                        help='seconds of audio per run')
+    parser.add_argument('--streams', type=int, default=32,
+                        help='streams for the inline versus pool comparison')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='worker threads for the pool run')
+    parser.add_argument('--max-cpu', type=float, default=0.05,
+                        help='largest acceptable share of one core per stream')
+    args = parser.parse_args()
+
+    signal = test_signal(max(args.seconds, 3))
+    share = cpu_share(signal)
+
+    print('Noise Suppression Benchmark')
+    print('=' * 30)
+    print(f'CPU per 16 kHz mono stream: {share * 100:.2f}% of one core')
+    print(f'Noise floor attenuation: {noise_reduction(signal):.1f} dB')
+    inline = many_streams(signal, args.streams, 0)
+    pooled = many_streams(signal, args.streams, args.workers)
+    print(f'{args.streams} streams x 1 s: inline {inline * 1000:.1f} ms, '
+          f'{args.workers} workers {pooled * 1000:.1f} ms')
+
+    if share > args.max_cpu:
+        print(f'FAIL: above {args.max_cpu * 100:.0f}% of one core')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
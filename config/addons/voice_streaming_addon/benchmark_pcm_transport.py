@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark the audio_data WebSocket payloads: JSON sample lists versus
+binary PCM frames. Reports bytes on the wire and CPU time per second of
+audio for a few frame shapes.
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from src.pcm_frames import PcmFrameEncoder, decode_pcm_frame
+
+FRAME_MS = 20
+SHAPES = [
+    (48000, 2),  # what aiortc decodes Opus to
+    (16000, 1),  # the add-on's configured output
+]
+
+
+def json_payload(samples: np.ndarray, sample_rate: int) -> bytes:
+    return json.dumps({
+        'type': 'audio_data',
+        'connection_id': '00000000-0000-0000-0000-000000000000',
+        'data': samples.tolist(),
+        'timestamp': time.monotonic(),
+        'sample_rate': sample_rate
+    }).encode()
+
+
+def measure(mode: str, sample_rate: int, channels: int, seconds: int):
+    frames_per_second = 1000 // FRAME_MS
+    samples_per_frame = sample_rate * FRAME_MS // 1000 * channels
+    rng = np.random.default_rng(0)
+    frame = (rng.standard_normal(samples_per_frame) * 3000).astype(np.int16)
+    encoder = PcmFrameEncoder(1)
+
+    wire_bytes = 0
+    start = time.process_time()
+    for _ in range(seconds * frames_per_second):
+        if mode == 'json':
+            wire_bytes += len(json_payload(frame, sample_rate))
+        else:
+            wire_bytes += len(encoder.encode(frame, sample_rate, channels))
+    cpu = time.process_time() - start
+
+    return {
+        'mode': mode,
+        'shape': f'{sample_rate // 1000} kHz x{channels}',
+        'bytes_per_second': wire_bytes / seconds,
+        'cpu_ms_per_second': cpu * 1000 / seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=int, default=10,
+                        help='seconds of audio per run')
+    args = parser.parse_args()
+
+    # Round-trip sanity check before timing anything
+    samples = np.arange(-160, 160, dtype=np.int16)
+    header, decoded = decode_pcm_frame(PcmFrameEncoder(7).encode(samples, 16000, 1))
+    assert header.stream_id == 7 and np.array_equal(decoded, samples)
+
+    print('PCM Transport Benchmark')
+    print('=' * 30)
+    print(f"{'mode':<8} {'shape':<12} {'KiB/s':>10} {'cpu ms/s':>10}")
+    for sample_rate, channels in SHAPES:
+        for mode in ('json', 'binary'):
+            result = measure(mode, sample_rate, channels, args.seconds)
+            print(f"{result['mode']:<8} {result['shape']:<12} "
+                  f"{result['bytes_per_second'] / 1024:>10.1f} "
+                  f"{result['cpu_ms_per_second']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
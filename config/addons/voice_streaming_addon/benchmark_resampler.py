@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark and verify the streaming resampler. Each rate pair is fed in
+20 ms frames, timed for its real-time factor (CPU seconds per second of
+audio), and compared against scipy.signal.resample_poly on the whole
+signal. Exits nonzero if any pair falls below the SNR threshold.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+from scipy.signal import resample_poly
+
+from src.resampler import AudioConverter, StreamResampler
+
+FRAME_MS = 20
+RATE_PAIRS = [
+    (48000, 16000),  # aiortc output to the default audio_settings
+    (48000, 8000),
+    (44100, 16000),
+    (16000, 48000),
+]
+
+
+def quality(in_rate: int, out_rate: int, seconds: int) -> float:
+    """SNR in dB of frame-by-frame output against resample_poly"""
+    rng = np.random.default_rng(0)
+    signal = rng.standard_normal(in_rate * seconds).astype(np.float32)
+    resampler = StreamResampler(in_rate, out_rate)
+    frame = in_rate * FRAME_MS // 1000
+    output = np.concatenate([
+        resampler.process(signal[i:i + frame, None]).copy()
+        for i in range(0, signal.size, frame)
+    ])[:, 0]
+
+    reference = resample_poly(signal.astype(np.float64), resampler.up, resampler.down)
+    # The streaming output lags the zero-phase reference by the group delay
+    delay = int(round(resampler.delay))
+    output = output[delay:]
+    reference = reference[:output.size]
+    error = output - reference
+    return 10 * np.log10(np.sum(reference ** 2) / np.sum(error ** 2))
+
+
+def realtime_factor(in_rate: int, out_rate: int, seconds: int) -> float:
+    """CPU time per second of 20 ms stereo int16 frames, downmixed to mono"""
+    rng = np.random.default_rng(1)
+    frame = (rng.standard_normal(in_rate * FRAME_MS // 1000 * 2) * 3000).astype(np.int16)
+    converter = AudioConverter(in_rate, 2, out_rate, 1)
+    frames = seconds * 1000 // FRAME_MS
+
+    start = time.process_time()
+    for _ in range(frames):
+        converter.process(frame)
+    return (time.process_time() - start) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=int, default=10,
+                        help='seconds of audio per run')
+    parser.add_argument('--min-snr', type=float, default=100.0,
+                        help='minimum SNR in dB against resample_poly')
+    args = parser.parse_args()
+
+    print('Resampler Benchmark')
+    print('=' * 30)
+    print(f"{'rates':<16} {'rt factor':>10} {'snr dB':>8}")
+    failed = False
+    for in_rate, out_rate in RATE_PAIRS:
+        factor = realtime_factor(in_rate, out_rate, args.seconds)
+        snr = quality(in_rate, out_rate, min(args.seconds, 2))
+        ok = snr >= args.min_snr
+        failed |= not ok
+        print(f"{f'{in_rate} -> {out_rate}':<16} {factor:>10.5f} {snr:>8.1f}"
+              f"{'' if ok else '  FAIL'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
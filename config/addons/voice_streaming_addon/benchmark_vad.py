@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark voice activity gating on an intercom-like stream: background
+noise with short bursts of a voiced, speech-like signal. Runs the DSP
+chain with and without the vad stage and reports how many bytes are sent
+and how much CPU goes into processing and sending, plus how well the
+detected speech matches the bursts. The DSP chain itself keeps running
+in silence, since the filters and the noise estimate need the whole
+signal, so its CPU is reported apart from the sending side.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from src.dsp_chain import DspChain
+from src.frame_aggregator import FrameAggregator
+from src.pcm_frames import PcmFrameEncoder
+from src.vad import SPEECH_START
+
+SOURCE_RATE = 48000
+FRAME_MS = 20
+FRAME = SOURCE_RATE * FRAME_MS // 1000
+PROCESSING = {
+    'noise_suppression': True,
+    'auto_gain_control': True,
+}
+
+
+def intercom_signal(seconds: int, speech_share: float) -> np.ndarray:
+    """Stereo int16 noise with 1.5 s speech-like bursts; returns (samples, truth per frame)"""
+    rng = np.random.default_rng(0)
+    t = np.arange(SOURCE_RATE * seconds) / SOURCE_RATE
+    pitch = 140 + 20 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / SOURCE_RATE
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 15))
+    syllables = 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)
+
+    period = 1.5 / speech_share
+    active = (t % period) >= period - 1.5
+    mono = voiced * syllables * active * 4000 + rng.standard_normal(t.size) * 300
+    samples = np.repeat(mono.clip(-32767, 32767).astype(np.int16), 2)
+    return samples, active[::FRAME]
+
+
+def run(samples: np.ndarray, vad: bool):
+    chain = DspChain(SOURCE_RATE, 2, 16000, 1, dict(PROCESSING, vad=vad))
+    aggregator = FrameAggregator(16000, 1)
+    encoder = PcmFrameEncoder(1)
+    sent = 0
+    decisions = []
+    dsp = 0.0
+
+    start = time.process_time()
+    for offset in range(0, samples.size, FRAME * 2):
+        before = time.process_time()
+        block = chain.process(samples[offset:offset + FRAME * 2])
+        dsp += time.process_time() - before
+        stage = chain.stage('vad')
+        if stage:
+            decisions.append(stage.speaking)
+            if stage.event == SPEECH_START:
+                for earlier in chain.recent():
+                    for window, _ in aggregator.add(earlier):
+                        sent += len(encoder.encode(window, 16000, 1))
+            if not stage.speaking:
+                continue
+        for window, _ in aggregator.add(block):
+            sent += len(encoder.encode(window, 16000, 1))
+    downstream = time.process_time() - start - dsp
+    return sent, dsp, downstream, np.array(decisions, dtype=bool)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=int, default=60,
+                        help='seconds of audio per run')
+    parser.add_argument('--speech-share', type=float, default=0.1,
+                        help='fraction of the stream that is speech')
+    args = parser.parse_args()
+
+    samples, truth = intercom_signal(args.seconds, args.speech_share)
+
+    print('VAD Gating Benchmark')
+    print('=' * 30)
+    print(f"{'mode':<8} {'KiB/s':>8} {'dsp ms/s':>10} {'send ms/s':>10}")
+    for vad in (False, True):
+        sent, dsp, downstream, decisions = run(samples, vad)
+        print(f"{'vad' if vad else 'ungated':<8} {sent / 1024 / args.seconds:>8.1f} "
+              f"{dsp * 1000 / args.seconds:>10.2f} {downstream * 1000 / args.seconds:>10.2f}")
+
+    truth = truth[:decisions.size]
+    missed = np.sum(truth & ~decisions) / max(truth.sum(), 1)
+    extra = np.sum(~truth & decisions) / max((~truth).sum(), 1)
+    print(f'Speech frames missed: {missed * 100:.1f}%, '
+          f'silence frames sent: {extra * 100:.1f}% (hangover included)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""Per-stream DSP pipeline built from the add-on's processing options.
+
+A chain is built once per connection. Every decoded frame is downmixed
+and resampled into the next slot of a preallocated float32 ring, each
+stage then works on that slot in place, and the result is written as
+int16 into the matching slot of an output ring. Blocks handed out stay
+valid for the next `slots - 1` frames, so the aggregator can hold on to
+them without copying while the following frames are processed, inline
+or on the optional worker pool (processing.worker_threads).
+
+Stages are looked up by name in a registry, so new processing can be
+added from any module:
+
+    @register_stage('my_stage')
+    class MyStage(DspStage):
+        def process(self, block):
+            block *= 0.5
+
+and enabled by listing it in processing.chain.
+"""
+import math
+import time
+from typing import Dict, List, Type
+
+import numpy as np
+from scipy.signal import butter, sosfilt
+
+from .noise_suppression import SpectralSubtractor
+from .resampler import AudioConverter
+from .vad import DEFAULT_HANGOVER_MS, DEFAULT_PREROLL_MS, VoiceActivityDetector
+
+DEFAULT_SLOTS = 8
+FULL_SCALE = 32768.0
+
+STAGES: Dict[str, Type['DspStage']] = {}
+
+
+def register_stage(name: str):
+    """Class decorator adding a stage to the registry under `name`"""
+    def decorator(cls):
+        cls.name = name
+        STAGES[name] = cls
+        return cls
+    return decorator
+
+
+class DspStage:
+    """One processing step; `process` modifies a float32 (n, channels) block in place.
+
+    Samples keep the int16 scale (full scale is +/-32768) so stages can be
+    reordered freely.
+    """
+    name = ''
+
+    def __init__(self, sample_rate: int, channels: int, options: dict):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.options = options
+
+    def process(self, block: np.ndarray):
+        raise NotImplementedError
+
+
+@register_stage('high_pass')
+class HighPassStage(DspStage):
+    """Removes DC offset and low-frequency rumble below processing.high_pass_hz"""
+
+    def __init__(self, sample_rate: int, channels: int, options: dict):
+        super().__init__(sample_rate, channels, options)
+        cutoff = options.get('high_pass_hz', 80)
+        self._sos = butter(2, cutoff, btype='highpass', fs=sample_rate, output='sos')
+        # Filter state per section and channel, carried across blocks
+        self._zi = np.zeros((self._sos.shape[0], 2, channels))
+
+    def process(self, block: np.ndarray):
+        filtered, self._zi = sosfilt(self._sos, block, axis=0, zi=self._zi)
+        block[:] = filtered
+
+
+@register_stage('noise_suppression')
+class NoiseSuppressionStage(DspStage):
+    """Spectral subtraction, see noise_suppression.py"""
+
+    def __init__(self, sample_rate: int, channels: int, options: dict):
+        super().__init__(sample_rate, channels, options)
+        self.suppressor = SpectralSubtractor(sample_rate, channels)
+
+    def process(self, block: np.ndarray):
+        self.suppressor.process_inplace(block)
+
+
+@register_stage('vad')
+class VadStage(DspStage):
+    """Marks speech; `event` is SPEECH_START or SPEECH_END on a transition block"""
+
+    def __init__(self, sample_rate: int, channels: int, options: dict):
+        super().__init__(sample_rate, channels, options)
+        self.detector = VoiceActivityDetector(
+            sample_rate, channels, options.get('vad_hangover_ms', DEFAULT_HANGOVER_MS))
+        self.event = None
+
+    @property
+    def speaking(self) -> bool:
+        return self.detector.speaking
+
+    def process(self, block: np.ndarray):
+        self.event = self.detector.update(block)
+
+
+@register_stage('auto_gain_control')
+class AutoGainStage(DspStage):
+    """Pulls the block level towards a target RMS with a smoothed, capped gain"""
+
+    def __init__(self, sample_rate: int, channels: int, options: dict):
+        super().__init__(sample_rate, channels, options)
+        self.target = FULL_SCALE * 10 ** (options.get('agc_target_dbfs', -20) / 20)
+        self.max_gain = 10 ** (options.get('agc_max_gain_db', 30) / 20)
+        # Levels below this are treated as silence and leave the gain alone
+        self.noise_gate = FULL_SCALE * 10 ** (-60 / 20)
+        self.gain = 1.0
+        self._attack = options.get('agc_attack_ms', 10) / 1000
+        self._release = options.get('agc_release_ms', 500) / 1000
+        self._steps = np.zeros(0, dtype=np.float32)
+        self._ramp = np.zeros(0, dtype=np.float32)
+
+    def process(self, block: np.ndarray):
+        count = block.shape[0]
+        if not count:
+            return
+        rms = math.sqrt(float(np.vdot(block, block)) / block.size)
+        start = self.gain
+        if rms > self.noise_gate:
+            desired = min(self.target / rms, self.max_gain)
+            # Turn down quickly on loud input, back up slowly
+            time_constant = self._attack if desired < start else self._release
+            alpha = 1 - math.exp(-count / (self.sample_rate * time_constant))
+            self.gain = start + alpha * (desired - start)
+
+        # Ramp across the block so gain changes do not click
+        if self._ramp.shape[0] < count:
+            self._steps = np.arange(1, count + 1, dtype=np.float32)
+            self._ramp = np.empty(count, dtype=np.float32)
+        ramp = self._ramp[:count]
+        np.multiply(self._steps[:count], (self.gain - start) / count, out=ramp)
+        ramp += start
+        block *= ramp[:, None]
+
+
+@register_stage('level_meter')
+class LevelMeterStage(DspStage):
+    """Records peak and RMS level in dBFS of the latest block"""
+
+    def __init__(self, sample_rate: int, channels: int, options: dict):
+        super().__init__(sample_rate, channels, options)
+        self.peak_dbfs = -math.inf
+        self.rms_dbfs = -math.inf
+
+    def process(self, block: np.ndarray):
+        if not block.size:
+            return
+        peak = max(float(block.max()), -float(block.min()))
+        rms = math.sqrt(float(np.vdot(block, block)) / block.size)
+        self.peak_dbfs = 20 * math.log10(peak / FULL_SCALE) if peak else -math.inf
+        self.rms_dbfs = 20 * math.log10(rms / FULL_SCALE) if rms else -math.inf
+
+
+def stage_names(processing: dict) -> List[str]:
+    """Stage order for the processing options; processing.chain overrides it"""
+    if processing.get('chain'):
+        return list(processing['chain'])
+    names = []
+    if processing.get('high_pass', True):
+        names.append('high_pass')
+    if processing.get('vad'):
+        # Ahead of noise suppression, whose residual is no longer flat, and
+        # of AGC, which would lift the noise floor it measures against
+        names.append('vad')
+    if processing.get('noise_suppression'):
+        names.append('noise_suppression')
+    if processing.get('auto_gain_control'):
+        names.append('auto_gain_control')
+    names.append('level_meter')
+    return names
+
+
+class DspChain:
+    """Resampler plus an ordered list of in-place stages for one stream"""
+
+    def __init__(self, in_rate: int, in_channels: int, out_rate: int, out_channels: int,
+                 processing: dict, slots: int = DEFAULT_SLOTS):
+        self.converter = AudioConverter(in_rate, in_channels, out_rate, out_channels)
+        self.sample_rate = out_rate
+        self.channels = self.converter.out_channels
+        names = stage_names(processing)
+        unknown = [name for name in names if name not in STAGES]
+        if unknown:
+            raise ValueError(f"Unknown DSP stages {unknown}, registered: {sorted(STAGES)}")
+        self.stages = [STAGES[name](self.sample_rate, self.channels, processing)
+                       for name in names]
+        self.slots = slots
+        # Audio kept in the ring for pre-roll when speech starts
+        self.preroll_ms = processing.get('vad_preroll_ms', DEFAULT_PREROLL_MS)
+        self._slot = 0
+        self._ring = np.zeros((slots, 0, self.channels), dtype=np.float32)
+        self._pcm_ring = np.zeros((slots, 0), dtype=np.int16)
+        self._lengths = [0] * slots
+
+        # Cumulative time and calls per stage, resampling included
+        self.timings: Dict[str, float] = {'resample': 0.0}
+        self.timings.update((stage.name, 0.0) for stage in self.stages)
+        self.blocks = 0
+
+    def stage(self, name: str):
+        return next((stage for stage in self.stages if stage.name == name), None)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Run one decoded frame through the chain, returning interleaved int16"""
+        timings = self.timings
+        started = time.perf_counter()
+        converted = self.converter.process_float(samples)
+        count = converted.shape[0]
+        if self._ring.shape[1] < count:
+            # First frame, or a longer one than before: size every slot for
+            # it with headroom for the resampler's one-sample jitter
+            size = count + count // 4
+            block_ms = count * 1000 / self.sample_rate
+            self.slots = max(self.slots, math.ceil(self.preroll_ms / block_ms) + 2)
+            self._lengths = [0] * self.slots
+            self._ring = np.zeros((self.slots, size, self.channels), dtype=np.float32)
+            self._pcm_ring = np.zeros((self.slots, size * self.channels), dtype=np.int16)
+        slot = self._slot
+        self._slot = (slot + 1) % self.slots
+        block = self._ring[slot, :count]
+        block[:] = converted
+        now = time.perf_counter()
+        timings['resample'] += now - started
+
+        for stage in self.stages:
+            stage.process(block)
+            finished = time.perf_counter()
+            timings[stage.name] += finished - now
+            now = finished
+
+        flat = block.reshape(-1)
+        np.rint(flat, out=flat)
+        np.clip(flat, -32768, 32767, out=flat)
+        pcm = self._pcm_ring[slot, :flat.size]
+        pcm[:] = flat
+        self._lengths[slot] = flat.size
+        self.blocks += 1
+        return pcm
+
+    def recent(self, duration_ms: int = None) -> List[np.ndarray]:
+        """Blocks processed before the latest one, oldest first.
+
+        Covers up to `duration_ms` (the pre-roll by default) and no more
+        than the ring holds, e.g. to send the audio leading up to speech.
+        """
+        if duration_ms is None:
+            duration_ms = self.preroll_ms
+        wanted = duration_ms * self.sample_rate * self.channels // 1000
+        blocks = []
+        slot = (self._slot - 1) % self.slots
+        for _ in range(min(self.blocks - 1, self.slots - 1)):
+            slot = (slot - 1) % self.slots
+            if wanted <= 0:
+                break
+            blocks.append(self._pcm_ring[slot, :self._lengths[slot]])
+            wanted -= self._lengths[slot]
+        blocks.reverse()
+        return blocks
+
+    def stats(self) -> Dict[str, dict]:
+        """Per-stage totals and mean time per block in microseconds"""
+        blocks = max(self.blocks, 1)
+        return {
+            name: {'total_ms': total * 1000, 'mean_us': total * 1e6 / blocks}
+            for name, total in self.timings.items()
+        }
@@ -0,0 +1,72 @@
+"""Collects decoded audio frames into fixed-length windows.
+
+aiortc hands out one 20 ms frame per recv(). Sending each of them is a
+WebSocket message and an event-loop round trip per frame per stream, so
+frames are copied into a preallocated window buffer and emitted once per
+window. When frames stop arriving (silence, DTX, end of stream) a latency
+cap flushes the partial window, so no sample waits longer than one window
+plus the cap.
+"""
+import time
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_WINDOW_MS = 20
+DEFAULT_MAX_LATENCY_MS = 100
+
+
+class FrameAggregator:
+    """Preallocated window buffer for one stream's interleaved int16 samples.
+
+    add() and flush() yield (block, timestamp) pairs where block is a view
+    into the window buffer: it is only valid until the generator resumes.
+    """
+
+    def __init__(self, sample_rate: int, channels: int,
+                 window_ms: int = DEFAULT_WINDOW_MS,
+                 max_latency_ms: int = DEFAULT_MAX_LATENCY_MS):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.window_ms = window_ms
+        # Longest gap between frames before a partial window is flushed
+        self.max_latency = max_latency_ms / 1000
+        self.window_size = max(1, sample_rate * window_ms // 1000) * channels
+        self._buffer = np.empty(self.window_size, dtype=np.int16)
+        self._fill = 0
+        self._window_timestamp: Optional[float] = None
+        self._last_arrival = time.monotonic()
+
+    def add(self, samples: np.ndarray,
+            timestamp: float = None) -> Iterator[Tuple[np.ndarray, float]]:
+        """Append a frame, yielding every window it completes"""
+        if timestamp is None:
+            timestamp = time.time()
+
+        samples = samples.reshape(-1)
+        self._last_arrival = time.monotonic()
+        offset = 0
+        while offset < samples.size:
+            if self._fill == 0:
+                frame_offset = offset // self.channels
+                self._window_timestamp = timestamp + frame_offset / self.sample_rate
+
+            count = min(self.window_size - self._fill, samples.size - offset)
+            self._buffer[self._fill:self._fill + count] = samples[offset:offset + count]
+            self._fill += count
+            offset += count
+
+            if self._fill == self.window_size:
+                yield from self.flush()
+
+    def flush(self) -> Iterator[Tuple[np.ndarray, float]]:
+        """Emit whatever is buffered, e.g. on the latency cap or end of stream"""
+        if self._fill:
+            fill, self._fill = self._fill, 0
+            yield self._buffer[:fill], self._window_timestamp
+
+    def time_to_deadline(self) -> Optional[float]:
+        """Seconds until the partial window must be flushed, None if empty"""
+        if not self._fill:
+            return None
+        return max(0.0, self._last_arrival + self.max_latency - time.monotonic())
@@ -0,0 +1,187 @@
+"""Streaming spectral-subtraction noise suppression.
+
+Audio is analysed in frames of 2 * hop samples with a square-root Hann
+window at 50% overlap, so analysis and synthesis windows together sum to
+one and the untouched signal is reconstructed exactly. Each bin's noise
+power is tracked per stream from a smoothed periodogram: bins within a
+few times the current floor are treated as noise and followed quickly,
+louder bins (speech) only pull the floor up slowly, so words do not leak
+into the estimate while a lasting change in background noise still does. The gain subtracts an over-estimate of that noise floor and
+never drops below a floor, which keeps residual "musical" noise low.
+
+All frames completed by one block are transformed in a single batched
+FFT. Only the noise update runs per frame, and it is vectorized over bins
+and channels. Output lags input by one frame (20 ms by default).
+"""
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+DEFAULT_FRAME_MS = 20
+DEFAULT_OVER_SUBTRACTION = 2.0
+DEFAULT_GAIN_FLOOR = 0.1  # -20 dB
+# Noise floor tracking: periodogram smoothing per hop, the power ratio
+# above the floor that counts as speech, and the two time constants
+POWER_SMOOTHING = 0.7
+SPEECH_THRESHOLD = 3.0
+NOISE_TRACK_MS = 100
+NOISE_RISE_MS = 2000
+
+
+class SpectralSubtractor:
+    """Noise suppressor for one stream of interleaved int16 samples"""
+
+    def __init__(self, sample_rate: int, channels: int = 1,
+                 frame_ms: int = DEFAULT_FRAME_MS,
+                 over_subtraction: float = DEFAULT_OVER_SUBTRACTION,
+                 gain_floor: float = DEFAULT_GAIN_FLOOR):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.hop = max(1, sample_rate * frame_ms // 2000)
+        self.frame_size = 2 * self.hop
+        self.over_subtraction = over_subtraction
+        self.gain_floor_squared = gain_floor ** 2
+
+        hop_seconds = self.hop / sample_rate
+        self._track = 1 - math.exp(-hop_seconds * 1000 / NOISE_TRACK_MS)
+        self._rise = 1 - math.exp(-hop_seconds * 1000 / NOISE_RISE_MS)
+
+        periodic_hann = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(self.frame_size) / self.frame_size)
+        self._window = np.sqrt(periodic_hann).astype(np.float32)
+        bins = self.hop + 1
+        self._noise = np.zeros((channels, bins), dtype=np.float32)
+        self._smoothed = np.zeros((channels, bins), dtype=np.float32)
+        self._primed = False
+
+        # Input: the previous hop of history followed by unprocessed samples
+        self._input = np.zeros((self.hop, channels), dtype=np.float32)
+        self._input_fill = self.hop
+        # Second half of the last synthesized frame, waiting for its overlap
+        self._tail = np.zeros((channels, self.hop), dtype=np.float32)
+        # Finished output, seeded with one hop of silence so every call can
+        # return as many samples as it was given
+        self._output = np.zeros((2 * self.hop, channels), dtype=np.float32)
+        self._output_fill = self.hop
+        self._returned = 0
+        self._pcm = np.zeros(0, dtype=np.int16)
+        self._noise_frames = np.zeros((0, channels, bins), dtype=np.float32)
+        self._delta = np.zeros((channels, bins), dtype=np.float32)
+        self._rate = np.zeros((channels, bins), dtype=np.float32)
+        self._is_noise = np.zeros((channels, bins), dtype=bool)
+
+    @property
+    def latency(self) -> float:
+        """Delay added to the signal, in seconds"""
+        return self.frame_size / self.sample_rate
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Suppress noise in an int16 block; the result is a view valid until the next call"""
+        output = self._run(samples.reshape(-1, self.channels)).reshape(-1)
+        if self._pcm.shape[0] < output.size:
+            self._pcm = np.empty(output.size, dtype=np.int16)
+        pcm = self._pcm[:output.size]
+        np.rint(output, out=output)
+        np.clip(output, -32768, 32767, out=output)
+        pcm[:] = output
+        return pcm
+
+    def process_inplace(self, block: np.ndarray):
+        """Suppress noise in a float32 (n, channels) block, overwriting it"""
+        block[:] = self._run(block)
+
+    def _run(self, frames: np.ndarray) -> np.ndarray:
+        count = frames.shape[0]
+
+        # Drop the output handed out by the previous call
+        if self._returned:
+            remaining = self._output_fill - self._returned
+            self._output[:remaining] = self._output[self._returned:self._output_fill]
+            self._output_fill = remaining
+
+        needed = self._input_fill + count
+        if self._input.shape[0] < needed:
+            grown = np.zeros((needed, self.channels), dtype=np.float32)
+            grown[:self._input_fill] = self._input[:self._input_fill]
+            self._input = grown
+        self._input[self._input_fill:needed] = frames
+        self._input_fill = needed
+
+        completed = (self._input_fill - self.hop) // self.hop
+        if completed:
+            self._append_output(self._process_frames(completed))
+
+        # Keep the last hop of consumed input plus anything not yet framed
+        consumed = completed * self.hop
+        remaining = self._input_fill - consumed
+        self._input[:remaining] = self._input[consumed:self._input_fill]
+        self._input_fill = remaining
+
+        self._returned = count
+        return self._output[:count]
+
+    def _process_frames(self, completed: int) -> np.ndarray:
+        # (completed, channels, frame_size) views over the input, one per hop
+        span = self._input[:self.hop * (completed + 1)]
+        frames = sliding_window_view(span, self.frame_size, axis=0)[::self.hop]
+        spectrum = np.fft.rfft(frames * self._window, axis=-1)
+
+        power = spectrum.real ** 2
+        power += spectrum.imag ** 2
+        noise = self._track_noise(power)
+
+        # Power-domain subtraction, applied as a magnitude gain
+        np.divide(noise, np.maximum(power, 1e-12), out=noise)
+        np.multiply(noise, -self.over_subtraction, out=noise)
+        noise += 1
+        np.maximum(noise, self.gain_floor_squared, out=noise)
+        np.sqrt(noise, out=noise)
+        spectrum *= noise
+
+        synthesized = np.fft.irfft(spectrum, n=self.frame_size, axis=-1).astype(np.float32)
+        synthesized *= self._window
+
+        # 50% overlap-add: each output hop is this frame's first half plus
+        # the previous frame's second half
+        first = synthesized[..., :self.hop]
+        second = synthesized[..., self.hop:]
+        first[0] += self._tail
+        first[1:] += second[:-1]
+        self._tail[:] = second[-1]
+        return first
+
+    def _track_noise(self, power: np.ndarray) -> np.ndarray:
+        """Noise floor for each frame, advancing the running estimate"""
+        if self._noise_frames.shape[0] < power.shape[0]:
+            self._noise_frames = np.empty(power.shape, dtype=np.float32)
+        estimates = self._noise_frames[:power.shape[0]]
+
+        noise, smoothed = self._noise, self._smoothed
+        delta, rate, is_noise = self._delta, self._rate, self._is_noise
+        if not self._primed:
+            noise[:] = power[0]
+            smoothed[:] = power[0]
+            self._primed = True
+        for index, frame_power in enumerate(power):
+            smoothed *= POWER_SMOOTHING
+            smoothed += (1 - POWER_SMOOTHING) * frame_power
+            np.subtract(smoothed, noise, out=delta)
+            np.multiply(noise, SPEECH_THRESHOLD, out=rate)
+            np.less(smoothed, rate, out=is_noise)
+            np.multiply(is_noise, self._track - self._rise, out=rate)
+            rate += self._rise
+            delta *= rate
+            noise += delta
+            estimates[index] = noise
+        return estimates
+
+    def _append_output(self, hops: np.ndarray):
+        # hops is (completed, channels, hop); output is (samples, channels)
+        block = hops.transpose(0, 2, 1).reshape(-1, self.channels)
+        needed = self._output_fill + block.shape[0]
+        if self._output.shape[0] < needed:
+            grown = np.zeros((needed, self.channels), dtype=np.float32)
+            grown[:self._output_fill] = self._output[:self._output_fill]
+            self._output = grown
+        self._output[self._output_fill:needed] = block
+        self._output_fill = needed
@@ -0,0 +1,68 @@
+"""Binary WebSocket framing for decoded PCM audio.
+
+Each message is a fixed 24-byte little-endian header followed by the raw
+int16 samples (interleaved when there is more than one channel):
+
+    offset  size  field
+    0       2     magic, b'VS'
+    2       1     format version
+    3       1     channel count
+    4       4     stream id (uint32, announced in 'stream_ready')
+    8       4     sequence number (uint32, wraps)
+    12      8     capture timestamp, microseconds since the Unix epoch
+    20      4     sample rate in Hz
+"""
+import struct
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+MAGIC = b'VS'
+VERSION = 1
+HEADER = struct.Struct('<2sBBIIQI')
+SAMPLE_DTYPE = np.dtype('<i2')
+
+
+class PcmFrameHeader(NamedTuple):
+    version: int
+    channels: int
+    stream_id: int
+    sequence: int
+    timestamp_us: int
+    sample_rate: int
+
+
+class PcmFrameEncoder:
+    """Packs PCM blocks for one stream into binary WebSocket messages"""
+
+    def __init__(self, stream_id: int):
+        self.stream_id = stream_id
+        self.sequence = 0
+
+    def encode(self, samples: np.ndarray, sample_rate: int, channels: int,
+               timestamp: float = None) -> memoryview:
+        """Build one message; the samples are copied exactly once, into place"""
+        if timestamp is None:
+            timestamp = time.time()
+
+        count = samples.size
+        message = bytearray(HEADER.size + count * SAMPLE_DTYPE.itemsize)
+        HEADER.pack_into(message, 0, MAGIC, VERSION, channels, self.stream_id,
+                         self.sequence, int(timestamp * 1_000_000), sample_rate)
+        payload = np.frombuffer(message, dtype=SAMPLE_DTYPE, count=count,
+                                offset=HEADER.size)
+        np.copyto(payload, samples.reshape(-1), casting='unsafe')
+
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        return memoryview(message)
+
+
+def decode_pcm_frame(message) -> tuple:
+    """Split a binary message into its header and a zero-copy sample view"""
+    magic, *fields = HEADER.unpack_from(message, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a PCM frame')
+    header = PcmFrameHeader(*fields)
+    samples = np.frombuffer(message, dtype=SAMPLE_DTYPE, offset=HEADER.size)
+    return header, samples
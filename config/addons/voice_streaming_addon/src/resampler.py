@@ -0,0 +1,152 @@
+"""Streaming polyphase resampler and downmixer for decoded audio.
+
+aiortc decodes Opus to 48 kHz stereo, while the add-on's consumers want
+audio_settings.sample_rate (16 kHz mono by default). The resampler keeps the
+last taps of input between calls, so consecutive frames are filtered as one
+continuous signal, and evaluates only the polyphase branches that produce
+output samples. Every branch is a strided view of the input, so one block
+costs a handful of matrix-vector products and no per-sample Python work.
+
+The anti-aliasing filter is the one scipy.signal.resample_poly designs by
+default (Kaiser window, beta 5, 10 zero crossings per side of the wider
+rate), so its output matches resample_poly delayed by the filter's group
+delay.
+"""
+from functools import lru_cache
+from math import gcd
+from typing import Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+KAISER_BETA = 5.0
+HALF_LENGTH_FACTOR = 10
+
+
+@lru_cache(maxsize=None)
+def polyphase_filter(in_rate: int, out_rate: int) -> Tuple[int, int, np.ndarray]:
+    """Return (up, down, branches) for a rate pair, designed once and cached.
+
+    branches[p] holds the taps of polyphase branch p in reverse order, so a
+    window of input samples ending at the current sample can be multiplied
+    by it directly.
+    """
+    divisor = gcd(in_rate, out_rate)
+    up, down = out_rate // divisor, in_rate // divisor
+    max_rate = max(up, down)
+
+    # Windowed-sinc lowpass at the narrower Nyquist, gain `up` for the zeros
+    # inserted by upsampling (equivalent to firwin(..., scale=True) * up)
+    length = 2 * HALF_LENGTH_FACTOR * max_rate + 1
+    n = np.arange(length) - (length - 1) / 2
+    taps = np.sinc(n / max_rate) * np.kaiser(length, KAISER_BETA)
+    taps *= up / taps.sum()
+
+    taps_per_branch = -(-length // up)
+    padded = np.zeros(taps_per_branch * up)
+    padded[:length] = taps
+    branches = padded.reshape(taps_per_branch, up).T[:, ::-1].astype(np.float32)
+    branches.setflags(write=False)
+    return up, down, branches
+
+
+class StreamResampler:
+    """Stateful resampler for one stream of float32 samples shaped (n, channels)"""
+
+    def __init__(self, in_rate: int, out_rate: int, channels: int = 1):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.channels = channels
+        self.up, self.down, self._branches = polyphase_filter(in_rate, out_rate)
+        self.taps = self._branches.shape[1]
+        # Position of the next output sample on the upsampled time axis,
+        # relative to the first sample of the next input block
+        self._phase = 0
+        self._history = self.taps - 1
+        self._input = np.zeros((self._history, channels), dtype=np.float32)
+        self._output = np.zeros((0, channels), dtype=np.float32)
+
+    @property
+    def delay(self) -> float:
+        """Group delay in output samples"""
+        return HALF_LENGTH_FACTOR * max(self.up, self.down) / self.down
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Resample a block; the result is a view valid until the next call"""
+        count = samples.shape[0]
+        if count == 0:
+            return self._output[:0]
+        history = self._history
+        if self._input.shape[0] < history + count:
+            grown = np.zeros((history + count, self.channels), dtype=np.float32)
+            grown[:history] = self._input[:history]
+            self._input = grown
+        buffer = self._input[:history + count]
+        buffer[history:] = samples
+
+        # Outputs whose newest input sample falls inside this block
+        outputs = max(0, -(-(self.up * count - self._phase) // self.down))
+        if self._output.shape[0] < outputs:
+            self._output = np.empty((outputs, self.channels), dtype=np.float32)
+        result = self._output[:outputs]
+
+        # windows[i, c] are the `taps` input samples ending at block sample i
+        windows = sliding_window_view(buffer, self.taps, axis=0)
+        for first in range(min(self.up, outputs)):
+            position = self._phase + first * self.down
+            branch = self._branches[position % self.up]
+            start = position // self.up
+            step = self.down
+            rows = windows[start::step][:len(range(first, outputs, self.up))]
+            np.matmul(rows, branch, out=result[first::self.up])
+
+        self._phase += outputs * self.down - self.up * count
+        # Keep the last taps - 1 samples at the front for the next block
+        buffer[:history] = buffer[count:]
+        return result
+
+
+class AudioConverter:
+    """Downmixes and resamples interleaved int16 frames to the configured format"""
+
+    def __init__(self, in_rate: int, in_channels: int, out_rate: int, out_channels: int):
+        self.in_rate = in_rate
+        self.in_channels = in_channels
+        self.out_rate = out_rate
+        self.out_channels = out_channels if out_channels in (1, in_channels) else 1
+        self.passthrough = in_rate == out_rate and self.out_channels == in_channels
+        self._resampler = StreamResampler(in_rate, out_rate, self.out_channels)
+        self._mono = np.zeros((0, 1), dtype=np.float32)
+        self._pcm = np.zeros(0, dtype=np.int16)
+
+    def process_float(self, samples: np.ndarray) -> np.ndarray:
+        """Interleaved int16 in, (n, out_channels) out, as a reused view.
+
+        The result is float32, or the input itself when no conversion is needed.
+        """
+        frames = samples.reshape(-1, self.in_channels)
+        if self.passthrough:
+            return frames
+        if self.out_channels == 1 and self.in_channels > 1:
+            if self._mono.shape[0] < frames.shape[0]:
+                self._mono = np.empty((frames.shape[0], 1), dtype=np.float32)
+            mixed = self._mono[:frames.shape[0]]
+            np.mean(frames, axis=1, dtype=np.float32, out=mixed[:, 0])
+            frames = mixed
+        return self._resampler.process(frames)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Interleaved int16 in, interleaved int16 out at the target format"""
+        if self.passthrough:
+            return samples.reshape(-1)
+
+        converted = self.process_float(samples)
+        size = converted.size
+        if self._pcm.shape[0] < size:
+            self._pcm = np.empty(size, dtype=np.int16)
+        pcm = self._pcm[:size]
+        flat = converted.reshape(-1)
+        np.rint(flat, out=flat)
+        np.clip(flat, -32768, 32767, out=flat)
+        pcm[:] = flat
+        return pcm
@@ -0,0 +1,110 @@
+"""Lightweight voice activity detection on processed audio blocks.
+
+A block counts as speech when its energy is well above a running noise
+floor and its spectrum is not flat: broadband noise has a spectral
+flatness near 0.56, while voiced speech concentrates its energy in a few
+harmonics. A hangover keeps the detector in speech for a while after the
+last speech block, so short pauses between words do not split a segment.
+"""
+import math
+from typing import Optional
+
+import numpy as np
+
+FULL_SCALE = 32768.0
+DEFAULT_HANGOVER_MS = 300
+DEFAULT_PREROLL_MS = 100
+DEFAULT_MARGIN_DB = 9.0
+DEFAULT_MIN_DBFS = -55.0
+DEFAULT_MAX_FLATNESS = 0.45
+# Band the flatness is measured over, where voiced speech has its harmonics
+SPEECH_BAND_HZ = (200, 4000)
+# How fast the noise floor drifts up outside and during speech
+NOISE_RISE_MS = 1000
+SPEECH_NOISE_RISE_MS = 15000
+
+SPEECH_START = 'speech_start'
+SPEECH_END = 'speech_end'
+
+
+class VoiceActivityDetector:
+    """Per-stream speech/silence decision for float32 (n, channels) blocks"""
+
+    def __init__(self, sample_rate: int, channels: int = 1,
+                 hangover_ms: int = DEFAULT_HANGOVER_MS,
+                 margin_db: float = DEFAULT_MARGIN_DB,
+                 min_dbfs: float = DEFAULT_MIN_DBFS,
+                 max_flatness: float = DEFAULT_MAX_FLATNESS):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.hangover = sample_rate * hangover_ms // 1000
+        self.margin_db = margin_db
+        self.min_dbfs = min_dbfs
+        self.max_flatness = max_flatness
+
+        self.speaking = False
+        self.level_dbfs = -math.inf
+        self.flatness = 1.0
+        self.noise_dbfs: Optional[float] = None
+        self._remaining = 0
+        self._window = np.zeros(0, dtype=np.float32)
+        self._mono = np.zeros(0, dtype=np.float32)
+
+    def update(self, block: np.ndarray) -> Optional[str]:
+        """Classify a block; returns SPEECH_START, SPEECH_END or None"""
+        count = block.shape[0]
+        if not count:
+            return None
+        if self._window.shape[0] != count:
+            self._window = np.hanning(count).astype(np.float32)
+            self._mono = np.empty(count, dtype=np.float32)
+
+        mono = self._mono
+        if self.channels == 1:
+            mono[:] = block[:, 0]
+        else:
+            np.mean(block, axis=1, out=mono)
+
+        energy = float(np.vdot(mono, mono)) / count
+        self.level_dbfs = 10 * math.log10(energy / FULL_SCALE ** 2 + 1e-12)
+        self.flatness = self._spectral_flatness(mono)
+        if self.noise_dbfs is None:
+            self.noise_dbfs = self.level_dbfs
+
+        is_speech = (self.level_dbfs > max(self.noise_dbfs + self.margin_db, self.min_dbfs)
+                     and self.flatness < self.max_flatness)
+        self._track_noise(count, is_speech)
+        if is_speech:
+            self._remaining = self.hangover
+        else:
+            self._remaining = max(0, self._remaining - count)
+
+        was_speaking = self.speaking
+        self.speaking = is_speech or self._remaining > 0
+        if self.speaking and not was_speaking:
+            return SPEECH_START
+        if was_speaking and not self.speaking:
+            return SPEECH_END
+        return None
+
+    def _spectral_flatness(self, mono: np.ndarray) -> float:
+        """Geometric over arithmetic mean of the speech-band power spectrum"""
+        mono *= self._window
+        power = np.abs(np.fft.rfft(mono)) ** 2
+        low, high = (int(hz * mono.size / self.sample_rate) for hz in SPEECH_BAND_HZ)
+        band = power[max(low, 1):high + 1]
+        if not band.size:
+            return 1.0
+        band += 1e-9
+        return float(np.exp(np.mean(np.log(band))) / np.mean(band))
+
+    def _track_noise(self, count: int, is_speech: bool):
+        # Follow quiet blocks down immediately and drift up otherwise, much
+        # more slowly during speech, so a lasting change in background level
+        # is still picked up
+        if self.level_dbfs < self.noise_dbfs:
+            self.noise_dbfs = self.level_dbfs
+        else:
+            rise_ms = SPEECH_NOISE_RISE_MS if is_speech else NOISE_RISE_MS
+            rise = 1 - math.exp(-count * 1000 / (self.sample_rate * rise_ms))
+            self.noise_dbfs += rise * (self.level_dbfs - self.noise_dbfs)
@@ -1,16 +1,28 @@
 import asyncio
 import json
 import logging
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Optional, Set
 from aiohttp import web, WSMsgType
 from aiohttp.web_ws import WebSocketResponse
-from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack
-from aiortc.contrib.media import MediaRecorder
+from aiortc import (RTCConfiguration, RTCIceServer, RTCPeerConnection,
+                    RTCSessionDescription, MediaStreamTrack)
+from aiortc.mediastreams import MediaStreamError
 import numpy as np
 from scipy.io import wavfile
 import pyaudio
 
+from .dsp_chain import DspChain
+from .frame_aggregator import (DEFAULT_MAX_LATENCY_MS, DEFAULT_WINDOW_MS,
+                               FrameAggregator)
+from .opus_profiles import apply_profile, check_profile
+from .pcm_frames import PcmFrameEncoder
+from .recording import Recorder
+from .recordings_api import RecordingsApi
+from .vad import SPEECH_END, SPEECH_START
+
 logger = logging.getLogger(__name__)
 
 class AudioStreamTrack(MediaStreamTrack):
@@ -31,7 +43,22 @@ class VoiceStreamingServer:
     def __init__(self, config: dict):
         self.config = config
         self.connections: Dict[str, dict] = {}
+        self._next_stream_id = 1
+
+        # Opt-in pool that takes the DSP chain off the event loop once enough
+        # streams are active, so signaling and WebSocket sends are not held
+        # up behind it. Each stream still awaits its frames one at a time.
+        processing = config['processing']
+        worker_threads = processing.get('worker_threads', 0)
+        self.dsp_executor = ThreadPoolExecutor(
+            max_workers=worker_threads, thread_name_prefix='dsp') if worker_threads else None
+        self.worker_pool_min_streams = processing.get('worker_pool_min_streams', 4)
+
+        # Segmented recordings, written by the recorder's own threads
+        recording = config.get('recording', {})
+        self.recorder = Recorder.from_config(recording) if recording.get('enabled') else None
         self.app = web.Application()
+        self.app.on_shutdown.append(self.on_shutdown)
         self.setup_routes()
         
     def setup_routes(self):
@@ -40,6 +67,8 @@ class VoiceStreamingServer:
         self.app.router.add_post('/webrtc/offer', self.handle_offer)
         self.app.router.add_post('/webrtc/answer', self.handle_answer)
         self.app.router.add_post('/webrtc/candidate', self.handle_candidate)
+        if self.recorder:
+            RecordingsApi(self.recorder).add_routes(self.app.router)
         self.app.router.add_static('/', '/app/www')
         
     async def health_check(self, request):
@@ -53,7 +82,7 @@ class VoiceStreamingServer:
         self.connections[connection_id] = {
             'ws': ws,
             'pc': None,
-            'recorder': None
+            'recording': None
         }
         
         try:
@@ -79,22 +108,43 @@ class VoiceStreamingServer:
             return
             
         if message_type == 'start_stream':
-            await self.start_voice_stream(connection_id)
+            await self.start_voice_stream(connection_id, data)
         elif message_type == 'stop_stream':
             await self.stop_voice_stream(connection_id)
         elif message_type == 'webrtc_offer':
             await self.handle_webrtc_offer(connection_id, data)
             
-    async def start_voice_stream(self, connection_id: str):
+    async def start_voice_stream(self, connection_id: str, options: dict = None):
         connection = self.connections[connection_id]
+        options = options or {}
+        audio_settings = self.config['audio_settings']
+
+        # Binary PCM frames by default; JSON sample lists only when asked for
+        audio_format = options.get('format') or audio_settings.get('transport', 'binary')
+        if audio_format not in ('binary', 'json'):
+            audio_format = 'binary'
+        stream_number = self._next_stream_id
+        self._next_stream_id += 1
+        connection['audio_format'] = audio_format
+        connection['pcm_encoder'] = PcmFrameEncoder(stream_number)
+
+        # Clients trade latency for fewer, larger messages per stream
+        connection['window_ms'] = int(options.get('window_ms') or audio_settings.get(
+            'frame_window_ms', DEFAULT_WINDOW_MS))
+        connection['max_latency_ms'] = int(options.get('max_latency_ms') or audio_settings.get(
+            'max_latency_ms', DEFAULT_MAX_LATENCY_MS))
+        # Opus ptime, bitrate, DTX and FEC asked of the sender in our answer
+        try:
+            connection['opus_profile'] = check_profile(
+                options.get('opus_profile') or audio_settings.get('opus_profile'))
+        except ValueError as e:
+            await connection['ws'].send_str(json.dumps({'type': 'error', 'message': str(e)}))
+            return
         
         # Create RTCPeerConnection with optimized settings
-        pc = RTCPeerConnection(configuration={
-            'iceServers': [
-                {'urls': server} for server in self.config['stun_servers']
-            ],
-            'iceCandidatePoolSize': 10,
-        })
+        pc = RTCPeerConnection(configuration=RTCConfiguration(iceServers=[
+            RTCIceServer(urls=server) for server in self.config['stun_servers']
+        ]))
         
         connection['pc'] = pc
         
@@ -104,57 +154,142 @@ class VoiceStreamingServer:
             if track.kind == "audio":
                 logger.info("Received audio track")
                 
-                # Create recorder for processing
-                recorder = MediaRecorder("/data/recordings/stream.wav")
-                await recorder.addTrack(track)
-                await recorder.start()
-                connection['recorder'] = recorder
-                
                 # Process audio frames in real-time
                 asyncio.create_task(self.process_audio_stream(track, connection_id))
                 
         # Send ready signal
-        await connection['ws'].send_text(json.dumps({
+        await connection['ws'].send_str(json.dumps({
             'type': 'stream_ready',
-            'connection_id': connection_id
+            'connection_id': connection_id,
+            'stream_id': stream_number,
+            'audio_format': audio_format,
+            'window_ms': connection['window_ms']
         }))
         
     async def process_audio_stream(self, track: MediaStreamTrack, connection_id: str):
         """Process incoming audio frames with minimal latency"""
+        connection = self.connections[connection_id]
+        audio_settings = self.config['audio_settings']
+        aggregator = None
         try:
             while True:
-                frame = await track.recv()
+                # Wait no longer than the partial window's latency cap
+                deadline = aggregator.time_to_deadline() if aggregator else None
+                try:
+                    frame = await asyncio.wait_for(track.recv(), deadline)
+                except asyncio.TimeoutError:
+                    await self.emit_windows(connection_id, aggregator, aggregator.flush())
+                    continue
                 
                 # Convert frame to numpy array
                 audio_data = np.frombuffer(frame.to_ndarray(), dtype=np.int16)
+
+                # Apply real-time processing: resampling to audio_settings first,
+                # then the stages selected by the processing options
+                if 'dsp_chain' not in connection:
+                    connection['dsp_chain'] = DspChain(
+                        frame.sample_rate, len(frame.layout.channels),
+                        audio_settings['sample_rate'], audio_settings['channels'],
+                        self.config['processing'])
+                chain = connection['dsp_chain']
+                audio_data = await self.run_dsp_chain(chain, audio_data)
+                if self.recorder and connection['recording'] is None:
+                    connection['recording'] = self.recorder.open_stream(
+                        connection_id, chain.sample_rate, chain.channels)
+                recording = connection['recording']
+
+                if aggregator is None:
+                    aggregator = FrameAggregator(
+                        chain.sample_rate, chain.channels,
+                        connection['window_ms'], connection['max_latency_ms'])
+
+                # With VAD enabled only speech goes downstream
+                vad = chain.stage('vad')
+                if vad:
+                    if vad.event == SPEECH_START:
+                        await self.send_speech_event(connection_id, SPEECH_START)
+                        await self.emit_preroll(connection_id, aggregator, chain, recording)
+                    if not vad.speaking:
+                        if vad.event == SPEECH_END:
+                            await self.emit_windows(connection_id, aggregator, aggregator.flush())
+                            await self.send_speech_event(connection_id, SPEECH_END)
+                            if recording:
+                                recording.flush()
+                        continue
+
+                if recording:
+                    recording.write(audio_data)
+
+                # Trigger Home Assistant events, one per completed window
+                await self.emit_windows(connection_id, aggregator, aggregator.add(audio_data))
                 
-                # Apply real-time processing
-                if self.config['processing']['noise_suppression']:
-                    audio_data = self.apply_noise_suppression(audio_data)
-                    
-                # Trigger Home Assistant events
-                await self.trigger_voice_event(connection_id, audio_data)
-                
+        except MediaStreamError:
+            # End of stream: deliver the last partial window
+            if aggregator and connection_id in self.connections:
+                await self.emit_windows(connection_id, aggregator, aggregator.flush())
+                vad = connection['dsp_chain'].stage('vad')
+                if vad and vad.speaking:
+                    await self.send_speech_event(connection_id, SPEECH_END)
         except Exception as e:
             logger.error(f"Audio processing error: {e}")
+
+    async def emit_windows(self, connection_id: str, aggregator: FrameAggregator, windows):
+        """Send each aggregated window as one audio message"""
+        for block, timestamp in windows:
+            await self.trigger_voice_event(connection_id, block, aggregator.sample_rate,
+                                           aggregator.channels, timestamp)
             
-    def apply_noise_suppression(self, audio_data: np.ndarray) -> np.ndarray:
-        """Basic noise suppression using spectral subtraction"""
-        # Implement your preferred noise suppression algorithm
-        return audio_data
-        
-    async def trigger_voice_event(self, connection_id: str, audio_data: np.ndarray):
-        """Send audio data to Home Assistant for processing"""
+    async def emit_preroll(self, connection_id: str, aggregator: FrameAggregator,
+                           chain: DspChain, recording=None):
+        """Send the audio from just before speech was detected, stamped with its capture time"""
+        rate = chain.sample_rate * chain.channels
+        blocks = chain.recent()
+        timestamp = time.time() - sum(block.size for block in blocks) / rate
+        for block in blocks:
+            if recording:
+                recording.write(block, timestamp)
+            await self.emit_windows(connection_id, aggregator, aggregator.add(block, timestamp))
+            timestamp += block.size / rate
+
+    async def send_speech_event(self, connection_id: str, event: str):
         connection = self.connections[connection_id]
-        
-        # Send processed audio event
-        await connection['ws'].send_text(json.dumps({
-            'type': 'audio_data',
+        await connection['ws'].send_str(json.dumps({
+            'type': event,
             'connection_id': connection_id,
-            'data': audio_data.tolist(),
-            'timestamp': asyncio.get_event_loop().time(),
-            'sample_rate': self.config['audio_settings']['sample_rate']
+            'stream_id': connection['pcm_encoder'].stream_id,
+            'timestamp': time.time()
         }))
+
+    async def run_dsp_chain(self, chain: DspChain, audio_data: np.ndarray) -> np.ndarray:
+        """Run one frame through a stream's DSP chain, on the pool when busy"""
+        if self.dsp_executor and self.active_chains() >= self.worker_pool_min_streams:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.dsp_executor, chain.process, audio_data)
+        return chain.process(audio_data)
+
+    def active_chains(self) -> int:
+        return sum(1 for connection in self.connections.values()
+                   if 'dsp_chain' in connection)
+
+    async def trigger_voice_event(self, connection_id: str, audio_data: np.ndarray,
+                                  sample_rate: int, channels: int, timestamp: float = None):
+        """Send audio data to Home Assistant for processing"""
+        connection = self.connections[connection_id]
+
+        if connection.get('audio_format') == 'json':
+            # Compatibility mode: every sample boxed into a JSON number
+            await connection['ws'].send_str(json.dumps({
+                'type': 'audio_data',
+                'connection_id': connection_id,
+                'data': audio_data.tolist(),
+                'timestamp': asyncio.get_event_loop().time(),
+                'sample_rate': sample_rate
+            }))
+            return
+
+        # Binary frame: fixed header plus the raw little-endian int16 buffer
+        await connection['ws'].send_bytes(
+            connection['pcm_encoder'].encode(audio_data, sample_rate, channels, timestamp))
         
     async def handle_webrtc_offer(self, connection_id: str, data: dict):
         connection = self.connections[connection_id]
@@ -172,10 +307,10 @@ class VoiceStreamingServer:
         answer = await pc.createAnswer()
         await pc.setLocalDescription(answer)
         
-        await connection['ws'].send_text(json.dumps({
+        await connection['ws'].send_str(json.dumps({
             'type': 'webrtc_answer',
             'answer': {
-                'sdp': pc.localDescription.sdp,
+                'sdp': apply_profile(pc.localDescription.sdp, connection.get('opus_profile')),
                 'type': pc.localDescription.type
             }
         }))
@@ -184,14 +319,21 @@ class VoiceStreamingServer:
         if connection_id in self.connections:
             connection = self.connections[connection_id]
             
-            if connection.get('recorder'):
-                await connection['recorder'].stop()
+            if connection.get('recording'):
+                self.recorder.close_stream(connection['recording'])
                 
             if connection.get('pc'):
                 await connection['pc'].close()
                 
             del self.connections[connection_id]
             
+    async def on_shutdown(self, app):
+        # Let the writers drain and finalize open segments
+        if self.recorder:
+            await asyncio.get_event_loop().run_in_executor(None, self.recorder.stop)
+        if self.dsp_executor:
+            self.dsp_executor.shutdown(wait=False)
+
     async def run_server(self):
         runner = web.AppRunner(self.app)
         await runner.setup()
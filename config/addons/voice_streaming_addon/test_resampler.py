@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the streaming resampler against scipy.signal.resample_poly
+and that feeding it in pieces gives the same output as one call
+"""
+
+import sys
+
+import numpy as np
+from scipy.signal import resample_poly
+
+from src.resampler import StreamResampler
+
+RATE_PAIRS = [
+    (48000, 16000),
+    (48000, 8000),
+    (44100, 16000),
+    (16000, 48000),
+]
+MIN_SNR_DB = 100.0
+# Piece sizes in input samples, cycled; includes empty and one-sample pieces
+PIECES = [960, 1, 0, 441, 7, 2048, 160, 333]
+
+
+def noise(rate: int, seconds: float = 1.0, channels: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((int(rate * seconds), channels)).astype(np.float32)
+
+
+def process_in_pieces(resampler: StreamResampler, signal: np.ndarray) -> np.ndarray:
+    outputs = []
+    position = 0
+    index = 0
+    while position < signal.shape[0]:
+        size = PIECES[index % len(PIECES)]
+        outputs.append(resampler.process(signal[position:position + size]).copy())
+        position += size
+        index += 1
+    return np.concatenate(outputs)
+
+
+def test_matches_resample_poly():
+    """Output lagged by the group delay matches resample_poly on the whole signal"""
+    for in_rate, out_rate in RATE_PAIRS:
+        signal = noise(in_rate)
+        resampler = StreamResampler(in_rate, out_rate)
+        output = resampler.process(signal)[:, 0].copy()
+
+        reference = resample_poly(signal[:, 0].astype(np.float64),
+                                  resampler.up, resampler.down)
+        delay = int(round(resampler.delay))
+        output = output[delay:]
+        reference = reference[:output.size]
+        error = output - reference
+        snr = 10 * np.log10(np.sum(reference ** 2) / np.sum(error ** 2))
+        assert snr >= MIN_SNR_DB, \
+            f'{in_rate} -> {out_rate}: {snr:.1f} dB against resample_poly'
+
+
+def test_pieces_match_one_call():
+    """Any split of the input gives the output of a single call, for every channel"""
+    for in_rate, out_rate in RATE_PAIRS:
+        signal = noise(in_rate, channels=2)
+        whole = StreamResampler(in_rate, out_rate, 2).process(signal).copy()
+        pieces = process_in_pieces(StreamResampler(in_rate, out_rate, 2), signal)
+
+        assert pieces.shape == whole.shape, \
+            f'{in_rate} -> {out_rate}: {pieces.shape} samples in pieces, {whole.shape} in one call'
+        difference = np.max(np.abs(pieces - whole))
+        assert difference < 1e-5, \
+            f'{in_rate} -> {out_rate}: pieces differ from one call by {difference:g}'
+
+
+if __name__ == "__main__":
+    print("Testing the streaming resampler...")
+    print("=" * 40)
+    failed = 0
+    for test in (test_matches_resample_poly, test_pieces_match_one_call):
+        try:
+            test()
+            print(f"✓ {test.__name__}: SUCCESS")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {test.__name__}: FAILED - {e}")
+
+    print("=" * 40)
+    sys.exit(1 if failed else 0)
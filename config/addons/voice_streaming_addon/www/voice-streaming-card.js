@@ -161,12 +161,17 @@ class VoiceStreamingCard extends LitElement {
     const wsUrl = `${protocol}//${window.location.host}/api/voice-streaming/ws`;
     
     this.websocket = new WebSocket(wsUrl);
+    this.websocket.binaryType = 'arraybuffer';
     
     this.websocket.onopen = () => {
       console.log('WebSocket connected');
     };
     
     this.websocket.onmessage = async (event) => {
+      if (event.data instanceof ArrayBuffer) {
+        this.handleAudioFrame(event.data);
+        return;
+      }
       const data = JSON.parse(event.data);
       await this.handleWebSocketMessage(data);
     };
@@ -199,6 +204,16 @@ class VoiceStreamingCard extends LitElement {
     }
   }
 
+  handleAudioFrame(buffer) {
+    // Binary audio frame: 24-byte little-endian header, then int16 samples
+    const view = new DataView(buffer);
+    if (buffer.byteLength < 24 || view.getUint8(0) !== 0x56 || view.getUint8(1) !== 0x53) {
+      return;
+    }
+    const timestampUs = Number(view.getBigUint64(12, true));
+    this.updateLatency(timestampUs / 1e6);
+  }
+
   async toggleRecording() {
     if (this.isRecording) {
       await this.stopRecording();
@@ -0,0 +1,163 @@
+"""
+Admission control and load shedding.
+
+Each server asks its AdmissionController before it accepts a WebSocket
+connection or starts a new sender or receiver session. A refused client
+gets an error message naming the limit it hit and a `retry_after` in
+seconds, before any peer connection is created. Sessions that are
+already running are never touched, so under overload new sessions are
+turned away and existing calls keep their audio.
+
+Limits are per process; in worker mode every worker applies them to its
+own connections and streams. A limit of None is not enforced.
+"""
+
+import time
+from typing import Dict, Optional
+
+from aiohttp import WSCloseCode
+
+from metrics import ADMISSION_REJECTIONS
+
+DEFAULT_RETRY_AFTER = 5.0
+# A negotiation that has not connected by then no longer holds its slot
+DEFAULT_NEGOTIATION_TIMEOUT = 30.0
+# Weight of each new loop-lag sample: at the 0.1 s probe interval, lag
+# has to last several probes, not one slow callback, to shed sessions
+LOOP_LAG_SMOOTHING = 0.2
+CPU_SAMPLE_INTERVAL = 1.0
+
+# Why a connection or session was refused
+REASON_CONNECTIONS = "too_many_connections"
+REASON_STREAMS = "too_many_streams"
+REASON_RECEIVERS = "too_many_receivers"
+REASON_NEGOTIATIONS = "too_many_negotiations"
+REASON_LOOP_LAG = "event_loop_lag"
+REASON_CPU = "cpu"
+
+MESSAGES = {
+    REASON_CONNECTIONS: "Server is at its connection limit",
+    REASON_STREAMS: "Server is at its stream limit",
+    REASON_RECEIVERS: "Stream is at its receiver limit",
+    REASON_NEGOTIATIONS: "Too many connections are being set up",
+    REASON_LOOP_LAG: "Server is overloaded",
+    REASON_CPU: "Server is overloaded",
+}
+
+
+class AdmissionController:
+    """Limits on connections, streams, receivers and negotiations, and
+    shedding of new sessions while the process is overloaded"""
+
+    def __init__(
+        self,
+        max_connections: int = None,
+        max_streams: int = None,
+        max_receivers_per_stream: int = None,
+        max_negotiations: int = None,
+        max_loop_lag: float = None,
+        max_cpu_percent: float = None,
+        retry_after: float = DEFAULT_RETRY_AFTER,
+        negotiation_timeout: float = DEFAULT_NEGOTIATION_TIMEOUT,
+    ):
+        self.max_connections = max_connections
+        self.max_streams = max_streams
+        self.max_receivers_per_stream = max_receivers_per_stream
+        # Peer connections between the start of a session and its
+        # connection; key generation, ICE and DTLS all happen here
+        self.max_negotiations = max_negotiations
+        # Seconds of smoothed event-loop lag, and percent of one core
+        self.max_loop_lag = max_loop_lag
+        self.max_cpu_percent = max_cpu_percent
+        self.retry_after = retry_after
+        self.negotiation_timeout = negotiation_timeout
+        # connection_id -> when its negotiation started
+        self._negotiations: Dict[str, float] = {}
+        self.loop_lag = 0.0
+        self.cpu_percent = 0.0
+        self._cpu_sample = None  # (wall clock, process CPU time)
+
+    def sample(self, lag: float):
+        """Record one loop-lag probe; monitor_loop_lag calls this on every wake-up"""
+        self.loop_lag += LOOP_LAG_SMOOTHING * (lag - self.loop_lag)
+        if self.max_cpu_percent is None:
+            return
+        now, cpu = time.monotonic(), time.process_time()
+        if self._cpu_sample is None:
+            self._cpu_sample = (now, cpu)
+        elif now - self._cpu_sample[0] >= CPU_SAMPLE_INTERVAL:
+            then, cpu_then = self._cpu_sample
+            self.cpu_percent = (cpu - cpu_then) / (now - then) * 100
+            self._cpu_sample = (now, cpu)
+
+    def overloaded(self) -> Optional[str]:
+        if self.max_loop_lag is not None and self.loop_lag > self.max_loop_lag:
+            return REASON_LOOP_LAG
+        if self.max_cpu_percent is not None and self.cpu_percent > self.max_cpu_percent:
+            return REASON_CPU
+        return None
+
+    def negotiations(self) -> int:
+        """Negotiations in flight, forgetting those that timed out"""
+        expired = time.monotonic() - self.negotiation_timeout
+        for connection_id, started in list(self._negotiations.items()):
+            if started < expired:
+                del self._negotiations[connection_id]
+        return len(self._negotiations)
+
+    def begin_negotiation(self, connection_id: str):
+        self._negotiations[connection_id] = time.monotonic()
+
+    def end_negotiation(self, connection_id: str):
+        self._negotiations.pop(connection_id, None)
+
+    def admit_connection(self, connections: int) -> Optional[str]:
+        """Why a new WebSocket connection is refused, or None to accept it"""
+        if self.max_connections is not None and connections >= self.max_connections:
+            return self.refuse(REASON_CONNECTIONS)
+        return None
+
+    def admit_stream(self, streams: int) -> Optional[str]:
+        """Why a new sender is refused, or None to accept it"""
+        if self.max_streams is not None and streams >= self.max_streams:
+            return self.refuse(REASON_STREAMS)
+        return self._admit_session()
+
+    def admit_receiver(self, receivers: int) -> Optional[str]:
+        """Why a new receiver of a stream with `receivers` is refused, or None"""
+        if (
+            self.max_receivers_per_stream is not None
+            and receivers >= self.max_receivers_per_stream
+        ):
+            return self.refuse(REASON_RECEIVERS)
+        return self._admit_session()
+
+    def _admit_session(self) -> Optional[str]:
+        if (
+            self.max_negotiations is not None
+            and self.negotiations() >= self.max_negotiations
+        ):
+            return self.refuse(REASON_NEGOTIATIONS)
+        reason = self.overloaded()
+        return self.refuse(reason) if reason else None
+
+    def refuse(self, reason: str) -> str:
+        ADMISSION_REJECTIONS.labels(reason).inc()
+        return reason
+
+    def rejection(self, reason: str) -> dict:
+        """The error message sent to a refused client"""
+        return {
+            "type": "error",
+            "code": "rejected",
+            "reason": reason,
+            "message": f"{MESSAGES[reason]}, retry in {self.retry_after:g} s",
+            "retry_after": self.retry_after,
+        }
+
+    async def reject_connection(self, ws, reason: str):
+        """Tell a refused WebSocket client why, then close it as 'try again later'"""
+        try:
+            await ws.send_json(self.rejection(reason))
+        finally:
+            await ws.close(code=WSCloseCode.TRY_AGAIN_LATER)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Broadcast benchmark for the relay server.
+Measures how long stream_available takes to reach fast clients when a few
+clients are slow, comparing the old sequential send loop with the
+per-connection outbound queues.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from outbound import OutboundQueue
+from webrtc_server_relay import VoiceStreamingServer
+
+
+class FakeWebSocket:
+    """WebSocket stand-in whose send_str takes a fixed time"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.delivered_at = None
+
+    async def send_str(self, message: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.delivered_at = time.perf_counter()
+
+    async def close(self, code=None):
+        pass
+
+
+def make_server(connections: int, slow: int, slow_delay: float):
+    server = VoiceStreamingServer(send_timeout=slow_delay * 2)
+    sockets = []
+    for i in range(connections):
+        ws = FakeWebSocket(slow_delay if i < slow else 0.0)
+        outbound = OutboundQueue(ws, f"client_{i}", send_timeout=server.send_timeout)
+        outbound.start()
+        server.connections[f"client_{i}"] = {"ws": ws, "outbound": outbound}
+        sockets.append(ws)
+    return server, sockets
+
+
+async def sequential_broadcast(server, stream_id: str):
+    """The pre-queue behaviour: serialize and await every client in turn"""
+    for conn in server.connections.values():
+        await conn["ws"].send_str(
+            json.dumps({"type": "stream_available", "stream_id": stream_id})
+        )
+
+
+async def measure(mode: str, connections: int, slow: int, slow_delay: float):
+    server, sockets = make_server(connections, slow, slow_delay)
+    fast = sockets[slow:]
+
+    start = time.perf_counter()
+    if mode == "sequential":
+        await sequential_broadcast(server, "stream_bench")
+    else:
+        await server.broadcast_stream_available("stream_bench")
+    returned = time.perf_counter() - start
+
+    while any(ws.delivered_at is None for ws in fast):
+        await asyncio.sleep(0.001)
+    fast_done = max(ws.delivered_at for ws in fast) - start
+
+    for conn in server.connections.values():
+        await conn["outbound"].close()
+
+    return {
+        "mode": mode,
+        "connections": connections,
+        "call_ms": returned * 1000,
+        "fast_clients_ms": fast_done * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--connections", type=int, nargs="+", default=[10, 100, 1000]
+    )
+    parser.add_argument("--slow", type=int, default=2, help="slow clients per run")
+    parser.add_argument(
+        "--slow-delay", type=float, default=0.2, help="seconds per send to a slow client"
+    )
+    args = parser.parse_args()
+
+    print("Broadcast Benchmark")
+    print("=" * 30)
+    print(f"{'mode':<11} {'connections':>11} {'call ms':>9} {'fast clients ms':>16}")
+    for connections in args.connections:
+        for mode in ("sequential", "queued"):
+            result = await measure(mode, connections, args.slow, args.slow_delay)
+            print(
+                f"{result['mode']:<11} {result['connections']:>11} "
+                f"{result['call_ms']:>9.2f} {result['fast_clients_ms']:>16.2f}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
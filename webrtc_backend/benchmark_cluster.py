@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Cluster mode benchmark for the relay server.
+Starts a stand-in registry broker and two relay nodes that use it. Senders
+connect to node A, and receivers connect both to node A and to node B,
+which gets the streams over the node-to-node media bridge. Reports how
+long node B takes to announce a new stream, frame delivery and time to
+the first frame for local and bridged receivers, and how long node B
+takes to announce the end of the streams after node A is killed.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+
+from benchmark_workers import (
+    FRAMES_PER_SECOND,
+    receive,
+    start_sender,
+    wait_until_healthy,
+)
+
+BROKER_PORT = 8766
+NODE_PORTS = {"a": 8098, "b": 8099}
+
+
+def node_url(node: str) -> str:
+    return f"http://127.0.0.1:{NODE_PORTS[node]}"
+
+
+def start_process(*args):
+    return subprocess.Popen(
+        [sys.executable, *args],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def start_node(node: str):
+    return start_process(
+        "webrtc_server_relay.py",
+        "--port",
+        str(NODE_PORTS[node]),
+        "--broker",
+        f"127.0.0.1:{BROKER_PORT}",
+        "--node-id",
+        node,
+        "--advertise-url",
+        node_url(node),
+    )
+
+
+async def wait_for(ws, message_type: str, count: int, stream_ids=None) -> float:
+    """Seconds until `count` messages of a type arrive on a client WebSocket,
+    counting only those about `stream_ids` if given"""
+    started = time.perf_counter()
+    seen = 0
+    async for message in ws:
+        data = json.loads(message.data)
+        if data["type"] != message_type:
+            continue
+        if stream_ids is None or data["stream_id"] in stream_ids:
+            seen += 1
+            if seen == count:
+                break
+    return time.perf_counter() - started
+
+
+def run_clients(senders: int, receivers: int, seconds: float):
+    """Stream from another process, so clients do not compete for the GIL"""
+
+    async def stream_all():
+        local, bridged = [], []
+        async with aiohttp.ClientSession() as session:
+            watcher = await session.ws_connect(f"{node_url('b')}/ws")
+            await watcher.receive()  # available_streams
+            announced = asyncio.ensure_future(
+                wait_for(watcher, "stream_available", senders)
+            )
+            streams = [
+                await start_sender(session, node_url("a")) for _ in range(senders)
+            ]
+            announce_time = await announced
+            await asyncio.gather(
+                *[
+                    receive(session, node_url(node), stream_id, seconds, results)
+                    for _, _, stream_id in streams
+                    for node, results in (("a", local), ("b", bridged))
+                    for _ in range(receivers)
+                ]
+            )
+            for ws, pc, _ in streams:
+                await pc.close()
+                await ws.close()
+            await watcher.close()
+        return local, bridged, announce_time
+
+    return asyncio.run(stream_all())
+
+
+def measure_failover(senders: int, node_a) -> float:
+    """Seconds from killing node A until node B reports its streams ended"""
+
+    async def watch():
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(f"{node_url('b')}/ws") as watcher:
+                await watcher.receive()  # available_streams
+                async with aiohttp.ClientSession() as sender_session:
+                    # Keep the peer connections referenced, or they are closed
+                    streams = [
+                        await start_sender(sender_session, node_url("a"))
+                        for _ in range(senders)
+                    ]
+                    await wait_for(
+                        watcher,
+                        "stream_available",
+                        senders,
+                        {stream_id for _, _, stream_id in streams},
+                    )
+                    node_a.send_signal(signal.SIGKILL)
+                    failover = await wait_for(
+                        watcher,
+                        "stream_ended",
+                        senders,
+                        {stream_id for _, _, stream_id in streams},
+                    )
+                    for _, pc, _ in streams:
+                        await pc.close()
+                    return failover
+
+    return asyncio.run(watch())
+
+
+def summarize(results, seconds: float):
+    expected = seconds * FRAMES_PER_SECOND
+    delivered = sum(min(frames, expected) for frames, _ in results)
+    first_frames = [first for _, first in results if first is not None]
+    return (
+        delivered / (len(results) * expected),
+        sum(first_frames) / len(first_frames) * 1000 if first_frames else 0,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--senders", type=int, default=2)
+    parser.add_argument(
+        "--receivers", type=int, default=4, help="receivers per sender on each node"
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=10, help="seconds each receiver listens"
+    )
+    args = parser.parse_args()
+
+    broker = start_process("stream_registry.py", "--port", str(BROKER_PORT))
+    nodes = {node: start_node(node) for node in NODE_PORTS}
+    try:
+        for node in nodes:
+            wait_until_healthy(node_url(node))
+        with ProcessPoolExecutor(1) as pool:
+            local, bridged, announce_time = pool.submit(
+                run_clients, args.senders, args.receivers, args.seconds
+            ).result()
+        failover = measure_failover(args.senders, nodes["a"])
+    finally:
+        for process in (*nodes.values(), broker):
+            process.terminate()
+            process.wait()
+
+    print("Cluster Mode Benchmark")
+    print("=" * 30)
+    print(
+        f"Senders on node A: {args.senders}, {args.receivers} receivers each "
+        f"on nodes A and B, {args.seconds:.0f} s"
+    )
+    print(f"Streams announced on node B after {announce_time * 1000:.0f} ms")
+    print(f"{'receivers':<10} {'delivered':>10} {'first frame ms':>15}")
+    for name, results in (("local", local), ("bridged", bridged)):
+        delivered, first_frame = summarize(results, args.seconds)
+        print(f"{name:<10} {delivered * 100:>9.1f}% {first_frame:>15.0f}")
+    print(f"Node A failure announced on node B after {failover * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
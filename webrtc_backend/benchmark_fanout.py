@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Fan-out benchmark for the relay server.
+Compares handing the sender's track to every receiver (the old behaviour)
+with the per-stream StreamFanout, for 1, 10 and 50 receivers on one stream.
+"""
+
+import argparse
+import asyncio
+import fractions
+import time
+
+import numpy as np
+from av import AudioFrame
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import MediaStreamError
+
+from stream_fanout import StreamFanout
+
+SAMPLE_RATE = 48000
+SAMPLES_PER_FRAME = 960  # 20 ms
+
+
+class SyntheticSourceTrack(MediaStreamTrack):
+    """Stands in for a remote sender track: a fixed number of 20 ms frames"""
+
+    kind = "audio"
+
+    def __init__(self, frame_count: int, realtime: bool):
+        super().__init__()
+        self.frame_count = frame_count
+        self.realtime = realtime
+        self._sent = 0
+        self._samples = np.zeros((1, SAMPLES_PER_FRAME * 2), dtype=np.int16)
+
+    async def recv(self):
+        if self.realtime:
+            await asyncio.sleep(SAMPLES_PER_FRAME / SAMPLE_RATE)
+        else:
+            await asyncio.sleep(0)
+
+        if self._sent >= self.frame_count:
+            self.stop()
+            raise MediaStreamError
+
+        frame = AudioFrame.from_ndarray(self._samples, format="s16", layout="stereo")
+        frame.sample_rate = SAMPLE_RATE
+        frame.pts = self._sent * SAMPLES_PER_FRAME
+        frame.time_base = fractions.Fraction(1, SAMPLE_RATE)
+        self._sent += 1
+        return frame
+
+
+async def drain(track) -> int:
+    """Read a track the way an RTCRtpSender does, counting frames"""
+    received = 0
+    try:
+        while True:
+            await track.recv()
+            received += 1
+    except MediaStreamError:
+        pass
+    return received
+
+
+async def run_shared(receivers: int, frame_count: int, realtime: bool):
+    source = SyntheticSourceTrack(frame_count, realtime)
+    return await asyncio.gather(*(drain(source) for _ in range(receivers)))
+
+
+async def run_fanout(receivers: int, frame_count: int, realtime: bool):
+    source = SyntheticSourceTrack(frame_count, realtime)
+    fanout = StreamFanout(source, "bench")
+    tracks = [fanout.subscribe(f"receiver_{i}") for i in range(receivers)]
+    fanout.start()
+    return await asyncio.gather(*(drain(track) for track in tracks))
+
+
+async def measure(mode: str, receivers: int, frame_count: int, realtime: bool):
+    runner = run_shared if mode == "shared" else run_fanout
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    counts = await runner(receivers, frame_count, realtime)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    audio_seconds = frame_count * SAMPLES_PER_FRAME / SAMPLE_RATE
+    return {
+        "mode": mode,
+        "receivers": receivers,
+        "cpu_ms_per_audio_second": cpu * 1000 / audio_seconds,
+        "wall_s": wall,
+        "min_completeness": min(counts) / frame_count,
+        "mean_completeness": sum(counts) / (receivers * frame_count),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=500, help="frames per run")
+    parser.add_argument(
+        "--receivers", type=int, nargs="+", default=[1, 10, 50], help="receiver counts"
+    )
+    parser.add_argument(
+        "--realtime", action="store_true", help="pace the source at 20 ms per frame"
+    )
+    args = parser.parse_args()
+
+    print("Fan-out Benchmark")
+    print("=" * 30)
+    print(
+        f"{'mode':<8} {'receivers':>9} {'cpu ms/s':>10} "
+        f"{'min complete':>13} {'mean complete':>14}"
+    )
+    for receivers in args.receivers:
+        for mode in ("shared", "fanout"):
+            result = await measure(mode, receivers, args.frames, args.realtime)
+            print(
+                f"{result['mode']:<8} {result['receivers']:>9} "
+                f"{result['cpu_ms_per_audio_second']:>10.2f} "
+                f"{result['min_completeness']:>12.1%} "
+                f"{result['mean_completeness']:>13.1%}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Forwarding benchmark for the relay server.
+Measures the per-receiver sender cost of re-encoding decoded frames to Opus
+against packing the sender's already-encoded Opus packets, for 1, 10 and 50
+receivers on one stream.
+"""
+
+import argparse
+import fractions
+import time
+
+import numpy as np
+from aiortc.codecs import get_encoder
+from aiortc.rtcrtpparameters import RTCRtpCodecParameters
+from av import AudioFrame, Packet
+
+from packet_forwarding import OPUS_TIME_BASE
+
+SAMPLE_RATE = 48000
+SAMPLES_PER_FRAME = 960  # 20 ms
+OPUS_CODEC = RTCRtpCodecParameters(
+    mimeType="audio/opus", clockRate=48000, channels=2, payloadType=111
+)
+
+
+def synthetic_frames(frame_count: int):
+    """Speech-like noise so the encoder does representative work"""
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(frame_count):
+        samples = (rng.standard_normal(SAMPLES_PER_FRAME * 2) * 3000).astype(np.int16)
+        frame = AudioFrame.from_ndarray(
+            samples.reshape(1, -1), format="s16", layout="stereo"
+        )
+        frame.sample_rate = SAMPLE_RATE
+        frame.pts = i * SAMPLES_PER_FRAME
+        frame.time_base = fractions.Fraction(1, SAMPLE_RATE)
+        frames.append(frame)
+    return frames
+
+
+def encoded_packets(frames):
+    """Encode once, the way the sender's browser would"""
+    encoder = get_encoder(OPUS_CODEC)
+    packets = []
+    for frame in frames:
+        payloads, timestamp = encoder.encode(frame)
+        for payload in payloads:
+            packet = Packet(payload)
+            packet.pts = timestamp
+            packet.time_base = OPUS_TIME_BASE
+            packets.append(packet)
+    return packets
+
+
+def measure(mode: str, receivers: int, frames, packets):
+    encoders = [get_encoder(OPUS_CODEC) for _ in range(receivers)]
+    payload_bytes = 0
+
+    cpu_start = time.process_time()
+    if mode == "transcode":
+        for frame in frames:
+            for encoder in encoders:
+                payloads, _ = encoder.encode(frame)
+                payload_bytes += sum(len(p) for p in payloads)
+    else:
+        for packet in packets:
+            for encoder in encoders:
+                payloads, _ = encoder.pack(packet)
+                payload_bytes += sum(len(p) for p in payloads)
+    cpu = time.process_time() - cpu_start
+
+    audio_seconds = len(frames) * SAMPLES_PER_FRAME / SAMPLE_RATE
+    return {
+        "mode": mode,
+        "receivers": receivers,
+        "cpu_ms_per_audio_second": cpu * 1000 / audio_seconds,
+        "cores_at_realtime": cpu / audio_seconds,
+        "payload_bytes": payload_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=250, help="frames per run")
+    parser.add_argument(
+        "--receivers", type=int, nargs="+", default=[1, 10, 50], help="receiver counts"
+    )
+    args = parser.parse_args()
+
+    frames = synthetic_frames(args.frames)
+    packets = encoded_packets(frames)
+
+    print("Forwarding Benchmark")
+    print("=" * 30)
+    print(f"{'mode':<10} {'receivers':>9} {'cpu ms/s':>10} {'cores':>7}")
+    for receivers in args.receivers:
+        for mode in ("transcode", "forward"):
+            result = measure(mode, receivers, frames, packets)
+            print(
+                f"{result['mode']:<10} {result['receivers']:>9} "
+                f"{result['cpu_ms_per_audio_second']:>10.2f} "
+                f"{result['cores_at_realtime']:>7.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Receiver time-to-connected with and without trickle ICE.
+Starts the relay on loopback with a local STUN server that answers after
+a configurable delay, standing in for a STUN server across the internet.
+Receivers join one stream one after the other, in one of three ways:
+
+  full     the relay and the receiver each gather every candidate before
+           sending their description (no trickle, as before)
+  trickle  both send their description first and their candidates as
+           ice_candidate messages once gathered
+  early    as trickle, but the receiver's candidates are sent ahead of its
+           answer, so the relay must keep them until the answer arrives
+
+Reports, per mode and STUN delay, the time from start_receiving until the
+offer arrived, ICE connected and DTLS connected.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+from aioice import stun
+from aiortc import (
+    RTCConfiguration,
+    RTCIceServer,
+    RTCPeerConnection,
+    RTCSessionDescription,
+)
+
+from ice_candidates import candidate_messages, parse_candidate
+from load_test import ToneTrack, close, next_message, run_sender, wait_until_healthy
+
+PORT = 8093
+BASE_URL = f"http://127.0.0.1:{PORT}"
+STUN_PORT = 3479
+STUN_URL = f"stun:127.0.0.1:{STUN_PORT}"
+MODES = ("full", "trickle", "early")
+
+
+class SlowStunServer(asyncio.DatagramProtocol):
+    """Answers STUN binding requests after `delay` seconds"""
+
+    delay = 0.0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            request = stun.parse_message(data)
+        except ValueError:
+            return
+        response = stun.Message(
+            message_method=stun.Method.BINDING,
+            message_class=stun.Class.RESPONSE,
+            transaction_id=request.transaction_id,
+        )
+        response.attributes["XOR-MAPPED-ADDRESS"] = addr
+        asyncio.get_event_loop().call_later(
+            self.delay, self.transport.sendto, bytes(response), addr
+        )
+
+
+async def add_relay_candidates(ws, pc):
+    """Add the candidates the relay trickles; other messages are ignored"""
+    async for message in ws:
+        if message.type != aiohttp.WSMsgType.TEXT:
+            continue
+        data = json.loads(message.data)
+        if data["type"] == "ice_candidate":
+            await pc.addIceCandidate(parse_candidate(data["candidate"]))
+
+
+async def send_json(ws, message: dict):
+    await ws.send_str(json.dumps(message))
+
+
+async def run_receiver(session, stream_id: str, mode: str, result: dict):
+    started = time.perf_counter()
+    ws = await session.ws_connect(f"{BASE_URL}/ws")
+    result["ws"] = ws
+    await send_json(
+        ws,
+        {"type": "start_receiving", "stream_id": stream_id, "trickle": mode != "full"},
+    )
+    offer = await next_message(ws, "webrtc_offer")
+    result["offer"] = time.perf_counter() - started
+
+    pc = RTCPeerConnection(RTCConfiguration(iceServers=[RTCIceServer(STUN_URL)]))
+    result["pc"] = pc
+    connected = asyncio.Event()
+
+    @pc.on("iceconnectionstatechange")
+    def on_iceconnectionstatechange():
+        if pc.iceConnectionState == "completed":
+            result["ice"] = time.perf_counter() - started
+
+    @pc.on("connectionstatechange")
+    def on_connectionstatechange():
+        if pc.connectionState == "connected":
+            result["connected"] = time.perf_counter() - started
+            connected.set()
+
+    await pc.setRemoteDescription(RTCSessionDescription(**offer["offer"]))
+    result["listener"] = asyncio.ensure_future(add_relay_candidates(ws, pc))
+    answer = await pc.createAnswer()
+    # createAnswer's description has the ICE credentials but no candidates
+    answer_message = {
+        "type": "webrtc_answer",
+        "answer": {"sdp": answer.sdp, "type": "answer"},
+    }
+    if mode == "full":
+        await pc.setLocalDescription(answer)
+        answer_message["answer"]["sdp"] = pc.localDescription.sdp
+        await send_json(ws, answer_message)
+    elif mode == "trickle":
+        await send_json(ws, answer_message)
+        await pc.setLocalDescription(answer)
+        for message in candidate_messages(pc):
+            await send_json(ws, message)
+    else:
+        await pc.setLocalDescription(answer)
+        for message in candidate_messages(pc):
+            await send_json(ws, message)
+        await send_json(ws, answer_message)
+    await connected.wait()
+
+
+async def measure(mode: str, receivers: int):
+    sender = {}
+    results = []
+    async with aiohttp.ClientSession() as session:
+        await asyncio.wait_for(run_sender(session, BASE_URL, ToneTrack(), sender), 20)
+        for _ in range(receivers):
+            result = {}
+            try:
+                await asyncio.wait_for(
+                    run_receiver(session, sender["stream_id"], mode, result), 20
+                )
+            except asyncio.TimeoutError:
+                pass
+            if "listener" in result:
+                result["listener"].cancel()
+            await close(result)
+            results.append(result)
+        await close(sender)
+    return results
+
+
+async def run(args):
+    loop = asyncio.get_event_loop()
+    transport, stun_server = await loop.create_datagram_endpoint(
+        SlowStunServer, local_addr=("127.0.0.1", STUN_PORT)
+    )
+    try:
+        for mode, delay_ms in itertools.product(args.modes, args.stun_delay_ms):
+            stun_server.delay = delay_ms / 1000
+            results = await measure(mode, args.receivers)
+            joined = sum("connected" in r for r in results)
+            print(
+                f"{mode:<8} {delay_ms:>8g} {joined:>4}/{len(results):<2} "
+                f"{median_ms(results, 'offer'):>9.1f} "
+                f"{median_ms(results, 'ice'):>8.1f} "
+                f"{median_ms(results, 'connected'):>13.1f}"
+            )
+    finally:
+        transport.close()
+
+
+def median_ms(results, key):
+    values = [r[key] for r in results if key in r]
+    return statistics.median(values) * 1000 if values else float("nan")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument(
+        "--stun-delay-ms",
+        type=float,
+        nargs="+",
+        default=[0, 100],
+        help="how long the STUN stand-in waits before answering",
+    )
+    parser.add_argument(
+        "--receivers", type=int, default=10, help="receivers joined per configuration"
+    )
+    args = parser.parse_args()
+
+    print("Trickle ICE Benchmark")
+    print("=" * 30)
+    print(
+        f"{'mode':<8} {'STUN ms':>8} {'joined':>7} {'offer ms':>9} "
+        f"{'ICE ms':>8} {'connected ms':>13}"
+    )
+    relay = subprocess.Popen(
+        [
+            sys.executable,
+            "webrtc_server_relay.py",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(PORT),
+            "--ice-server",
+            STUN_URL,
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_healthy(BASE_URL)
+        asyncio.run(run(args))
+    finally:
+        relay.terminate()
+        relay.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Mouth-to-ear latency benchmark for the relay server.
+A synthetic sender streams silence with a 40 ms tone burst every 200 ms.
+Each burst's frequency is one of eight, and that frequency codes the
+burst's number modulo 8. Receivers decode the stream, detect each burst's
+onset with one Goertzel filter per frequency, and match it to the burst
+the sender captured. Latency runs from the moment the burst entered the
+sender's encoder to the moment its first frame left the receiver's
+decoder. This covers Opus coding, both peer connections, the relay and
+the jitter buffer, on loopback.
+
+Runs every combination of receiver count, relay mode (forwarding the
+sender's packets or transcoding) and simulated uplink jitter, and reports
+the latency distribution and jitter of each. With --max-p95-ms or
+--max-jitter-ms it exits with status 1 when any configuration exceeds
+them, so it can gate a build.
+"""
+
+import argparse
+import asyncio
+import fractions
+import itertools
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+import numpy as np
+from aiortc.mediastreams import MediaStreamError, MediaStreamTrack
+from av import AudioFrame
+
+from load_test import (
+    SAMPLE_RATE,
+    SAMPLES_PER_FRAME,
+    close,
+    run_receiver,
+    run_sender,
+    wait_until_healthy,
+)
+
+PORT = 8094
+BASE_URL = f"http://127.0.0.1:{PORT}"
+BURST_PERIOD_FRAMES = 10  # 200 ms
+BURST_FRAMES = 2  # 40 ms
+# Multiples of 50 Hz, so each 20 ms frame holds whole periods
+BURST_FREQUENCIES = (500, 750, 1000, 1250, 1500, 1750, 2000, 2250)
+BURST_AMPLITUDE = 10000
+# Goertzel magnitude of a full-amplitude tone over one frame is A * N / 2
+DETECTION_THRESHOLD = 0.25 * BURST_AMPLITUDE * SAMPLES_PER_FRAME / 2
+
+
+class BurstTrack(MediaStreamTrack):
+    """Silence with coded tone bursts, recording when each burst is captured"""
+
+    kind = "audio"
+
+    def __init__(self, jitter: float = 0.0):
+        super().__init__()
+        # Extra random delay per frame, like a jittery uplink
+        self.jitter = jitter
+        self.bursts = []  # (code, capture time)
+        t = np.arange(SAMPLES_PER_FRAME) / SAMPLE_RATE
+        self._tones = [
+            (np.sin(2 * math.pi * frequency * t) * BURST_AMPLITUDE).astype(np.int16)
+            for frequency in BURST_FREQUENCIES
+        ]
+        self._silence = np.zeros(SAMPLES_PER_FRAME, dtype=np.int16)
+        self._index = 0
+        self._start = None
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+
+        if self._start is None:
+            self._start = time.perf_counter()
+        else:
+            self._index += 1
+        # The moment this frame's audio was spoken
+        captured = self._start + self._index * SAMPLES_PER_FRAME / SAMPLE_RATE
+        delay = captured - time.perf_counter()
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        await asyncio.sleep(delay)
+
+        burst, position = divmod(self._index, BURST_PERIOD_FRAMES)
+        samples = self._silence
+        if position < BURST_FRAMES:
+            code = burst % len(BURST_FREQUENCIES)
+            samples = self._tones[code]
+            if position == 0:
+                self.bursts.append((code, captured))
+
+        frame = AudioFrame.from_ndarray(
+            samples.reshape(1, -1), format="s16", layout="mono"
+        )
+        frame.pts = self._index * SAMPLES_PER_FRAME
+        frame.sample_rate = SAMPLE_RATE
+        frame.time_base = fractions.Fraction(1, SAMPLE_RATE)
+        return frame
+
+
+class BurstDetector:
+    """Finds burst onsets in decoded frames and reports their codes"""
+
+    def __init__(self):
+        self.onsets = []  # (code, time the frame left the decoder)
+        self._filters = {}
+        # Ignore a burst already under way when the receiver joins
+        self._in_burst = True
+
+    def _filter_bank(self, samples: int):
+        # Complex exponentials, one row per burst frequency
+        if samples not in self._filters:
+            n = np.arange(samples)
+            self._filters[samples] = np.exp(
+                -2j * math.pi * np.outer(BURST_FREQUENCIES, n) / SAMPLE_RATE
+            )
+        return self._filters[samples]
+
+    def __call__(self, frame):
+        received = time.perf_counter()
+        channels = len(frame.layout.channels)
+        # Packed s16: the first channel of interleaved samples
+        mono = frame.to_ndarray().reshape(-1)[::channels].astype(np.float64)
+        magnitudes = np.abs(self._filter_bank(mono.shape[0]) @ mono)
+        code = int(np.argmax(magnitudes))
+        # Frames longer or shorter than 20 ms scale the expected magnitude
+        if magnitudes[code] > DETECTION_THRESHOLD * mono.shape[0] / SAMPLES_PER_FRAME:
+            if not self._in_burst:
+                self.onsets.append((code, received))
+            self._in_burst = True
+        else:
+            self._in_burst = False
+
+
+def match_latencies(bursts, onsets):
+    """Latency of each onset to the latest earlier burst with the same code"""
+    latencies = []
+    for code, received in onsets:
+        captured = [t for c, t in bursts if c == code and t <= received]
+        if captured:
+            latencies.append(received - captured[-1])
+    return latencies
+
+
+def summarize(latencies):
+    if not latencies:
+        return None
+    ordered = sorted(latencies)
+
+    def at(q):
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)] * 1000
+
+    # Mean change between consecutive bursts, as in RFC 3550
+    changes = [abs(b - a) for a, b in zip(latencies, latencies[1:])]
+    return {
+        "samples": len(latencies),
+        "p50_ms": at(0.5),
+        "p95_ms": at(0.95),
+        "p99_ms": at(0.99),
+        "max_ms": ordered[-1] * 1000,
+        "stdev_ms": statistics.pstdev(latencies) * 1000,
+        "jitter_ms": statistics.mean(changes) * 1000 if changes else 0.0,
+    }
+
+
+async def measure(receivers: int, jitter: float, seconds: float):
+    track = BurstTrack(jitter)
+    sender = {}
+    detectors = [BurstDetector() for _ in range(receivers)]
+    results = [{} for _ in range(receivers)]
+    async with aiohttp.ClientSession() as session:
+        await asyncio.wait_for(run_sender(session, BASE_URL, track, sender), 20)
+        await asyncio.gather(
+            *[
+                asyncio.wait_for(
+                    run_receiver(
+                        session, BASE_URL, sender["stream_id"], result, detector
+                    ),
+                    20,
+                )
+                for result, detector in zip(results, detectors)
+            ]
+        )
+        await asyncio.sleep(seconds)
+        for result in results + [sender]:
+            await close(result)
+
+    latencies = []
+    for detector in detectors:
+        latencies.extend(match_latencies(track.bursts, detector.onsets))
+    return summarize(latencies)
+
+
+def start_relay(mode: str):
+    arguments = ["webrtc_server_relay.py", "--host", "127.0.0.1", "--port", str(PORT)]
+    if mode == "transcode":
+        arguments.append("--transcode")
+    return subprocess.Popen(
+        [sys.executable, *arguments],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--receivers", type=int, nargs="+", default=[1, 10], help="receiver counts"
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=["forward", "transcode"],
+        default=["forward", "transcode"],
+    )
+    parser.add_argument(
+        "--jitter-ms",
+        type=float,
+        nargs="+",
+        default=[0, 20],
+        help="random extra uplink delay per frame, up to this many ms",
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=10, help="seconds measured per configuration"
+    )
+    parser.add_argument("--max-p95-ms", type=float, help="fail above this p95")
+    parser.add_argument("--max-jitter-ms", type=float, help="fail above this jitter")
+    parser.add_argument("--json", help="write the results here")
+    args = parser.parse_args()
+
+    print("Mouth-to-Ear Latency Benchmark")
+    print("=" * 30)
+    print(
+        f"{'mode':<10} {'receivers':>9} {'jitter':>7} {'bursts':>7} {'p50 ms':>7} "
+        f"{'p95 ms':>7} {'p99 ms':>7} {'max ms':>7} {'jitter ms':>10}"
+    )
+    results = []
+    failures = []
+    for mode in args.modes:
+        relay = start_relay(mode)
+        try:
+            wait_until_healthy(BASE_URL)
+            for receivers, jitter_ms in itertools.product(
+                args.receivers, args.jitter_ms
+            ):
+                summary = asyncio.run(
+                    measure(receivers, jitter_ms / 1000, args.seconds)
+                )
+                results.append(
+                    {
+                        "mode": mode,
+                        "receivers": receivers,
+                        "uplink_jitter_ms": jitter_ms,
+                        "latency": summary,
+                    }
+                )
+                name = f"{mode} x{receivers} +{jitter_ms:g} ms"
+                if summary is None:
+                    print(
+                        f"{mode:<10} {receivers:>9} {jitter_ms:>7g} no bursts detected"
+                    )
+                    failures.append(f"{name}: no bursts detected")
+                    continue
+                print(
+                    f"{mode:<10} {receivers:>9} {jitter_ms:>7g} "
+                    f"{summary['samples']:>7} {summary['p50_ms']:>7.1f} "
+                    f"{summary['p95_ms']:>7.1f} {summary['p99_ms']:>7.1f} "
+                    f"{summary['max_ms']:>7.1f} {summary['jitter_ms']:>10.1f}"
+                )
+                if args.max_p95_ms is not None and summary["p95_ms"] > args.max_p95_ms:
+                    failures.append(
+                        f"{name}: p95 {summary['p95_ms']:.1f} ms > {args.max_p95_ms:g}"
+                    )
+                if (
+                    args.max_jitter_ms is not None
+                    and summary["jitter_ms"] > args.max_jitter_ms
+                ):
+                    failures.append(
+                        f"{name}: jitter {summary['jitter_ms']:.1f} ms "
+                        f"> {args.max_jitter_ms:g}"
+                    )
+        finally:
+            relay.terminate()
+            relay.wait()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures and (args.max_p95_ms is not None or args.max_jitter_ms is not None):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
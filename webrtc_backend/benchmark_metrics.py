@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Metrics overhead benchmark for the relay server.
+Measures what the /metrics instrumentation costs on the media path: the
+time per counter increment and histogram observation, the time per packet
+of PacketForwarder.handle_rtp_packet for 1, 10 and 50 receivers with its
+counters bound and with them replaced by no-ops, and the time to render a
+scrape with many streams' series.
+"""
+
+import argparse
+import gc
+import time
+
+from aiortc.rtp import RtpPacket
+
+import metrics
+from packet_forwarding import PacketForwarder
+
+OPUS_PAYLOAD_TYPE = 111
+SAMPLES_PER_PACKET = 960  # 20 ms
+
+
+class NoOpMetric:
+    def inc(self, amount=1):
+        pass
+
+
+def ns_per_call(function, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - started) * 1e9 / calls
+
+
+def measure_primitives(calls: int):
+    counter = metrics.Counter("bench_counter_total", "Benchmark", ["stream"]).labels(
+        "bench"
+    )
+    histogram = metrics.Histogram("bench_seconds", "Benchmark").labels()
+    noop = NoOpMetric()
+    return {
+        "no-op call": ns_per_call(noop.inc, calls),
+        "Counter.inc": ns_per_call(counter.inc, calls),
+        "Histogram.observe": ns_per_call(lambda: histogram.observe(0.003), calls),
+    }
+
+
+def measure_forwarding(receivers: int, packet_count: int, instrumented: bool):
+    packets = [
+        RtpPacket(
+            payload_type=OPUS_PAYLOAD_TYPE,
+            sequence_number=i & 0xFFFF,
+            timestamp=i * SAMPLES_PER_PACKET,
+            payload=bytes(80),
+        )
+        for i in range(packet_count)
+    ]
+    # Queues large enough that no receiver drops, so only forwarding is timed
+    forwarder = PacketForwarder(None, "bench", queue_size=packet_count + 1)
+    forwarder._payload_type = OPUS_PAYLOAD_TYPE
+    for i in range(receivers):
+        forwarder.subscribe(f"receiver_{i}")
+    if not instrumented:
+        forwarder._received_metric = forwarder._forwarded_metric = NoOpMetric()
+
+    # Collections of the queued packets would swamp the difference
+    gc.collect()
+    gc.disable()
+    started = time.perf_counter()
+    for packet in packets:
+        forwarder.handle_rtp_packet(packet)
+    elapsed = time.perf_counter() - started
+    gc.enable()
+    forwarder.stop()
+    metrics.REGISTRY.forget_stream("bench")
+    return elapsed * 1e9 / packet_count
+
+
+def measure_render(streams: int, scrapes: int):
+    for i in range(streams):
+        stream_id = f"stream_{i}"
+        for metric in (
+            metrics.PACKETS_RECEIVED,
+            metrics.PACKETS_FORWARDED,
+            metrics.FRAMES_RECEIVED,
+            metrics.FRAMES_FORWARDED,
+            metrics.RECEIVER_DROPS,
+        ):
+            metric.labels(stream_id).inc(1000)
+    for message_type in ("start_sending", "start_receiving", "webrtc_answer"):
+        metrics.MESSAGE_SECONDS.labels(message_type).observe(0.002)
+
+    started = time.perf_counter()
+    for _ in range(scrapes):
+        body = metrics.REGISTRY.render()
+    elapsed = (time.perf_counter() - started) / scrapes
+
+    for i in range(streams):
+        metrics.REGISTRY.forget_stream(f"stream_{i}")
+    return elapsed * 1000, len(body), body.count("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--packets", type=int, default=20000)
+    parser.add_argument(
+        "--receivers", type=int, nargs="+", default=[1, 10, 50], help="receiver counts"
+    )
+    parser.add_argument(
+        "--streams", type=int, default=500, help="streams in the rendered scrape"
+    )
+    args = parser.parse_args()
+
+    print("Metrics Overhead Benchmark")
+    print("=" * 30)
+
+    primitives = measure_primitives(1_000_000)
+    for name, ns in primitives.items():
+        print(f"{name:<18} {ns:>8.0f} ns")
+
+    print()
+    print(f"PacketForwarder.handle_rtp_packet, {args.packets} packets")
+    print(f"{'receivers':>9} {'no-op ns':>10} {'metrics ns':>11} {'overhead':>9}")
+    for receivers in args.receivers:
+        # Interleave the variants so both see the same machine state
+        runs = {False: [], True: []}
+        for _ in range(5):
+            for instrumented in (False, True):
+                runs[instrumented].append(
+                    measure_forwarding(receivers, args.packets, instrumented)
+                )
+        baseline, instrumented = min(runs[False]), min(runs[True])
+        print(
+            f"{receivers:>9} {baseline:>10.0f} {instrumented:>11.0f} "
+            f"{(instrumented - baseline) / baseline * 100:>8.1f}%"
+        )
+
+    # A forwarded packet costs one received and one forwarded increment
+    per_packet = 2 * (primitives["Counter.inc"] - primitives["no-op call"])
+    print(f"Metrics cost per forwarded packet: {per_packet:.0f} ns")
+
+    print()
+    render_ms, size, lines = measure_render(args.streams, 20)
+    print(
+        f"Scrape with {args.streams} streams: {render_ms:.1f} ms, "
+        f"{lines} lines, {size / 1024:.0f} KiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the per-message and per-frame hot paths.
+Times, with stub WebSockets and synthetic frames, the relay's
+handle_message dispatch, JSON encoding and decoding of signaling
+messages, broadcast_stream_available to 10, 100 and 1,000 connections,
+connection setup and cleanup_connection churn, and the per-frame
+conversion and aggregation in webrtc_server.py's process_audio_stream.
+
+Each case reports its best throughput over several runs, the peak memory
+a batch allocates above its starting point, and the bytes it retains per
+operation. --save-baseline stores the results as a JSON baseline. Later
+runs are compared with it and exit with status 1 if a case loses more
+than --threshold percent of its throughput or allocates that much more,
+in its first run and again when it is re-measured.
+Baselines are only comparable on the same machine and Python.
+"""
+
+import argparse
+import asyncio
+import fractions
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from aiortc.mediastreams import MediaStreamError
+from av import AudioFrame
+
+import webrtc_server
+import webrtc_server_relay
+from outbound import OutboundQueue
+from stream_fanout import StreamFanout
+
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "benchmark_micro_baseline.json"
+)
+# Differences smaller than these are noise, whatever the percentage
+PEAK_SLACK_BYTES = 1024
+RETAINED_SLACK_BYTES = 16
+
+OFFER_SDP = "\r\n".join(
+    [
+        "v=0",
+        "o=- 3912345678 3912345678 IN IP4 0.0.0.0",
+        "s=-",
+        "t=0 0",
+        "a=group:BUNDLE 0",
+        "a=msid-semantic:WMS *",
+        "m=audio 9 UDP/TLS/RTP/SAVPF 111 0 8",
+        "c=IN IP4 0.0.0.0",
+        "a=sendrecv",
+        "a=mid:0",
+        "a=msid:1c2d3e4f 5a6b7c8d",
+        "a=rtcp:9 IN IP4 0.0.0.0",
+        "a=rtcp-mux",
+        "a=ssrc:1234567890 cname:a1b2c3d4-e5f6",
+        "a=rtpmap:111 opus/48000/2",
+        "a=fmtp:111 minptime=10;useinbandfec=1",
+        "a=rtpmap:0 PCMU/8000",
+        "a=rtpmap:8 PCMA/8000",
+        "a=candidate:1 1 udp 2130706431 192.168.1.20 50000 typ host",
+        "a=candidate:2 1 udp 1694498815 203.0.113.7 50000 typ srflx "
+        "raddr 192.168.1.20 rport 50000",
+        "a=end-of-candidates",
+        "a=ice-ufrag:abcd",
+        "a=ice-pwd:0123456789abcdef01234567",
+        "a=fingerprint:sha-256 " + ":".join(["AB"] * 32),
+        "a=setup:actpass",
+        "",
+    ]
+)
+OFFER_MESSAGE = {"type": "webrtc_offer", "offer": {"sdp": OFFER_SDP, "type": "offer"}}
+
+
+class StubWebSocket:
+    """WebSocket stand-in that accepts every message at once"""
+
+    async def send_str(self, message: str):
+        pass
+
+    async def send_bytes(self, message: bytes):
+        pass
+
+    async def close(self, code=None):
+        pass
+
+
+class StubTrack:
+    """Hands out prepared frames, then ends like a remote track"""
+
+    kind = "audio"
+
+    def __init__(self, frames):
+        self._frames = iter(frames)
+
+    async def recv(self):
+        try:
+            return next(self._frames)
+        except StopIteration:
+            raise MediaStreamError
+
+
+def synthetic_frames(count: int):
+    """20 ms of 48 kHz stereo, as aiortc's Opus decoder hands them out"""
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(count):
+        samples = (rng.standard_normal(1920) * 3000).astype(np.int16)
+        frame = AudioFrame.from_ndarray(
+            samples.reshape(1, -1), format="s16", layout="stereo"
+        )
+        frame.sample_rate = 48000
+        frame.pts = i * 960
+        frame.time_base = fractions.Fraction(1, 48000)
+        frames.append(frame)
+    return frames
+
+
+def relay_server(connections: int = 0):
+    server = webrtc_server_relay.VoiceStreamingServer()
+    for i in range(connections):
+        add_connection(server, f"client_{i}", maxsize=0)
+    return server
+
+
+def add_connection(server, connection_id: str, maxsize: int = 64):
+    ws = StubWebSocket()
+    outbound = OutboundQueue(ws, connection_id, maxsize=maxsize)
+    server.connections[connection_id] = {
+        "ws": ws,
+        "outbound": outbound,
+        "pc": None,
+        "role": None,
+        "stream_id": None,
+        "track": None,
+        "forwarded": False,
+        "trace": None,
+        "session_stats": False,
+        "trickle": False,
+        "pending_candidates": [],
+    }
+    return outbound
+
+
+def case_json_decode(ops: int = 20000):
+    text = json.dumps(OFFER_MESSAGE)
+
+    async def batch():
+        for _ in range(ops):
+            json.loads(text)
+        return ops
+
+    return batch
+
+
+def case_json_encode(ops: int = 20000):
+    async def batch():
+        for _ in range(ops):
+            json.dumps(OFFER_MESSAGE)
+        return ops
+
+    return batch
+
+
+def case_handle_message(ops: int = 20000):
+    server = relay_server(1)
+    # No peer connection yet, so only the dispatch runs
+    message = {"type": "webrtc_answer", "answer": {"sdp": "", "type": "answer"}}
+
+    async def batch():
+        for _ in range(ops):
+            await server.handle_message("client_0", message)
+        return ops
+
+    return batch
+
+
+def case_broadcast(connections: int):
+    server = relay_server(connections)
+    ops = max(5, 20000 // connections)
+
+    async def batch():
+        for _ in range(ops):
+            await server.broadcast_stream_available("stream_bench")
+        # Writers are not running; empty the queues for the next batch
+        for connection in server.connections.values():
+            queue = connection["outbound"]._queue
+            while not queue.empty():
+                queue.get_nowait()
+        return ops
+
+    return batch
+
+
+def case_cleanup_churn(ops: int = 2000):
+    """A receiver connects, subscribes to a stream and disconnects"""
+    server = relay_server()
+    fanout = StreamFanout(None, "stream_bench")
+    server.active_streams["stream_bench"] = {
+        "fanout": fanout,
+        "forwarder": None,
+        "receivers": [],
+        "bridges": set(),
+    }
+
+    async def batch():
+        for i in range(ops):
+            connection_id = f"receiver_{i}"
+            add_connection(server, connection_id).start()
+            connection = server.connections[connection_id]
+            connection.update(
+                role="receiver",
+                stream_id="stream_bench",
+                track=fanout.subscribe(connection_id),
+            )
+            server.active_streams["stream_bench"]["receivers"].append(connection_id)
+            await server.cleanup_connection(connection_id)
+        return ops
+
+    return batch
+
+
+def case_process_audio(window_ms: int, frame_count: int = 1000):
+    server = webrtc_server.VoiceStreamingServer()
+    if server.recorder:
+        server.recorder.stop()
+        server.recorder = None
+    frames = synthetic_frames(frame_count)
+
+    async def batch():
+        server.connections["sender"] = {
+            "ws": StubWebSocket(),
+            "pc": None,
+            "recording": None,
+            "window_ms": window_ms,
+            "max_latency_ms": 100,
+        }
+        await server.process_audio_stream(StubTrack(frames), "sender")
+        return frame_count
+
+    return batch
+
+
+CASES = {
+    "json_decode_offer": case_json_decode,
+    "json_encode_offer": case_json_encode,
+    "handle_message_dispatch": case_handle_message,
+    "broadcast_10": lambda: case_broadcast(10),
+    "broadcast_100": lambda: case_broadcast(100),
+    "broadcast_1000": lambda: case_broadcast(1000),
+    "cleanup_connection_churn": case_cleanup_churn,
+    "process_audio_frame_20ms": lambda: case_process_audio(20),
+    "process_audio_frame_100ms": lambda: case_process_audio(100),
+}
+
+
+async def measure(name: str, repeats: int):
+    batch = CASES[name]()
+    await batch()  # warm up caches and lazily created state
+
+    best = 0.0
+    gc.disable()  # a collection landing in one run is not the code's cost
+    try:
+        for _ in range(repeats):
+            started = time.perf_counter()
+            ops = await batch()
+            best = max(best, ops / (time.perf_counter() - started))
+    finally:
+        gc.enable()
+
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    ops = await batch()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "ops_per_second": best,
+        "peak_bytes": max(0, peak - start),
+        "retained_bytes_per_op": max(0.0, (current - start) / ops),
+    }
+
+
+def regressions(result: dict, baseline: dict, threshold: float):
+    """Descriptions of every way `result` is worse than `baseline`"""
+    found = []
+    floor = baseline["ops_per_second"] * (1 - threshold)
+    if result["ops_per_second"] < floor:
+        found.append("throughput")
+    for key, slack in (
+        ("peak_bytes", PEAK_SLACK_BYTES),
+        ("retained_bytes_per_op", RETAINED_SLACK_BYTES),
+    ):
+        limit = max(baseline[key] * (1 + threshold), baseline[key] + slack)
+        if result[key] > limit:
+            found.append(key.replace("_", " "))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--repeats", type=int, default=7)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store these results as the baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10,
+        help="percent of throughput lost or allocations gained that fails a case",
+    )
+    args = parser.parse_args()
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["cases"]
+
+    print("Hot Path Microbenchmarks")
+    print("=" * 30)
+    print(
+        f"{'case':<26} {'ops/s':>11} {'vs base':>8} {'peak KiB':>9} "
+        f"{'B/op kept':>9}  status"
+    )
+    results = {}
+    failed = False
+    for name in args.cases:
+        result = asyncio.run(measure(name, args.repeats))
+        results[name] = result
+        change, status = "", "no baseline"
+        if name in baseline:
+            reference = baseline[name]
+            change = f"{(result['ops_per_second'] / reference['ops_per_second'] - 1) * 100:+.1f}%"
+            worse = regressions(result, reference, args.threshold / 100)
+            if worse:
+                # Measure again before blaming the code for a noisy neighbour
+                result = asyncio.run(measure(name, args.repeats))
+                results[name] = result
+                worse = regressions(result, reference, args.threshold / 100)
+            status = f"REGRESSED: {', '.join(worse)}" if worse else "ok"
+            failed = failed or bool(worse)
+        elif args.save_baseline:
+            status = "saved"
+        print(
+            f"{name:<26} {result['ops_per_second']:>11,.0f} {change:>8} "
+            f"{result['peak_bytes'] / 1024:>9.1f} "
+            f"{result['retained_bytes_per_op']:>9.1f}  {status}"
+        )
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"python": sys.version.split()[0], "cases": results}, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    elif failed:
+        print(f"Regressions over {args.threshold:g}% against {args.baseline}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
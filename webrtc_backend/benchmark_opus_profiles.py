@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Bandwidth and CPU per stream for each Opus profile.
+Encodes a synthetic room microphone, background noise with occasional
+speech-like bursts, with libopus set up the way a browser sets itself up
+from the profile's fmtp and ptime: bitrate, DTX, in-band FEC and frame
+size, in mono. "none" is what the sender does with aiortc's unmodified
+answer (20 ms, 32 kbit/s, no DTX or FEC).
+
+Reports packets per second, payload and on-the-wire bitrate (with 50
+bytes of RTP, SRTP, UDP and IPv4 headers per packet; DTX frames of one or
+two bytes are not sent, as in browsers), the sender's encoding CPU, and
+the relay's CPU for the stream: decoding every packet once and packing it
+for each of --receivers receivers.
+
+FFmpeg's libopus wrapper cannot enable DTX, so libopus is called directly;
+it is found on the library path or among PyAV's bundled libraries.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import glob
+import os
+import sys
+import time
+
+import av
+import numpy as np
+from aiortc.codecs import get_encoder
+from aiortc.codecs.opus import OpusDecoder
+from aiortc.jitterbuffer import JitterFrame
+from aiortc.rtcrtpparameters import RTCRtpCodecParameters
+from av import Packet
+
+from opus_profiles import PROFILES
+from packet_forwarding import OPUS_TIME_BASE
+
+SAMPLE_RATE = 48000
+# RTP 12, SRTP authentication tag 10, UDP 8 and IPv4 20 bytes
+HEADER_BYTES = 50
+MAX_PACKET_BYTES = 1500
+OPUS_APPLICATION_VOIP = 2048
+OPUS_SET_BITRATE_REQUEST = 4002
+OPUS_SET_INBAND_FEC_REQUEST = 4012
+OPUS_SET_PACKET_LOSS_PERC_REQUEST = 4014
+OPUS_SET_DTX_REQUEST = 4016
+OPUS_CODEC = RTCRtpCodecParameters(
+    mimeType="audio/opus", clockRate=48000, channels=2, payloadType=111
+)
+# aiortc's answer has no fmtp, so browsers use their defaults
+UNTUNED = {
+    "ptime": 20,
+    "fmtp": {"maxaveragebitrate": 32000, "usedtx": 0, "useinbandfec": 0},
+}
+
+
+def load_libopus():
+    candidates = [ctypes.util.find_library("opus")] + sorted(
+        glob.glob(
+            os.path.join(os.path.dirname(av.__file__), "..", "av.libs", "libopus*")
+        )
+    )
+    for path in candidates:
+        if not path:
+            continue
+        try:
+            lib = ctypes.CDLL(path)
+        except OSError:
+            continue
+        lib.opus_encoder_create.restype = ctypes.c_void_p
+        lib.opus_encoder_create.argtypes = [
+            ctypes.c_int32,
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.POINTER(ctypes.c_int),
+        ]
+        lib.opus_encode.restype = ctypes.c_int32
+        lib.opus_encode.argtypes = [
+            ctypes.c_void_p,
+            ctypes.POINTER(ctypes.c_int16),
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_int32,
+        ]
+        lib.opus_encoder_destroy.argtypes = [ctypes.c_void_p]
+        return lib
+    sys.exit("libopus not found; install it (e.g. libopus0) or PyAV's wheel")
+
+
+class LibopusEncoder:
+    """A mono libopus encoder configured from a profile, as a browser would"""
+
+    def __init__(self, lib, profile: dict, loss_percent: int):
+        fmtp = profile["fmtp"]
+        self.lib = lib
+        self.frame_samples = SAMPLE_RATE * profile["ptime"] // 1000
+        error = ctypes.c_int()
+        self.state = lib.opus_encoder_create(
+            SAMPLE_RATE, 1, OPUS_APPLICATION_VOIP, ctypes.byref(error)
+        )
+        if error.value:
+            raise RuntimeError(f"opus_encoder_create failed: {error.value}")
+        for request, value in (
+            (OPUS_SET_BITRATE_REQUEST, fmtp["maxaveragebitrate"]),
+            (OPUS_SET_DTX_REQUEST, fmtp["usedtx"]),
+            (OPUS_SET_INBAND_FEC_REQUEST, fmtp["useinbandfec"]),
+            (OPUS_SET_PACKET_LOSS_PERC_REQUEST, loss_percent),
+        ):
+            lib.opus_encoder_ctl(
+                ctypes.c_void_p(self.state), ctypes.c_int(request), ctypes.c_int(value)
+            )
+        self.buffer = ctypes.create_string_buffer(MAX_PACKET_BYTES)
+
+    def encode(self, samples: np.ndarray) -> bytes:
+        length = self.lib.opus_encode(
+            self.state,
+            samples.ctypes.data_as(ctypes.POINTER(ctypes.c_int16)),
+            self.frame_samples,
+            self.buffer,
+            MAX_PACKET_BYTES,
+        )
+        if length < 0:
+            raise RuntimeError(f"opus_encode failed: {length}")
+        return self.buffer.raw[:length]
+
+    def close(self):
+        self.lib.opus_encoder_destroy(self.state)
+
+
+def room_signal(seconds: float, activity: float) -> np.ndarray:
+    """Mono int16 room noise with speech-like bursts `activity` of the time"""
+    rng = np.random.default_rng(0)
+    samples = int(seconds * SAMPLE_RATE)
+    signal = rng.standard_normal(samples) * 20  # about -64 dBFS
+    burst = int(1.5 * SAMPLE_RATE)
+    t = np.arange(burst) / SAMPLE_RATE
+    for start in range(0, samples - burst, burst):
+        if rng.random() >= activity:
+            continue
+        pitch = rng.uniform(100, 220) * (1 + 0.05 * np.sin(2 * np.pi * 3 * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+        voiced = sum(np.sin(k * phase) / k for k in range(1, 8))
+        syllables = np.abs(np.sin(2 * np.pi * rng.uniform(3, 5) * t))
+        signal[start : start + burst] += (
+            voiced * syllables * 4000 + rng.standard_normal(burst) * 300
+        )
+    return np.clip(signal, -32768, 32767).astype(np.int16)
+
+
+def measure(lib, profile: dict, signal: np.ndarray, receivers: int, loss_percent):
+    encoder = LibopusEncoder(lib, profile, loss_percent)
+    frame_samples = encoder.frame_samples
+    payloads = []
+    cpu_start = time.process_time()
+    for start in range(0, len(signal) - frame_samples + 1, frame_samples):
+        payloads.append((start, encoder.encode(signal[start : start + frame_samples])))
+    sender_cpu = time.process_time() - cpu_start
+    encoder.close()
+    # Browsers do not send DTX frames, only the periodic comfort-noise updates
+    sent = [(start, payload) for start, payload in payloads if len(payload) > 2]
+
+    decoder = OpusDecoder()
+    packers = [get_encoder(OPUS_CODEC) for _ in range(receivers)]
+    cpu_start = time.process_time()
+    for start, payload in sent:
+        decoder.decode(JitterFrame(payload, start))
+        packet = Packet(payload)
+        packet.pts = start
+        packet.time_base = OPUS_TIME_BASE
+        for packer in packers:
+            packer.pack(packet)
+    relay_cpu = time.process_time() - cpu_start
+
+    seconds = len(signal) / SAMPLE_RATE
+    payload_bytes = sum(len(payload) for _, payload in sent)
+    return {
+        "packets_per_second": len(sent) / seconds,
+        "payload_kbps": payload_bytes * 8 / seconds / 1000,
+        "wire_kbps": (payload_bytes + HEADER_BYTES * len(sent)) * 8 / seconds / 1000,
+        "sender_cpu_ms_per_second": sender_cpu * 1000 / seconds,
+        "relay_cpu_ms_per_second": relay_cpu * 1000 / seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--profiles",
+        nargs="+",
+        choices=["none"] + list(PROFILES),
+        default=["none"] + list(PROFILES),
+    )
+    parser.add_argument("--seconds", type=float, default=60, help="audio per profile")
+    parser.add_argument(
+        "--activity",
+        type=float,
+        nargs="+",
+        default=[0.1, 1.0],
+        help="fraction of the time someone is speaking",
+    )
+    parser.add_argument(
+        "--receivers", type=int, default=10, help="receivers the relay forwards to"
+    )
+    parser.add_argument(
+        "--loss-percent",
+        type=int,
+        default=10,
+        help="packet loss the encoder expects; sizes the in-band FEC",
+    )
+    args = parser.parse_args()
+
+    lib = load_libopus()
+    # Warm up libopus and the decoder so the first profile is not charged for it
+    measure(lib, UNTUNED, room_signal(1, 1.0), args.receivers, args.loss_percent)
+    print("Opus Profile Benchmark")
+    print("=" * 30)
+    print(
+        f"{'profile':<15} {'speech':>6} {'pkts/s':>7} {'payload kbps':>12} "
+        f"{'wire kbps':>10} {'sender ms/s':>11} {'relay ms/s':>10}"
+    )
+    for activity in args.activity:
+        signal = room_signal(args.seconds, activity)
+        for name in args.profiles:
+            profile = PROFILES.get(name, UNTUNED)
+            result = measure(lib, profile, signal, args.receivers, args.loss_percent)
+            print(
+                f"{name:<15} {activity:>6.0%} {result['packets_per_second']:>7.1f} "
+                f"{result['payload_kbps']:>12.1f} {result['wire_kbps']:>10.1f} "
+                f"{result['sender_cpu_ms_per_second']:>11.2f} "
+                f"{result['relay_cpu_ms_per_second']:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
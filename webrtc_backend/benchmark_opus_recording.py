@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Opus recording benchmark.
+Records the same Opus packets for many streams twice: decoded to PCM and
+written as WAV, as the server does by default, and written as received
+into Ogg/Opus. Reports total CPU (including the writer threads) and disk
+bytes per stream-minute for each, and checks that the Ogg files decode to
+the expected duration with the lost packets concealed.
+"""
+
+import argparse
+import fractions
+import os
+import shutil
+import tempfile
+import time
+
+import av
+import numpy as np
+from aiortc.codecs.opus import OpusDecoder
+from aiortc.jitterbuffer import JitterFrame
+
+from recording import OPUS_SAMPLE_RATE, Recorder
+
+FRAME_SAMPLES = 960
+
+
+def encode_packets(seconds: int, bitrate: int) -> list:
+    """Opus packets of a speech-like signal, 20 ms each, as a browser sends them"""
+    encoder = av.CodecContext.create("libopus", "w")
+    encoder.sample_rate = OPUS_SAMPLE_RATE
+    encoder.layout = "stereo"
+    encoder.format = "s16"
+    encoder.bit_rate = bitrate
+
+    t = np.arange(OPUS_SAMPLE_RATE * seconds) / OPUS_SAMPLE_RATE
+    pitch = 140 + 20 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / OPUS_SAMPLE_RATE
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 15))
+    mono = (voiced * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)) * 4000).astype(np.int16)
+
+    packets = []
+    for offset in range(0, mono.size, FRAME_SAMPLES):
+        frame = av.AudioFrame.from_ndarray(
+            np.repeat(mono[offset : offset + FRAME_SAMPLES], 2).reshape(1, -1),
+            format="s16",
+            layout="stereo",
+        )
+        frame.sample_rate = OPUS_SAMPLE_RATE
+        frame.pts = offset
+        frame.time_base = fractions.Fraction(1, OPUS_SAMPLE_RATE)
+        packets.extend(bytes(packet) for packet in encoder.encode(frame))
+    return packets
+
+
+def run(fmt: str, packets: list, received: np.ndarray, streams: int, directory: str):
+    recorder = Recorder(directory, queue_size=1_000_000)
+    start_time = time.time()
+    recordings = []
+    decoders = []
+    for number in range(streams):
+        recordings.append(
+            recorder.open_stream(f"stream_{number}", OPUS_SAMPLE_RATE, 2, fmt)
+        )
+        decoders.append(OpusDecoder())
+
+    started = time.process_time()
+    for index, payload in enumerate(packets):
+        if not received[index]:
+            continue
+        rtp_timestamp = index * FRAME_SAMPLES
+        timestamp = start_time + rtp_timestamp / OPUS_SAMPLE_RATE
+        for recording, decoder in zip(recordings, decoders):
+            if fmt == "opus":
+                recording.write_packet(payload, rtp_timestamp, timestamp)
+            else:
+                # What the receiver's decoder and to_ndarray() do for every packet
+                for frame in decoder.decode(JitterFrame(payload, rtp_timestamp)):
+                    recording.write(frame.to_ndarray(), timestamp)
+    recorder.stop()
+    cpu = time.process_time() - started
+
+    files = [
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names
+        if name.endswith("." + fmt)
+    ]
+    return cpu, sum(os.path.getsize(path) for path in files), files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--streams", type=int, default=20)
+    parser.add_argument(
+        "--seconds", type=int, default=60, help="seconds of audio per stream"
+    )
+    parser.add_argument("--bitrate", type=int, default=32000)
+    parser.add_argument(
+        "--loss", type=float, default=0.02, help="fraction of packets lost"
+    )
+    args = parser.parse_args()
+
+    packets = encode_packets(args.seconds, args.bitrate)
+    received = np.random.default_rng(0).random(len(packets)) >= args.loss
+    received[0] = True
+    minutes = args.streams * args.seconds / 60
+
+    print("Opus Recording Benchmark")
+    print("=" * 30)
+    print(
+        f"Streams: {args.streams}, {args.seconds} s each, "
+        f"{args.bitrate // 1000} kb/s, {args.loss * 100:.0f}% loss"
+    )
+    print(f"{'format':<8} {'CPU ms/stream-s':>16} {'MB/stream-min':>14}")
+    for fmt in ("wav", "opus"):
+        directory = tempfile.mkdtemp(prefix=f"{fmt}-recording-benchmark-")
+        cpu, size, files = run(fmt, packets, received, args.streams, directory)
+        print(
+            f"{fmt:<8} {cpu * 1000 / (args.streams * args.seconds):>16.3f} "
+            f"{size / 1e6 / minutes:>14.3f}"
+        )
+        if fmt == "opus":
+            with av.open(files[0]) as container:
+                decoded = sum(frame.samples for frame in container.decode(audio=0))
+            print(
+                f"Decoded Ogg/Opus duration: {decoded / OPUS_SAMPLE_RATE:.2f} s "
+                f"of {len(packets) * FRAME_SAMPLES / OPUS_SAMPLE_RATE:.2f} s"
+            )
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
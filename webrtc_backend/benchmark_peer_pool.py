@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Receiver time to first audio with and without the peer connection pool.
+Starts the relay on loopback, with a local STUN server that answers after
+a configurable delay, in three configurations:
+
+  none       every session creates its peer connection and gathers its
+             candidates on demand (as before)
+  certified  --peer-pool --peer-pool-no-gather: pooled peer connections
+             have their DTLS certificate and transceiver ready
+  gathered   --peer-pool: their ICE candidates are gathered as well
+
+Receivers join one stream one after the other, `--interval` apart so the
+pool can refill, without trickle ICE. Reports, per configuration and
+STUN delay, the median time from start_receiving until the offer
+arrived, DTLS connected and the first audio frame was decoded.
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+from benchmark_ice import (
+    BASE_URL,
+    PORT,
+    STUN_PORT,
+    STUN_URL,
+    SlowStunServer,
+    median_ms,
+    run_receiver,
+)
+from load_test import ToneTrack, close, run_sender, wait_until_healthy
+
+CONFIGURATIONS = {
+    "none": [],
+    "certified": ["--peer-pool", "--peer-pool-no-gather"],
+    "gathered": ["--peer-pool"],
+}
+
+
+async def run_listener(session, stream_id: str, result: dict):
+    started = time.perf_counter()
+    await run_receiver(session, stream_id, "full", result)
+    await result["pc"].getReceivers()[0].track.recv()
+    result["first_audio"] = time.perf_counter() - started
+
+
+async def measure(receivers: int, interval: float):
+    sender = {}
+    results = []
+    async with aiohttp.ClientSession() as session:
+        await asyncio.wait_for(run_sender(session, BASE_URL, ToneTrack(), sender), 20)
+        for _ in range(receivers):
+            await asyncio.sleep(interval)
+            result = {}
+            try:
+                await asyncio.wait_for(
+                    run_listener(session, sender["stream_id"], result), 20
+                )
+            except asyncio.TimeoutError:
+                pass
+            if "listener" in result:
+                result["listener"].cancel()
+            await close(result)
+            results.append(result)
+        await close(sender)
+    return results
+
+
+def start_relay(configuration: str) -> subprocess.Popen:
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "webrtc_server_relay.py",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(PORT),
+            "--ice-server",
+            STUN_URL,
+            *CONFIGURATIONS[configuration],
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def run(args):
+    loop = asyncio.get_event_loop()
+    # The STUN stand-in runs before each relay starts, so the pool's first
+    # connections gather against it too
+    transport, stun_server = await loop.create_datagram_endpoint(
+        SlowStunServer, local_addr=("127.0.0.1", STUN_PORT)
+    )
+    try:
+        for configuration, delay_ms in itertools.product(
+            args.configurations, args.stun_delay_ms
+        ):
+            stun_server.delay = delay_ms / 1000
+            relay = start_relay(configuration)
+            try:
+                await loop.run_in_executor(None, wait_until_healthy, BASE_URL)
+                results = await measure(args.receivers, args.interval)
+            finally:
+                relay.terminate()
+                await loop.run_in_executor(None, relay.wait)
+            joined = sum("first_audio" in r for r in results)
+            print(
+                f"{configuration:<10} {delay_ms:>8g} {joined:>4}/{len(results):<2} "
+                f"{median_ms(results, 'offer'):>9.1f} "
+                f"{median_ms(results, 'connected'):>13.1f} "
+                f"{median_ms(results, 'first_audio'):>15.1f}"
+            )
+    finally:
+        transport.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--configurations",
+        nargs="+",
+        choices=list(CONFIGURATIONS),
+        default=list(CONFIGURATIONS),
+    )
+    parser.add_argument(
+        "--stun-delay-ms",
+        type=float,
+        nargs="+",
+        default=[0, 100],
+        help="how long the STUN stand-in waits before answering",
+    )
+    parser.add_argument(
+        "--receivers", type=int, default=10, help="receivers joined per configuration"
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.5,
+        help="seconds between receivers, for the pool to refill",
+    )
+    args = parser.parse_args()
+
+    print("Peer Connection Pool Benchmark")
+    print("=" * 30)
+    print(
+        f"{'pool':<10} {'STUN ms':>8} {'joined':>7} {'offer ms':>9} "
+        f"{'connected ms':>13} {'first audio ms':>15}"
+    )
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
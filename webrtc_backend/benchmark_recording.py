@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Recording benchmark.
+Feeds 20 ms frames for many streams into the segmented recorder, faster
+than real time by --speed, and reports the time each write() takes on the calling thread
+(the event loop in the server), the writers' throughput, and how many
+chunks the overflow policy dropped.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from recording import Recorder
+
+FRAME_MS = 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument(
+        "--seconds", type=int, default=30, help="seconds of audio per stream"
+    )
+    parser.add_argument("--sample-rate", type=int, default=48000)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--writer-threads", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=10.0,
+        help="how much faster than real time to feed",
+    )
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="recording-benchmark-")
+    recorder = Recorder(
+        directory,
+        segment_seconds=10,
+        writer_threads=args.writer_threads,
+        queue_size=args.queue_size,
+    )
+    recordings = [
+        recorder.open_stream(f"stream_{i}", args.sample_rate, args.channels)
+        for i in range(args.streams)
+    ]
+    frame = np.zeros(
+        args.sample_rate * FRAME_MS // 1000 * args.channels, dtype=np.int16
+    )
+    frames = args.seconds * 1000 // FRAME_MS
+    start_time = time.time()
+
+    write_time = 0.0
+    started = time.perf_counter()
+    for index in range(frames):
+        timestamp = start_time + index * FRAME_MS / 1000
+        ahead = started + index * FRAME_MS / 1000 / args.speed - time.perf_counter()
+        if ahead > 0:
+            time.sleep(ahead)
+        before = time.perf_counter()
+        for recording in recordings:
+            recording.write(frame, timestamp)
+        write_time += time.perf_counter() - before
+    recorder.stop()
+    elapsed = time.perf_counter() - started
+
+    written = sum(worker.chunks_written for worker in recorder.workers)
+    audio_bytes = frame.nbytes * frames * args.streams
+    print("Recording Benchmark")
+    print("=" * 30)
+    print(
+        f"Streams: {args.streams}, {args.seconds} s each, {args.writer_threads} writers"
+    )
+    print(
+        f"write() on the caller: {write_time * 1e6 / (frames * args.streams):.2f} us per frame"
+    )
+    print(
+        f"Audio fed: {audio_bytes / 1e6:.1f} MB in {elapsed:.2f} s "
+        f"({audio_bytes / 1e6 / elapsed:.1f} MB/s, "
+        f"{args.seconds * args.streams / elapsed:.0f}x real time)"
+    )
+    print(
+        f"Chunks written: {written}, dropped by overflow policy: {recorder.chunks_dropped}"
+    )
+    segments = sum(
+        name.endswith(".wav") for _, _, files in os.walk(directory) for name in files
+    )
+    print(f"Segment files: {segments}")
+    shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
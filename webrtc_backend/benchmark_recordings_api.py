@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Recordings API benchmark.
+Records a long WAV stream, then has several clients download time ranges
+of it at once, some as whole ranges and some as a series of Range
+requests like a scrubbing player. Meanwhile a probe sleeps 10 ms at a
+time on the server's event loop and records how late it wakes up, which
+is how much the downloads delay signaling and media. The clients run in
+another process. Reports throughput and the probe's lag.
+"""
+
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+import numpy as np
+from aiohttp import web
+
+from recording import Recorder
+from recordings_api import RecordingsApi
+
+PROBE_INTERVAL = 0.01
+PORT = 8096
+
+
+def record(directory: str, minutes: int, sample_rate: int) -> Recorder:
+    recorder = Recorder(directory, segment_seconds=300, queue_size=minutes * 60)
+    recording = recorder.open_stream("doorbell", sample_rate, 1)
+    second = np.zeros(sample_rate, dtype=np.int16)
+    for index in range(minutes * 60):
+        recording.write(second, 1_700_000_000 + index)
+    recorder.close_stream(recording)
+    return recorder
+
+
+async def probe(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        before = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - before - PROBE_INTERVAL)
+
+
+async def download(session, url: str, seconds: int, scrub: bool) -> int:
+    if not scrub:
+        async with session.get(url) as response:
+            return len(await response.read())
+
+    received = 0
+    for _ in range(20):
+        offset = np.random.randint(0, seconds * 32000)
+        headers = {"Range": f"bytes={offset}-{offset + 256 * 1024 - 1}"}
+        async with session.get(url, headers=headers) as response:
+            received += len(await response.read())
+    return received
+
+
+def run_clients(clients: int, seconds: int, minutes: int) -> int:
+    """Download from another process, so clients do not compete for the GIL"""
+
+    async def download_all():
+        starts = np.random.uniform(0, minutes * 60 - seconds, clients) + 1_700_000_000
+        async with aiohttp.ClientSession() as session:
+            received = await asyncio.gather(
+                *[
+                    download(
+                        session,
+                        f"http://127.0.0.1:{PORT}/api/recordings/doorbell/audio"
+                        f"?start={start}&end={start + seconds}",
+                        seconds,
+                        scrub=index % 2 == 1,
+                    )
+                    for index, start in enumerate(starts)
+                ]
+            )
+        return sum(received)
+
+    return asyncio.run(download_all())
+
+
+async def run(recorder: Recorder, clients: int, seconds: int, minutes: int):
+    app = web.Application()
+    RecordingsApi(recorder).add_routes(app.router)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+    lags = []
+    stop = asyncio.Event()
+    probe_task = asyncio.ensure_future(probe(lags, stop))
+    started = time.perf_counter()
+    with ProcessPoolExecutor(1) as pool:
+        received = await asyncio.get_event_loop().run_in_executor(
+            pool, run_clients, clients, seconds, minutes
+        )
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe_task
+    await runner.cleanup()
+    return received, elapsed, np.array(lags)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--minutes", type=int, default=30, help="length of the recording"
+    )
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument(
+        "--seconds", type=int, default=600, help="length of each requested range"
+    )
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="recordings-api-benchmark-")
+    recorder = record(directory, args.minutes, 16000)
+    while any(worker.depth for worker in recorder.workers):
+        time.sleep(0.1)
+    try:
+        received, elapsed, lags = asyncio.run(
+            run(recorder, args.clients, args.seconds, args.minutes)
+        )
+    finally:
+        recorder.stop()
+        shutil.rmtree(directory)
+
+    print("Recordings API Benchmark")
+    print("=" * 30)
+    print(
+        f"Clients: {args.clients}, {args.seconds} s ranges of a {args.minutes} min recording"
+    )
+    print(
+        f"Served {received / 1e6:.1f} MB in {elapsed:.2f} s ({received / 1e6 / elapsed:.0f} MB/s)"
+    )
+    print(
+        f"Event loop lag: p50 {np.percentile(lags, 50) * 1000:.2f} ms, "
+        f"p99 {np.percentile(lags, 99) * 1000:.2f} ms, max {lags.max() * 1000:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
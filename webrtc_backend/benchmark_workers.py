@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Worker mode benchmark for the relay server.
+Starts the relay with 1, 2, 4 and 8 workers sharing one port, connects
+senders and then several receivers per sender from another process, and
+lets them stream. Receivers land on whichever worker the kernel picks, so
+with several workers most of them read their stream from another worker's
+packet ring. Reports the fraction of audio frames delivered, the time to
+the first frame, and the CPU used by the whole server process tree.
+Scaling needs as many free cores as workers: on a machine with fewer
+cores, the extra workers only add context switches.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from aiortc.mediastreams import AudioStreamTrack, MediaStreamError
+
+PORT = 8097
+BASE_URL = f"http://127.0.0.1:{PORT}"
+FRAMES_PER_SECOND = 50  # 20 ms Opus frames
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def tree_cpu_seconds(pid: int) -> float:
+    """User + system CPU of a process and its children, from /proc"""
+    total = 0.0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # Fields after the command: state, ppid, ..., utime (12), stime (13)
+        if int(entry) == pid or int(fields[1]) == pid:
+            total += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return total
+
+
+async def start_sender(session, base_url: str):
+    ws = await session.ws_connect(f"{base_url}/ws")
+    await ws.send_str(json.dumps({"type": "start_sending"}))
+    while True:
+        ready = json.loads((await ws.receive()).data)
+        if ready["type"] == "sender_ready":
+            break
+    pc = RTCPeerConnection()
+    pc.addTrack(AudioStreamTrack())
+    await pc.setLocalDescription(await pc.createOffer())
+    await ws.send_str(
+        json.dumps(
+            {
+                "type": "webrtc_offer",
+                "offer": {"sdp": pc.localDescription.sdp, "type": "offer"},
+            }
+        )
+    )
+    while True:
+        message = json.loads((await ws.receive()).data)
+        if message["type"] == "webrtc_answer":
+            break
+    await pc.setRemoteDescription(RTCSessionDescription(**message["answer"]))
+    return ws, pc, f"stream_{ready['connection_id']}"
+
+
+async def receive(
+    session, base_url: str, stream_id: str, seconds: float, results: list
+):
+    ws = await session.ws_connect(f"{base_url}/ws")
+    requested = time.perf_counter()
+    await ws.send_str(json.dumps({"type": "start_receiving", "stream_id": stream_id}))
+    while True:
+        message = json.loads((await ws.receive()).data)
+        if message["type"] == "webrtc_offer":
+            break
+        if message["type"] == "error":
+            results.append((0, None))
+            await ws.close()
+            return
+
+    pc = RTCPeerConnection()
+    frames = 0
+    first_frame = None
+    done = asyncio.Event()
+
+    @pc.on("track")
+    def on_track(track):
+        async def count():
+            nonlocal frames, first_frame
+            deadline = None
+            try:
+                while deadline is None or time.perf_counter() < deadline:
+                    await track.recv()
+                    frames += 1
+                    if first_frame is None:
+                        first_frame = time.perf_counter() - requested
+                        deadline = time.perf_counter() + seconds
+            except MediaStreamError:
+                pass
+            done.set()
+
+        asyncio.ensure_future(count())
+
+    await pc.setRemoteDescription(RTCSessionDescription(**message["offer"]))
+    await pc.setLocalDescription(await pc.createAnswer())
+    await ws.send_str(
+        json.dumps(
+            {
+                "type": "webrtc_answer",
+                "answer": {"sdp": pc.localDescription.sdp, "type": "answer"},
+            }
+        )
+    )
+    try:
+        await asyncio.wait_for(done.wait(), seconds + 10)
+    except asyncio.TimeoutError:
+        pass
+    results.append((frames, first_frame))
+    await pc.close()
+    await ws.close()
+
+
+def run_clients(senders: int, receivers: int, seconds: float):
+    """Stream from another process, so clients do not compete for the GIL"""
+
+    async def stream_all():
+        results = []
+        async with aiohttp.ClientSession() as session:
+            streams = [await start_sender(session, BASE_URL) for _ in range(senders)]
+            # Let every worker see the streams in the shared registry
+            await asyncio.sleep(2)
+            stream_ids = [
+                stream_id for _, _, stream_id in streams for _ in range(receivers)
+            ]
+            await asyncio.gather(
+                *[
+                    receive(session, BASE_URL, stream_id, seconds, results)
+                    for stream_id in stream_ids
+                ]
+            )
+            for ws, pc, _ in streams:
+                await pc.close()
+                await ws.close()
+        return results
+
+    return asyncio.run(stream_all())
+
+
+def wait_until_healthy(base_url: str, timeout: float = 30):
+    async def poll():
+        deadline = time.time() + timeout
+        async with aiohttp.ClientSession() as session:
+            while time.time() < deadline:
+                try:
+                    async with session.get(f"{base_url}/health") as r:
+                        if r.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError("Relay did not start")
+
+    asyncio.run(poll())
+
+
+def measure(workers: int, senders: int, receivers: int, seconds: float):
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "webrtc_server_relay.py",
+            "--workers",
+            str(workers),
+            "--port",
+            str(PORT),
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_healthy(BASE_URL)
+        # Let the workers finish importing before measuring their CPU
+        time.sleep(1)
+        cpu_start = tree_cpu_seconds(server.pid)
+        with ProcessPoolExecutor(1) as pool:
+            results = pool.submit(run_clients, senders, receivers, seconds).result()
+        cpu = tree_cpu_seconds(server.pid) - cpu_start
+    finally:
+        server.terminate()
+        server.wait()
+
+    # A receiver's jitter buffer can release a burst just before the deadline
+    expected = seconds * FRAMES_PER_SECOND
+    delivered = sum(min(frames, expected) for frames, _ in results)
+    first_frames = [first for _, first in results if first is not None]
+    return {
+        "workers": workers,
+        "delivered": delivered / (len(results) * expected),
+        "first_frame_ms": (
+            sum(first_frames) / len(first_frames) * 1000 if first_frames else 0
+        ),
+        "server_cpu": cpu,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="worker counts"
+    )
+    parser.add_argument("--senders", type=int, default=4)
+    parser.add_argument("--receivers", type=int, default=4, help="receivers per sender")
+    parser.add_argument(
+        "--seconds", type=float, default=10, help="seconds each receiver listens"
+    )
+    args = parser.parse_args()
+
+    print("Worker Mode Benchmark")
+    print("=" * 30)
+    print(
+        f"Senders: {args.senders}, {args.receivers} receivers each, "
+        f"{args.seconds:.0f} s, {os.cpu_count()} CPUs"
+    )
+    print(
+        f"{'workers':>7} {'delivered':>10} {'first frame ms':>15} {'server CPU s':>13}"
+    )
+    for workers in args.workers:
+        result = measure(workers, args.senders, args.receivers, args.seconds)
+        print(
+            f"{result['workers']:>7} {result['delivered'] * 100:>9.1f}% "
+            f"{result['first_frame_ms']:>15.0f} {result['server_cpu']:>13.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Event-loop stall reports and an on-demand sampling profiler.
+
+Both are off unless enabled, and cost nothing until then: no thread is
+started and no route is added.
+
+``LoopWatchdog`` is fed by the loop-lag probe in ``metrics.py``, which
+beats it every time the event loop wakes. A daemon thread watches the
+beats; when the loop has not woken for `threshold` seconds past the
+probe interval, it logs the stack the loop thread is stuck in, once per
+stall, while the stall is still going on.
+
+``handle_profile`` samples the stacks of the process's threads from a
+thread of its own for a bounded time and answers with one line per distinct
+stack in the collapsed format that flamegraph.pl, speedscope and inferno
+read: ``root;...;leaf count``, frames as ``function (file.py:line)``.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LAG_THRESHOLD = 0.25
+DEFAULT_PROFILE_SECONDS = 10.0
+MAX_PROFILE_SECONDS = 60.0
+DEFAULT_SAMPLE_INTERVAL = 0.005
+MIN_SAMPLE_INTERVAL = 0.001
+SAMPLE_SWITCH_INTERVAL = 0.0001
+
+
+class LoopWatchdog:
+    """Logs the event loop thread's stack when the loop stops waking up"""
+
+    def __init__(self, threshold: float = DEFAULT_LAG_THRESHOLD):
+        self.threshold = threshold
+        self.stalls = 0
+        self._interval = 0.0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, interval: float):
+        """Watch the calling thread's event loop, beaten every `interval` seconds"""
+        self._interval = interval
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def beat(self):
+        self._last_beat = time.monotonic()
+
+    def _watch(self):
+        reported_beat = None
+        limit = self._interval + self.threshold
+        while not self._stop.wait(self.threshold / 2):
+            last_beat = self._last_beat
+            stalled = time.monotonic() - last_beat
+            if stalled < limit or last_beat == reported_beat:
+                continue
+            reported_beat = last_beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            logger.warning(
+                f"Event loop blocked for {(stalled - self._interval) * 1000:.0f} ms "
+                f"so far, in:\n{stack}"
+            )
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def collapse(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def sample_stacks(seconds: float, interval: float) -> Dict[str, int]:
+    """Count the stacks of every other thread, sampled every `interval` seconds.
+
+    Runs in the calling thread until `seconds` have passed.
+    """
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    own = threading.get_ident()
+    counts: Counter = Counter()
+    # The sampler only runs when it gets the GIL. With the default 5 ms switch
+    # interval a busy loop thread would mostly hand it over in select(), and
+    # short bursts of work between two selects would never be sampled.
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(min(switch_interval, SAMPLE_SWITCH_INTERVAL))
+    try:
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own:
+                    name = names.get(thread_id, str(thread_id))
+                    counts[f"{name};{collapse(frame)}"] += 1
+            time.sleep(interval)
+    finally:
+        sys.setswitchinterval(switch_interval)
+    return counts
+
+
+class Profiler:
+    """Serves time-boxed sampling profiles, one at a time"""
+
+    def __init__(self):
+        self._running = False
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def handle_profile(self, request):
+        """GET /admin/profile?seconds=10&interval=0.005 -> collapsed stacks"""
+        try:
+            seconds = float(request.query.get("seconds", DEFAULT_PROFILE_SECONDS))
+            interval = float(request.query.get("interval", DEFAULT_SAMPLE_INTERVAL))
+        except ValueError:
+            raise web.HTTPBadRequest(text="seconds and interval must be numbers")
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            raise web.HTTPBadRequest(
+                text=f"seconds must be between 0 and {MAX_PROFILE_SECONDS:g}"
+            )
+        interval = max(interval, MIN_SAMPLE_INTERVAL)
+        if self._running:
+            raise web.HTTPConflict(text="A profile is already running")
+
+        logger.info(f"Profiling for {seconds:g} s every {interval * 1000:g} ms")
+        # Its own thread, so the profile never waits for a busy default executor
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="profiler")
+        self._running = True
+        try:
+            counts = await asyncio.get_event_loop().run_in_executor(
+                self._executor, sample_stacks, seconds, interval
+            )
+        finally:
+            self._running = False
+
+        body = "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+        return web.Response(
+            text=body,
+            content_type="text/plain",
+            headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'},
+        )
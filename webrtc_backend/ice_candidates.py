@@ -0,0 +1,98 @@
+"""
+ICE candidate signaling for aiortc peer connections.
+
+Clients send their candidates as `ice_candidate` messages whose
+`candidate` is the browser's RTCIceCandidate JSON; an empty candidate
+string (or null) marks the end of candidates. Candidates that arrive
+before the remote description are kept and added once it is set.
+
+aiortc gathers all of its own candidates at once, in setLocalDescription,
+but the descriptions from createOffer and createAnswer already carry the
+ICE credentials. A server trickling to its client therefore sends the
+description first and the candidates, followed by an end-of-candidates
+marker, once gathering completes. The client creates its answer and
+gathers its own candidates in the meantime.
+"""
+
+import logging
+from typing import List, Optional
+
+from aiortc import RTCIceCandidate, RTCPeerConnection
+from aiortc.sdp import SessionDescription, candidate_from_sdp, candidate_to_sdp
+
+logger = logging.getLogger(__name__)
+
+# Candidates kept per connection until its remote description arrives
+MAX_PENDING_CANDIDATES = 32
+
+
+def parse_candidate(data) -> Optional[RTCIceCandidate]:
+    """The candidate of an ice_candidate message, or None for end-of-candidates.
+
+    Takes the browser's RTCIceCandidate JSON or a bare candidate line, and
+    raises ValueError for anything else.
+    """
+    if data is None:
+        return None
+    if isinstance(data, str):
+        data = {"candidate": data}
+    if not isinstance(data, dict):
+        raise ValueError(f"Invalid ICE candidate format: {data!r}")
+
+    line = data.get("candidate") or ""
+    if line.startswith("a="):
+        line = line[2:]
+    if line.startswith("candidate:"):
+        line = line[len("candidate:") :]
+    if not line:
+        return None
+    try:
+        candidate = candidate_from_sdp(line)
+    except (AssertionError, IndexError, ValueError):
+        raise ValueError(f"Invalid ICE candidate: {line!r}")
+    candidate.sdpMid = data.get("sdpMid")
+    candidate.sdpMLineIndex = data.get("sdpMLineIndex")
+    if candidate.sdpMid is None and candidate.sdpMLineIndex is None:
+        # Every peer connection here bundles its single audio section
+        candidate.sdpMLineIndex = 0
+    return candidate
+
+
+async def add_candidate(pc: RTCPeerConnection, candidate: Optional[RTCIceCandidate]):
+    try:
+        await pc.addIceCandidate(candidate)
+    except Exception as e:
+        logger.error(f"Error adding ICE candidate: {e}")
+
+
+async def add_pending_candidates(pc: RTCPeerConnection, pending: list):
+    """Add the candidates that arrived before the remote description"""
+    while pending:
+        await add_candidate(pc, pending.pop(0))
+
+
+def candidate_messages(pc: RTCPeerConnection) -> List[dict]:
+    """ice_candidate messages for every gathered local candidate, each media
+    section ending with an end-of-candidates marker"""
+    messages = []
+    description = SessionDescription.parse(pc.localDescription.sdp)
+    for index, media in enumerate(description.media):
+        mid = media.rtp.muxId
+        for candidate in media.ice_candidates:
+            messages.append(
+                {
+                    "type": "ice_candidate",
+                    "candidate": {
+                        "candidate": "candidate:" + candidate_to_sdp(candidate),
+                        "sdpMid": mid,
+                        "sdpMLineIndex": index,
+                    },
+                }
+            )
+        messages.append(
+            {
+                "type": "ice_candidate",
+                "candidate": {"candidate": "", "sdpMid": mid, "sdpMLineIndex": index},
+            }
+        )
+    return messages
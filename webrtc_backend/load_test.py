@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+Synthetic load generator for the relay server.
+Connects N aiortc senders, each streaming a tone or an audio file, and then
+M receivers spread over their streams, using the relay's /ws protocol:
+start_sending or start_receiving, then offer and answer with the ICE
+candidates carried in the SDP. Connections are opened at a fixed rate and
+then held for a while. Reports join latency percentiles, frame delivery,
+and the server's CPU and RSS per connection; --json writes the same
+results to a file to compare runs.
+
+With --spawn the relay is started on loopback and measured; otherwise
+pass --url and, for the server figures, --server-pid.
+"""
+
+import argparse
+import asyncio
+import fractions
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from typing import Callable
+
+import aiohttp
+import numpy as np
+from aiohttp import WSMsgType
+from aiortc import RTCPeerConnection, RTCSessionDescription
+from aiortc.contrib.media import MediaPlayer
+from aiortc.mediastreams import AUDIO_PTIME, MediaStreamError, MediaStreamTrack
+from av import AudioFrame
+
+SAMPLE_RATE = 48000
+SAMPLES_PER_FRAME = int(AUDIO_PTIME * SAMPLE_RATE)
+FRAMES_PER_SECOND = round(1 / AUDIO_PTIME)
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class ToneTrack(MediaStreamTrack):
+    """A sine tone in real time, 20 ms per frame"""
+
+    kind = "audio"
+
+    def __init__(self, frequency: int = 440):
+        super().__init__()
+        # One second holds a whole number of periods, so it loops seamlessly
+        t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+        self._second = (np.sin(2 * math.pi * frequency * t) * 8000).astype(np.int16)
+        self._timestamp = 0
+        self._start = None
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+
+        if self._start is None:
+            self._start = time.time()
+        else:
+            self._timestamp += SAMPLES_PER_FRAME
+            await asyncio.sleep(
+                self._start + self._timestamp / SAMPLE_RATE - time.time()
+            )
+
+        offset = self._timestamp % SAMPLE_RATE
+        samples = self._second[offset : offset + SAMPLES_PER_FRAME]
+        frame = AudioFrame.from_ndarray(
+            samples.reshape(1, -1), format="s16", layout="mono"
+        )
+        frame.pts = self._timestamp
+        frame.sample_rate = SAMPLE_RATE
+        frame.time_base = fractions.Fraction(1, SAMPLE_RATE)
+        return frame
+
+
+def audio_track(audio_file: str = None, frequency: int = 440):
+    if audio_file:
+        return MediaPlayer(audio_file, loop=True).audio
+    return ToneTrack(frequency)
+
+
+async def next_message(ws, *types):
+    """The next message of one of `types`, skipping others; error messages raise"""
+    while True:
+        message = await ws.receive()
+        if message.type != WSMsgType.TEXT:
+            raise ConnectionError(f"WebSocket closed ({message.type.name})")
+        data = json.loads(message.data)
+        if data["type"] in types:
+            return data
+        if data["type"] == "error":
+            raise RuntimeError(data.get("message"))
+
+
+async def drain(ws):
+    """Keep reading notifications, so the relay never sees a slow consumer"""
+    async for _ in ws:
+        pass
+
+
+async def run_sender(session, url: str, track, result: dict):
+    started = time.perf_counter()
+    ws = await session.ws_connect(f"{url}/ws")
+    result.update(ws=ws)
+    await ws.send_str(json.dumps({"type": "start_sending"}))
+    ready = await next_message(ws, "sender_ready")
+    result["stream_id"] = f"stream_{ready['connection_id']}"
+
+    pc = RTCPeerConnection()
+    result["pc"] = pc
+    connected = asyncio.Event()
+
+    @pc.on("connectionstatechange")
+    def on_connectionstatechange():
+        if pc.connectionState == "connected":
+            connected.set()
+
+    pc.addTrack(track)
+    await pc.setLocalDescription(await pc.createOffer())
+    await ws.send_str(
+        json.dumps(
+            {
+                "type": "webrtc_offer",
+                "offer": {"sdp": pc.localDescription.sdp, "type": "offer"},
+            }
+        )
+    )
+    answer = await next_message(ws, "webrtc_answer")
+    result["signaling"] = time.perf_counter() - started
+    await pc.setRemoteDescription(RTCSessionDescription(**answer["answer"]))
+    result["drain"] = asyncio.ensure_future(drain(ws))
+    await connected.wait()
+    result["join"] = time.perf_counter() - started
+
+
+async def run_receiver(
+    session, url: str, stream_id: str, result: dict, on_frame: Callable = None
+):
+    """Receive a stream, counting frames; `on_frame(frame)` sees each one"""
+    started = time.perf_counter()
+    ws = await session.ws_connect(f"{url}/ws")
+    result.update(ws=ws, frames=0)
+    await ws.send_str(json.dumps({"type": "start_receiving", "stream_id": stream_id}))
+    offer = await next_message(ws, "webrtc_offer")
+
+    pc = RTCPeerConnection()
+    result["pc"] = pc
+    first_frame = asyncio.Event()
+
+    @pc.on("track")
+    def on_track(track):
+        async def count():
+            try:
+                while True:
+                    frame = await track.recv()
+                    if on_frame:
+                        on_frame(frame)
+                    if not first_frame.is_set():
+                        result["first_frame_at"] = time.perf_counter()
+                        first_frame.set()
+                    result["frames"] += 1
+            except MediaStreamError:
+                pass
+
+        result["counter"] = asyncio.ensure_future(count())
+
+    await pc.setRemoteDescription(RTCSessionDescription(**offer["offer"]))
+    await pc.setLocalDescription(await pc.createAnswer())
+    await ws.send_str(
+        json.dumps(
+            {
+                "type": "webrtc_answer",
+                "answer": {"sdp": pc.localDescription.sdp, "type": "answer"},
+            }
+        )
+    )
+    result["signaling"] = time.perf_counter() - started
+    result["drain"] = asyncio.ensure_future(drain(ws))
+    await first_frame.wait()
+    result["join"] = result["first_frame_at"] - started
+
+
+async def join(coroutine, result: dict, timeout: float):
+    try:
+        await asyncio.wait_for(coroutine, timeout)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+
+
+async def ramp(count: int, rate: float, start_one):
+    """Start `count` connections, `rate` per second, and wait for all to join"""
+    tasks = []
+    for i in range(count):
+        tasks.append(asyncio.ensure_future(start_one(i)))
+        await asyncio.sleep(1 / rate)
+    await asyncio.gather(*tasks)
+
+
+async def close(result: dict):
+    for name in ("counter", "drain"):
+        if name in result:
+            result[name].cancel()
+    if "pc" in result:
+        await result["pc"].close()
+    if "ws" in result:
+        await result["ws"].close()
+
+
+def process_tree_usage(pid: int):
+    """CPU seconds and RSS bytes of a process and its children, from /proc"""
+    cpu, rss = 0.0, 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # Fields after the command: state, ppid, ..., utime (12), stime (13),
+        # ..., rss in pages (22)
+        if int(entry) == pid or int(fields[1]) == pid:
+            cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+            rss += int(fields[21]) * PAGE_SIZE
+    return cpu, rss
+
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def at(q):
+        # Nearest rank
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)] * 1000
+
+    return {
+        "p50_ms": at(0.5),
+        "p90_ms": at(0.9),
+        "p99_ms": at(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def summarize(senders, receivers, hold_started, hold_ended, usage):
+    joined = [r for r in receivers if "join" in r]
+    ratios = []
+    for r in joined:
+        # Only frames the receiver could have had since its first one
+        expected = (hold_ended - r["first_frame_at"]) * FRAMES_PER_SECOND
+        ratios.append(min(1.0, r["frames"] / expected) if expected >= 1 else 1.0)
+    summary = {
+        "senders": {
+            "joined": sum("join" in r for r in senders),
+            "failed": sum("error" in r for r in senders),
+            "join": percentiles([r["join"] for r in senders if "join" in r]),
+            "signaling": percentiles(
+                [r["signaling"] for r in senders if "signaling" in r]
+            ),
+        },
+        "receivers": {
+            "joined": len(joined),
+            "failed": sum("error" in r for r in receivers),
+            "join": percentiles([r["join"] for r in joined]),
+            "signaling": percentiles(
+                [r["signaling"] for r in receivers if "signaling" in r]
+            ),
+            "delivery_mean": sum(ratios) / len(ratios) if ratios else None,
+            "delivery_min": min(ratios) if ratios else None,
+        },
+        "errors": sorted({r["error"] for r in senders + receivers if "error" in r}),
+    }
+    if usage:
+        (cpu_start, _), (cpu_end, rss_end), rss_idle = usage
+        connections = len(senders) + len(receivers)
+        cpu_percent = (cpu_end - cpu_start) / (hold_ended - hold_started) * 100
+        summary["server"] = {
+            "cpu_percent": cpu_percent,
+            "cpu_percent_per_connection": cpu_percent / connections,
+            "rss_mb": rss_end / 2**20,
+            "rss_mb_per_connection": (rss_end - rss_idle) / 2**20 / connections,
+        }
+    return summary
+
+
+async def run_load(args, server_pid=None):
+    senders = [{} for _ in range(args.senders)]
+    receivers = [{} for _ in range(args.receivers)]
+    rss_idle = process_tree_usage(server_pid)[1] if server_pid else None
+
+    async with aiohttp.ClientSession() as session:
+        await ramp(
+            args.senders,
+            args.rate,
+            lambda i: join(
+                run_sender(
+                    session,
+                    args.url,
+                    audio_track(args.audio_file, args.tone + i),
+                    senders[i],
+                ),
+                senders[i],
+                args.join_timeout,
+            ),
+        )
+        stream_ids = [s["stream_id"] for s in senders if "join" in s]
+        if stream_ids:
+            await ramp(
+                args.receivers,
+                args.rate,
+                lambda i: join(
+                    run_receiver(
+                        session, args.url, stream_ids[i % len(stream_ids)], receivers[i]
+                    ),
+                    receivers[i],
+                    args.join_timeout,
+                ),
+            )
+        else:
+            for result in receivers:
+                result["error"] = "no sender joined"
+
+        hold_started = time.perf_counter()
+        usage_start = process_tree_usage(server_pid) if server_pid else None
+        await asyncio.sleep(args.hold)
+        hold_ended = time.perf_counter()
+        usage = None
+        if server_pid:
+            usage = (usage_start, process_tree_usage(server_pid), rss_idle)
+
+        for result in receivers + senders:
+            await close(result)
+
+    return summarize(senders, receivers, hold_started, hold_ended, usage)
+
+
+def wait_until_healthy(url: str, timeout: float = 30):
+    async def poll():
+        deadline = time.time() + timeout
+        async with aiohttp.ClientSession() as session:
+            while time.time() < deadline:
+                try:
+                    async with session.get(f"{url}/health") as r:
+                        if r.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError(f"Server at {url} did not become healthy")
+
+    asyncio.run(poll())
+
+
+def print_report(args, summary):
+    print("Load Test")
+    print("=" * 30)
+    print(
+        f"{args.senders} senders, {args.receivers} receivers, "
+        f"{args.rate:g} connections/s, held {args.hold:g} s"
+    )
+    print(
+        f"{'':<10} {'joined':>7} {'failed':>7} {'p50 ms':>8} {'p90 ms':>8} "
+        f"{'p99 ms':>8} {'max ms':>8}"
+    )
+    for role in ("senders", "receivers"):
+        stats = summary[role]
+        join = stats["join"] or {}
+        print(
+            f"{role:<10} {stats['joined']:>7} {stats['failed']:>7} "
+            + " ".join(
+                f"{join[key]:>8.0f}" if key in join else f"{'-':>8}"
+                for key in ("p50_ms", "p90_ms", "p99_ms", "max_ms")
+            )
+        )
+    receivers = summary["receivers"]
+    if receivers["delivery_mean"] is not None:
+        print(
+            f"Frames delivered: {receivers['delivery_mean'] * 100:.1f}% mean, "
+            f"{receivers['delivery_min'] * 100:.1f}% worst receiver"
+        )
+    server = summary.get("server")
+    if server:
+        print(
+            f"Server: {server['cpu_percent']:.1f}% CPU "
+            f"({server['cpu_percent_per_connection']:.2f}% per connection), "
+            f"{server['rss_mb']:.0f} MB RSS "
+            f"({server['rss_mb_per_connection']:.2f} MB per connection)"
+        )
+    for error in summary["errors"]:
+        print(f"Error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--senders", type=int, default=4)
+    parser.add_argument("--receivers", type=int, default=16)
+    parser.add_argument(
+        "--rate", type=float, default=5, help="new connections per second"
+    )
+    parser.add_argument(
+        "--hold", type=float, default=20, help="seconds to hold every connection"
+    )
+    parser.add_argument(
+        "--audio-file", help="stream this file (looped) instead of a tone"
+    )
+    parser.add_argument(
+        "--tone", type=int, default=440, help="tone of the first sender, Hz"
+    )
+    parser.add_argument("--join-timeout", type=float, default=20)
+    parser.add_argument(
+        "--spawn",
+        action="store_true",
+        help="start webrtc_server_relay.py on loopback and measure it",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="relay workers with --spawn"
+    )
+    parser.add_argument("--server-pid", type=int, help="server process to measure")
+    parser.add_argument("--json", help="write the configuration and results here")
+    args = parser.parse_args()
+
+    server = None
+    server_pid = args.server_pid
+    if args.spawn:
+        port = 8095
+        args.url = f"http://127.0.0.1:{port}"
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                "webrtc_server_relay.py",
+                "--host",
+                "127.0.0.1",
+                "--port",
+                str(port),
+                "--workers",
+                str(args.workers),
+            ],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        server_pid = server.pid
+    try:
+        wait_until_healthy(args.url)
+        summary = asyncio.run(run_load(args, server_pid))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    print_report(args, summary)
+    if args.json:
+        config = {
+            key: value for key, value in vars(args).items() if key not in ("json",)
+        }
+        with open(args.json, "w") as f:
+            json.dump({"config": config, "results": summary}, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
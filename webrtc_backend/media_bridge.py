@@ -0,0 +1,91 @@
+"""
+Node-to-node media bridge for cluster mode.
+
+A stream lives on the node its sender connected to. When a receiver on
+another node asks for it, that node opens one WebSocket to the owner's
+``/api/bridge/{stream_id}`` and the owner sends every forwarded Opus
+packet down it as a binary message: the 32-bit RTP timestamp followed by
+the payload. A node opens at most one bridge per stream however many of
+its receivers listen, and closes it when the last one leaves. The owner
+closes the bridge when the stream ends, which ends the receivers' tracks.
+"""
+
+import asyncio
+import logging
+import struct
+from typing import Set
+
+import aiohttp
+from aiohttp import WSMsgType, web
+
+from outbound import POLICY_DROP_OLDEST, OutboundQueue
+from packet_forwarding import RemotePacketSource
+from stream_fanout import DEFAULT_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+BRIDGE_HEADER = struct.Struct("<I")  # RTP timestamp
+# About 1 s of packets; a bridge that falls further behind loses the oldest
+BRIDGE_QUEUE_SIZE = 50
+BRIDGE_HEARTBEAT = 10.0
+
+
+def bridge_url(base_url: str, stream_id: str) -> str:
+    """The WebSocket URL on the node at `base_url` that bridges `stream_id`"""
+    return f"{base_url.rstrip('/')}/api/bridge/{stream_id}"
+
+
+class BridgePacketSource(RemotePacketSource):
+    """Feeds a stream owned by another node to this node's receivers"""
+
+    def __init__(self, url: str, stream_id: str, queue_size: int = DEFAULT_QUEUE_SIZE):
+        super().__init__(stream_id, queue_size)
+        self.url = url
+
+    async def _run(self):
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.ws_connect(
+                    self.url, heartbeat=BRIDGE_HEARTBEAT
+                ) as ws:
+                    async for message in ws:
+                        if message.type != WSMsgType.BINARY:
+                            continue
+                        (timestamp,) = BRIDGE_HEADER.unpack_from(message.data)
+                        self.push_packet(timestamp, message.data[BRIDGE_HEADER.size :])
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Media bridge for {self.stream_id} failed: {e}")
+        # The owner ended the stream or is unreachable; the next receiver
+        # opens a new bridge if the registry still lists the stream
+        logger.info(f"Media bridge for {self.stream_id} closed")
+        self.ended()
+
+
+async def serve_bridge(request, forwarder, bridges: Set[web.WebSocketResponse]):
+    """Send a stream's packets to the node that requested them until it leaves.
+
+    `forwarder` is the stream's PacketForwarder or RemotePacketSource, and
+    `bridges` the stream's open bridges, which are closed when it ends.
+    """
+    ws = web.WebSocketResponse(heartbeat=BRIDGE_HEARTBEAT)
+    await ws.prepare(request)
+    peer = request.remote
+    outbound = OutboundQueue(
+        ws, f"bridge to {peer}", maxsize=BRIDGE_QUEUE_SIZE, policy=POLICY_DROP_OLDEST
+    )
+    outbound.start()
+
+    def forward(packet):
+        outbound.send(BRIDGE_HEADER.pack(packet.timestamp) + packet.payload)
+
+    logger.info(f"Bridging {forwarder.stream_id} to {peer}")
+    forwarder.add_listener(forward)
+    bridges.add(ws)
+    try:
+        async for _ in ws:
+            pass
+    finally:
+        forwarder.remove_listener(forward)
+        bridges.discard(ws)
+        await outbound.close()
+    return ws
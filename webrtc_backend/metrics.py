@@ -0,0 +1,390 @@
+"""
+Counters, gauges and fixed-bucket histograms, exposed in the Prometheus
+text format at ``/metrics``.
+
+Hot paths bind a labelled child once, for example when a stream starts,
+and then only add to a slot on it: ``Counter.inc`` is one attribute
+update and ``Histogram.observe`` one bisect over the bucket bounds. Nothing
+is formatted or aggregated until a scrape, and gauges that mirror server
+state are read by callbacks at scrape time. ``benchmark_metrics.py``
+measures the cost per frame.
+
+Every metric the servers export is defined at the bottom of this module.
+Per-stream label sets are dropped with ``forget_stream`` when a stream
+ends, so the series count follows the number of live streams.
+"""
+
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; from well under a millisecond to a blocked event loop
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+# Seconds; connection setup takes from tens of milliseconds to ICE timeouts
+SETUP_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LOOP_LAG_INTERVAL = 0.1
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return f"{{{pairs}}}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class MetricsRegistry:
+    """The set of metrics rendered on a scrape"""
+
+    def __init__(self):
+        self._metrics: List["Metric"] = []
+        # Labels added to every sample, such as the node and worker
+        self.const_labels: Dict[str, str] = {}
+
+    def register(self, metric: "Metric"):
+        self._metrics.append(metric)
+
+    def forget_stream(self, stream_id: str):
+        """Drop every series labelled with a stream that has ended"""
+        for metric in self._metrics:
+            if metric.labelnames[:1] == ("stream",):
+                metric.remove_matching(stream_id)
+
+    def render(self) -> str:
+        const = tuple(self.const_labels.items())
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                lines.append(
+                    f"{metric.name}{suffix}{_format_labels(const + labels)} "
+                    f"{_format_value(value)}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class GaugeValue:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from `function` at scrape time"""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function else self.value
+
+
+class HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        # One count per bucket plus the +Inf bucket, not yet cumulative
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def time(self) -> "_Timer":
+        """Context manager observing the duration of its block"""
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram: HistogramValue):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Metric:
+    """A named metric with zero or more labels, one child value per label set"""
+
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: MetricsRegistry = REGISTRY,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+        registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values) -> object:
+        """The child for a label set, created on first use; bind it once"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def remove(self, *values):
+        self._children.pop(tuple(str(value) for value in values), None)
+
+    def remove_matching(self, first_value: str):
+        for key in [key for key in self._children if key[0] == first_value]:
+            del self._children[key]
+
+    def _label_pairs(self, key) -> Tuple[Tuple[str, str], ...]:
+        return tuple(zip(self.labelnames, key))
+
+    def samples(self):
+        for key, child in tuple(self._children.items()):
+            yield "", self._label_pairs(key), child.value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return CounterValue()
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return GaugeValue()
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default.set_function(function)
+
+    def samples(self):
+        for key, child in tuple(self._children.items()):
+            yield "", self._label_pairs(key), child.get()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        registry: MetricsRegistry = REGISTRY,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return self._default.time()
+
+    def samples(self):
+        for key, child in tuple(self._children.items()):
+            labels = self._label_pairs(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                yield "_bucket", labels + (("le", _format_value(bound)),), cumulative
+            yield "_sum", labels, child.sum
+            yield "_count", labels, cumulative
+
+
+async def handle_metrics(request):
+    """aiohttp handler serving the registry in the Prometheus text format"""
+    return web.Response(
+        body=REGISTRY.render().encode(), headers={"Content-Type": CONTENT_TYPE}
+    )
+
+
+async def monitor_loop_lag(
+    interval: float = LOOP_LAG_INTERVAL, watchdog=None, on_lag=None
+):
+    """Record how late the event loop wakes from `interval`-second sleeps.
+
+    Beats `watchdog`, a diagnostics.LoopWatchdog, every time it wakes, and
+    passes each lag in seconds to `on_lag`.
+    """
+    loop = asyncio.get_event_loop()
+    if watchdog is not None:
+        watchdog.start(interval)
+    try:
+        while True:
+            before = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - before - interval)
+            LOOP_LAG_SECONDS.observe(lag)
+            if on_lag is not None:
+                on_lag(lag)
+            if watchdog is not None:
+                watchdog.beat()
+    finally:
+        if watchdog is not None:
+            watchdog.stop()
+
+
+# Media
+PACKETS_RECEIVED = Counter(
+    "voice_packets_received_total",
+    "Opus packets received from a stream's sender and eligible for forwarding",
+    ["stream"],
+)
+PACKETS_FORWARDED = Counter(
+    "voice_packets_forwarded_total",
+    "Opus packets queued for a stream's receivers, one per receiver",
+    ["stream"],
+)
+FRAMES_RECEIVED = Counter(
+    "voice_frames_received_total",
+    "Decoded audio frames read from a stream's sender",
+    ["stream"],
+)
+FRAMES_FORWARDED = Counter(
+    "voice_frames_forwarded_total",
+    "Decoded audio frames queued for a stream's receivers, one per receiver",
+    ["stream"],
+)
+RECEIVER_DROPS = Counter(
+    "voice_receiver_queue_drops_total",
+    "Frames or packets dropped because a receiver's queue was full",
+    ["stream"],
+)
+
+# Signaling
+WS_SEND_SECONDS = Histogram(
+    "voice_ws_send_seconds", "Time to hand one WebSocket message to the transport"
+)
+WS_QUEUE_DEPTH = Histogram(
+    "voice_ws_outbound_queue_depth",
+    "Messages already waiting in a connection's outbound queue when one is queued",
+    buckets=QUEUE_DEPTH_BUCKETS,
+)
+WS_MESSAGES_DROPPED = Counter(
+    "voice_ws_messages_dropped_total",
+    "Outbound WebSocket messages dropped because a client's queue was full",
+)
+MESSAGE_SECONDS = Histogram(
+    "voice_handle_message_seconds",
+    "Time to handle one client message, by message type",
+    ["type"],
+)
+PC_STATE_TRANSITIONS = Counter(
+    "voice_peer_connection_states_total",
+    "Peer connection state changes, by role and new state",
+    ["role", "state"],
+)
+SESSION_PHASE_SECONDS = Histogram(
+    "voice_session_phase_seconds",
+    "Receiver connection setup: seconds from start_receiving until each phase "
+    "finished, or the duration of ICE gathering",
+    ["phase"],
+    buckets=SETUP_BUCKETS,
+)
+
+# Server
+LOOP_LAG_SECONDS = Histogram(
+    "voice_event_loop_lag_seconds", "How late the event loop runs a timer"
+)
+ACTIVE_STREAMS = Gauge("voice_active_streams", "Streams sent to this process")
+CONNECTED_CLIENTS = Gauge(
+    "voice_connected_clients", "WebSocket clients connected to this process"
+)
+NEGOTIATIONS_IN_FLIGHT = Gauge(
+    "voice_negotiations_in_flight",
+    "Peer connections started but not yet connected, failed or closed",
+)
+ADMISSION_REJECTIONS = Counter(
+    "voice_admission_rejections_total",
+    "Connections and sessions refused by admission control, by reason",
+    ["reason"],
+)
+PEER_POOL_TAKES = Counter(
+    "voice_peer_pool_takes_total",
+    "Peer connections taken from a pool, by role and whether one was ready",
+    ["role", "result"],
+)
+PEER_POOL_READY = Gauge(
+    "voice_peer_pool_ready", "Prepared peer connections waiting in a pool", ["role"]
+)
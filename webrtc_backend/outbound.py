@@ -0,0 +1,136 @@
+"""
+Per-connection outbound WebSocket queues.
+
+Every connection gets a bounded queue drained by its own writer task, so
+queuing a message never waits for the network. A client that stops reading
+can only fill its own queue: it then either loses its oldest messages or is
+disconnected, depending on the slow-consumer policy, and never delays other
+clients or the caller.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Optional, Union
+
+from aiohttp import WSCloseCode
+
+from metrics import WS_MESSAGES_DROPPED, WS_QUEUE_DEPTH, WS_SEND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_SEND_TIMEOUT = 5.0
+
+# What to do when a connection's queue is full
+POLICY_DISCONNECT = "disconnect"
+POLICY_DROP_OLDEST = "drop_oldest"
+
+
+class OutboundQueue:
+    """Bounded outbound message queue with its own writer task for one WebSocket"""
+
+    def __init__(
+        self,
+        ws,
+        connection_id: str,
+        maxsize: int = DEFAULT_QUEUE_SIZE,
+        send_timeout: float = DEFAULT_SEND_TIMEOUT,
+        policy: str = POLICY_DISCONNECT,
+        transport=None,
+    ):
+        self.ws = ws
+        self.connection_id = connection_id
+        self.send_timeout = send_timeout
+        self.policy = policy
+        self.messages_sent = 0
+        self.messages_dropped = 0
+        self._transport = transport
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._task: Optional[asyncio.Task] = None
+        self._disconnect_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._write_loop())
+
+    def send(self, message: Union[str, bytes]) -> bool:
+        """Queue an already-serialized message without waiting for the network.
+
+        Text goes out as a text frame and bytes as a binary frame.
+        """
+        if self._closing:
+            return False
+
+        WS_QUEUE_DEPTH.observe(self._queue.qsize())
+        if self._queue.full():
+            WS_MESSAGES_DROPPED.inc()
+            if self.policy == POLICY_DROP_OLDEST:
+                self._queue.get_nowait()
+                self.messages_dropped += 1
+            else:
+                self.messages_dropped += 1
+                self._begin_disconnect("outbound queue full")
+                return False
+
+        self._queue.put_nowait(message)
+        return True
+
+    async def close(self):
+        """Stop the writer task; queued messages are discarded"""
+        self._closing = True
+        if self._task is not None and self._task is not asyncio.current_task():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        # A slow-client disconnect is bounded by send_timeout; let it finish
+        # so the client still gets its close frame
+        disconnect = self._disconnect_task
+        if disconnect is not None and disconnect is not asyncio.current_task():
+            await disconnect
+        self._disconnect_task = None
+
+    async def _write_loop(self):
+        while True:
+            message = await self._queue.get()
+            started = time.perf_counter()
+            try:
+                if isinstance(message, bytes):
+                    send = self.ws.send_bytes(message)
+                else:
+                    send = self.ws.send_str(message)
+                await asyncio.wait_for(send, self.send_timeout)
+            except asyncio.TimeoutError:
+                await self._disconnect(f"send timed out after {self.send_timeout}s")
+                return
+            except Exception as e:
+                logger.debug(f"Send to {self.connection_id} failed: {e}")
+                self._closing = True
+                return
+            WS_SEND_SECONDS.observe(time.perf_counter() - started)
+            self.messages_sent += 1
+
+    def _begin_disconnect(self, reason: str):
+        self._closing = True
+        if self._disconnect_task is None:
+            self._disconnect_task = asyncio.ensure_future(self._disconnect(reason))
+
+    async def _disconnect(self, reason: str):
+        self._closing = True
+        logger.warning(f"Disconnecting slow client {self.connection_id}: {reason}")
+        try:
+            await asyncio.wait_for(
+                self.ws.close(code=WSCloseCode.TRY_AGAIN_LATER), self.send_timeout
+            )
+        except Exception:
+            # The close frame cannot get through either; drop the socket
+            if self._transport is not None:
+                self._transport.abort()
@@ -0,0 +1,262 @@
+"""
+Encode-once forwarding of a sender's Opus packets.
+
+``PacketForwarder`` taps the sender's ``RTCRtpReceiver`` before its jitter
+buffer and decoder, wraps each Opus payload in an ``av.Packet`` once, and
+pushes that packet to a proxy track per receiver. When a receiver's
+``RTCRtpSender`` reads a packet instead of a frame it only packs it, so no
+receiver runs an Opus encoder. Each receiver's sender still stamps its own
+SSRC and sequence numbers, and the packet's pts is rebased so RTP timestamps
+keep the sender's spacing (including DTX gaps).
+"""
+
+import asyncio
+import fractions
+import logging
+from typing import Callable, List, Optional, Set
+
+from aiortc import RTCPeerConnection
+from aiortc.rtp import RtpPacket
+from aiortc.sdp import SessionDescription
+from av import Packet
+
+from metrics import PACKETS_FORWARDED, PACKETS_RECEIVED
+from stream_fanout import DEFAULT_QUEUE_SIZE, FanoutTrack
+
+logger = logging.getLogger(__name__)
+
+OPUS_MIME_TYPE = "audio/opus"
+OPUS_TIME_BASE = fractions.Fraction(1, 48000)
+
+
+def negotiated_audio_codec(sdp: str) -> Optional[str]:
+    """Return the mime type of the first audio codec in an SDP, if any"""
+    description = SessionDescription.parse(sdp)
+    for media in description.media:
+        if media.kind == "audio" and media.rtp.codecs:
+            return media.rtp.codecs[0].mimeType.lower()
+    return None
+
+
+class PacketForwarder:
+    """Forwards one sender's encoded Opus packets to every subscribed receiver"""
+
+    def __init__(
+        self,
+        pc: RTCPeerConnection,
+        stream_id: str,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ):
+        self.pc = pc
+        self.stream_id = stream_id
+        self.queue_size = queue_size
+        self.packets_received = 0
+        self.packets_discarded = 0
+        self._received_metric = PACKETS_RECEIVED.labels(stream_id)
+        self._forwarded_metric = PACKETS_FORWARDED.labels(stream_id)
+        self._payload_type: Optional[int] = None
+        self._first_timestamp: Optional[int] = None
+        self._last_sequence: Optional[int] = None
+        self._tracks: Set[FanoutTrack] = set()
+        self._listeners: List[Callable] = []
+
+    @property
+    def receiver_count(self) -> int:
+        return len(self._tracks)
+
+    @property
+    def forwarding(self) -> bool:
+        """Whether the sender negotiated Opus, so its packets can be forwarded"""
+        if self._payload_type is None:
+            self._payload_type = self._resolve_payload_type()
+        return self._payload_type is not None and self._payload_type >= 0
+
+    def attach(self, receiver):
+        """Tap an RTCRtpReceiver so every incoming RTP packet is seen once"""
+        handle_rtp_packet = receiver._handle_rtp_packet
+
+        async def tapped_handle_rtp_packet(packet, arrival_time_ms):
+            self.handle_rtp_packet(packet)
+            await handle_rtp_packet(packet, arrival_time_ms=arrival_time_ms)
+
+        receiver._handle_rtp_packet = tapped_handle_rtp_packet
+
+    def subscribe(self, receiver_id: str) -> FanoutTrack:
+        """Create a packet proxy track for a new receiver"""
+        track = FanoutTrack(self, receiver_id, self.queue_size)
+        self._tracks.add(track)
+        return track
+
+    def unsubscribe(self, track: FanoutTrack):
+        self._tracks.discard(track)
+
+    def add_listener(self, callback: Callable):
+        """Call `callback(rtp_packet)` for every forwarded Opus packet; it must not block"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def stop(self):
+        """End every packet proxy track"""
+        for track in tuple(self._tracks):
+            track.push(None)
+        self._tracks.clear()
+
+    def handle_rtp_packet(self, packet):
+        if not self.forwarding:
+            return
+
+        # RTX, FEC and other payload types are left to the receiver pipeline
+        if packet.payload_type != self._payload_type or not packet.payload:
+            return
+
+        self.packets_received += 1
+        self._received_metric.inc()
+
+        # Forward only packets newer than the last one; late and duplicate
+        # packets would otherwise go out with fresh sequence numbers
+        if self._last_sequence is not None:
+            delta = (packet.sequence_number - self._last_sequence) & 0xFFFF
+            if delta == 0 or delta >= 0x8000:
+                self.packets_discarded += 1
+                return
+        self._last_sequence = packet.sequence_number
+
+        if self._first_timestamp is None:
+            self._first_timestamp = packet.timestamp
+
+        for listener in tuple(self._listeners):
+            try:
+                listener(packet)
+            except Exception as e:
+                logger.error(f"Packet listener for {self.stream_id} failed: {e}")
+
+        if not self._tracks:
+            return
+
+        forwarded = Packet(packet.payload)
+        forwarded.pts = (packet.timestamp - self._first_timestamp) & 0xFFFFFFFF
+        forwarded.time_base = OPUS_TIME_BASE
+        tracks = tuple(self._tracks)
+        for track in tracks:
+            track.push(forwarded)
+        self._forwarded_metric.inc(len(tracks))
+
+    def _resolve_payload_type(self) -> Optional[int]:
+        description = self.pc.localDescription
+        if description is None:
+            return None
+
+        # The sender encodes with the first codec of the answer
+        for media in SessionDescription.parse(description.sdp).media:
+            if media.kind == "audio" and media.rtp.codecs:
+                codec = media.rtp.codecs[0]
+                if codec.mimeType.lower() == OPUS_MIME_TYPE:
+                    return codec.payloadType
+                break
+
+        logger.warning(
+            f"Sender of {self.stream_id} did not negotiate Opus, forwarding disabled"
+        )
+        return -1
+
+
+class RemotePacketSource:
+    """Stands in for the PacketForwarder of a stream received elsewhere.
+
+    Subclasses get the stream's Opus packets from another worker or node
+    in `_run` and hand each one to `push_packet`. Receivers subscribe and
+    listeners are called exactly as with a PacketForwarder.
+    """
+
+    forwarding = True
+
+    def __init__(self, stream_id: str, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.stream_id = stream_id
+        self.queue_size = queue_size
+        self.packets_received = 0
+        self._received_metric = PACKETS_RECEIVED.labels(stream_id)
+        self._forwarded_metric = PACKETS_FORWARDED.labels(stream_id)
+        self._first_timestamp: Optional[int] = None
+        self._tracks: Set[FanoutTrack] = set()
+        self._listeners: List[Callable] = []
+        self._task: Optional[asyncio.Task] = None
+        # Called when the source ends by itself rather than through stop()
+        self.on_ended: Optional[Callable[[], None]] = None
+
+    @property
+    def receiver_count(self) -> int:
+        return len(self._tracks)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def subscribe(self, receiver_id: str) -> FanoutTrack:
+        track = FanoutTrack(self, receiver_id, self.queue_size)
+        self._tracks.add(track)
+        return track
+
+    def unsubscribe(self, track: FanoutTrack):
+        self._tracks.discard(track)
+
+    def add_listener(self, callback: Callable):
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    async def stop(self):
+        """Stop receiving and end every proxy track"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error(f"Packet source for {self.stream_id} failed: {e}")
+            self._task = None
+        self.end_tracks()
+        self._close()
+
+    def end_tracks(self):
+        for track in tuple(self._tracks):
+            track.push(None)
+        self._tracks.clear()
+
+    def ended(self):
+        """End every proxy track and tell the owner this source is done"""
+        self.end_tracks()
+        if self.on_ended:
+            self.on_ended()
+
+    def push_packet(self, timestamp: int, payload: bytes):
+        self.packets_received += 1
+        self._received_metric.inc()
+        if self._listeners:
+            rtp_packet = RtpPacket(timestamp=timestamp, payload=payload)
+            for listener in tuple(self._listeners):
+                try:
+                    listener(rtp_packet)
+                except Exception as e:
+                    logger.error(f"Packet listener for {self.stream_id} failed: {e}")
+
+        if self._first_timestamp is None:
+            self._first_timestamp = timestamp
+        packet = Packet(payload)
+        packet.pts = (timestamp - self._first_timestamp) & 0xFFFFFFFF
+        packet.time_base = OPUS_TIME_BASE
+        tracks = tuple(self._tracks)
+        for track in tracks:
+            track.push(packet)
+        self._forwarded_metric.inc(len(tracks))
+
+    async def _run(self):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
@@ -0,0 +1,146 @@
+"""
+Rolling in-memory history of a stream's decoded audio.
+
+Each active stream keeps its last N seconds of PCM in one circular NumPy
+buffer, allocated when the first frame arrives. Frames are copied straight
+from the decoder's plane into the ring, so keeping the history costs no
+allocation per frame, constant memory, and no disk I/O. A snapshot copies
+a time window out and encodes it to WAV or Ogg/Opus only when someone asks
+for it.
+"""
+
+import io
+import time
+import wave
+from fractions import Fraction
+from typing import Optional, Tuple
+
+import av
+import numpy as np
+
+DEFAULT_HISTORY_SECONDS = 30
+SNAPSHOT_FORMATS = ("wav", "opus")
+OPUS_FRAME_SAMPLES = 960
+
+
+class PcmHistory:
+    """Fixed-size ring of the last `seconds` of interleaved int16 audio"""
+
+    def __init__(self, seconds: float = DEFAULT_HISTORY_SECONDS):
+        self.seconds = seconds
+        self.sample_rate: Optional[int] = None
+        self.channels: Optional[int] = None
+        self.capacity = 0
+        self._buffer: Optional[np.ndarray] = None
+        self._written = 0
+        # Wall-clock time of the end of the newest sample
+        self._end_time: Optional[float] = None
+
+    @property
+    def available_seconds(self) -> float:
+        if not self.sample_rate:
+            return 0.0
+        return min(self._written, self.capacity) / self.sample_rate
+
+    @property
+    def end_time(self) -> Optional[float]:
+        return self._end_time
+
+    def _allocate(self, sample_rate: int, channels: int):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.capacity = int(sample_rate * self.seconds)
+        self._buffer = np.zeros((self.capacity, channels), dtype=np.int16)
+
+    def add_frame(self, frame):
+        """Copy a decoded av.AudioFrame into the ring"""
+        channels = len(frame.layout.channels)
+        if self._buffer is None:
+            self._allocate(frame.sample_rate, channels)
+        if frame.format.name == "s16":
+            # Packed int16, as aiortc decodes: view the plane without a copy
+            samples = np.frombuffer(
+                frame.planes[0], dtype=np.int16, count=frame.samples * channels
+            )
+        else:
+            samples = frame.to_ndarray().astype(np.int16, copy=False)
+        self.write(samples)
+
+    def write(self, samples: np.ndarray, timestamp: float = None):
+        """Append interleaved int16 samples; `timestamp` is when the last one was captured"""
+        frames = samples.reshape(-1, self.channels)
+        count = frames.shape[0]
+        if count > self.capacity:
+            frames = frames[-self.capacity :]
+            self._written += count - self.capacity
+            count = self.capacity
+
+        start = self._written % self.capacity
+        first = min(count, self.capacity - start)
+        self._buffer[start : start + first] = frames[:first]
+        if first < count:
+            self._buffer[: count - first] = frames[first:]
+        self._written += count
+        self._end_time = time.time() if timestamp is None else timestamp
+
+    def snapshot(self, seconds: float, end: float = None) -> Tuple[np.ndarray, float]:
+        """Copy out up to `seconds` of audio ending at wall-clock time `end`.
+
+        Returns the samples, shaped (frames, channels), and the capture time
+        of the first one. The window is clipped to what the ring still holds.
+        """
+        if self._buffer is None:
+            return np.zeros((0, 1), dtype=np.int16), time.time()
+
+        available = min(self._written, self.capacity)
+        skip = 0
+        if end is not None:
+            skip = int(max(0.0, self._end_time - end) * self.sample_rate)
+        skip = min(skip, available)
+        count = min(int(seconds * self.sample_rate), available - skip)
+
+        stop = self._written - skip
+        indices = np.arange(stop - count, stop) % self.capacity
+        samples = self._buffer[indices]
+        start_time = self._end_time - (skip + count) / self.sample_rate
+        return samples, start_time
+
+
+def encode_snapshot(
+    samples: np.ndarray, sample_rate: int, channels: int, fmt: str = "wav"
+) -> bytes:
+    """Encode a snapshot to a WAV or Ogg/Opus file in memory; CPU-bound"""
+    if fmt == "wav":
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(channels)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(np.ascontiguousarray(samples).tobytes())
+        return buffer.getvalue()
+
+    if fmt != "opus":
+        raise ValueError(
+            f"Unsupported snapshot format {fmt!r}, use one of {SNAPSHOT_FORMATS}"
+        )
+
+    buffer = io.BytesIO()
+    layout = "stereo" if channels == 2 else "mono"
+    with av.open(buffer, "w", format="ogg") as container:
+        stream = container.add_stream("libopus", rate=sample_rate)
+        stream.layout = layout
+        pts = 0
+        for offset in range(0, samples.shape[0], OPUS_FRAME_SAMPLES):
+            chunk = np.ascontiguousarray(samples[offset : offset + OPUS_FRAME_SAMPLES])
+            frame = av.AudioFrame.from_ndarray(
+                chunk.reshape(1, -1), format="s16", layout=layout
+            )
+            frame.sample_rate = sample_rate
+            frame.pts = pts
+            frame.time_base = Fraction(1, sample_rate)
+            pts += chunk.shape[0]
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buffer.getvalue()
@@ -0,0 +1,125 @@
+"""
+Peer connections prepared ahead of demand.
+
+Creating an RTCPeerConnection generates its DTLS key and certificate,
+and its first setLocalDescription gathers ICE candidates, which waits a
+round trip to every STUN server. A PeerConnectionPool does both in the
+background. Each pooled connection already has its DTLS certificate and
+an audio transceiver, and, with `gather`, the transceiver's candidates
+are already gathered. A new session takes one and skips that work.
+
+aiortc has no way to hand a new peer connection an existing certificate,
+so the pool keeps whole peer connections rather than bare certificates.
+Its size follows demand: it holds as many connections as were taken in
+the last DEMAND_WINDOW seconds, between `min_size` and `max_size`.
+Connections older than `max_age` are closed unused, since NAT bindings
+behind their server-reflexive candidates expire.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable
+
+from aiortc import RTCPeerConnection
+
+from metrics import PEER_POOL_READY, PEER_POOL_TAKES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 4
+DEFAULT_MAX_AGE = 30.0
+# Connections taken this recently set the pool's size
+DEMAND_WINDOW = 10.0
+
+
+class PeerConnectionPool:
+    """Ready peer connections with one audio transceiver, refilled in the background"""
+
+    def __init__(
+        self,
+        factory: Callable[[], RTCPeerConnection],
+        direction: str,
+        role: str,
+        gather: bool = True,
+        min_size: int = 1,
+        max_size: int = DEFAULT_MAX_SIZE,
+        max_age: float = DEFAULT_MAX_AGE,
+    ):
+        self.factory = factory
+        # Transceiver direction: "sendonly" for receivers, "recvonly" for senders
+        self.direction = direction
+        self.role = role
+        self.gather = gather
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_age = max_age
+        self._ready = deque()  # (created, pc), oldest first
+        self._taken = deque()  # when connections were taken
+        self._wakeup = None
+        self._task = None
+        self._hit = PEER_POOL_TAKES.labels(role, "hit")
+        self._miss = PEER_POOL_TAKES.labels(role, "miss")
+        PEER_POOL_READY.labels(role).set_function(lambda: len(self._ready))
+
+    def target_size(self) -> int:
+        expired = time.monotonic() - DEMAND_WINDOW
+        while self._taken and self._taken[0] < expired:
+            self._taken.popleft()
+        return max(self.min_size, min(self.max_size, len(self._taken)))
+
+    def take(self) -> RTCPeerConnection:
+        """A prepared peer connection, or a new unprepared one if none is ready"""
+        now = time.monotonic()
+        self._taken.append(now)
+        if self._wakeup:
+            self._wakeup.set()
+        while self._ready:
+            created, pc = self._ready.popleft()
+            if now - created <= self.max_age:
+                self._hit.inc()
+                return pc
+            asyncio.ensure_future(pc.close())
+        self._miss.inc()
+        return self.factory()
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._refill())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        while self._ready:
+            _, pc = self._ready.popleft()
+            await pc.close()
+
+    async def _prepare(self) -> RTCPeerConnection:
+        pc = self.factory()
+        transceiver = pc.addTransceiver("audio", direction=self.direction)
+        if self.gather:
+            await transceiver.sender.transport.transport.iceGatherer.gather()
+        return pc
+
+    async def _refill(self):
+        while True:
+            expired = time.monotonic() - self.max_age
+            while self._ready and self._ready[0][0] < expired:
+                await self._ready.popleft()[1].close()
+            while len(self._ready) < self.target_size():
+                try:
+                    pc = await self._prepare()
+                except Exception as e:
+                    logger.error(
+                        f"Could not prepare a {self.role} peer connection: {e}"
+                    )
+                    break
+                self._ready.append((time.monotonic(), pc))
+            self._wakeup.clear()
+            # Woken by a take; the timeout retires old connections
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.max_age / 2)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,681 @@
+"""
+Segmented stream recording with file I/O off the event loop.
+
+Each stream is written to its own directory as a series of segment files
+that rotate every `segment_seconds`, and after a pause in the audio (for
+example while VAD holds back silence). The event loop only copies samples
+into a per-stream buffer. Full buffers are handed to a small pool of
+writer threads through bounded queues, and every stream sticks to one
+writer so its chunks stay in order. When a writer falls behind, its queue
+applies the overflow policy instead of blocking the media path.
+
+Recordings are either 16-bit PCM WAV, from decoded audio, or Ogg/Opus
+built straight from the sender's RTP payloads, which skips decoding and
+takes a small fraction of the disk space.
+
+A SQLite index next to the recordings lists every segment (stream, start
+and end time, file, data offset, length) plus a byte-offset mark about
+once a second, so a time range maps to files and offsets without listing
+or opening anything.
+"""
+
+import collections
+import logging
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEGMENT_SECONDS = 300
+DEFAULT_WRITER_THREADS = 2
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_BUFFER_MS = 1000
+# Pauses shorter than this are filled with silence, longer ones start a new segment
+DEFAULT_MAX_GAP_SECONDS = 2.0
+# Decoded audio is placed by arrival time, which jitters by a few frames;
+# only later arrivals than this are a pause worth filling with silence
+MIN_GAP_SECONDS = 0.06
+MARK_INTERVAL = 1.0
+
+# Opus always runs its timeline, and so Ogg granule positions, at 48 kHz
+OPUS_SAMPLE_RATE = 48000
+OPUS_FRAME_SAMPLES = (120, 240, 480, 960)
+OPUS_SILK_FRAME_SAMPLES = (480, 960, 1920, 2880)
+MAX_PAGE_SEGMENTS = 255
+# Bit order of every byte swapped, to get Ogg's unreflected CRC out of zlib
+_BIT_REVERSED = bytes(int(f"{byte:08b}"[::-1], 2) for byte in range(256))
+
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_DROP_NEWEST = "drop_newest"
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    stream TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL,
+    path TEXT NOT NULL,
+    format TEXT NOT NULL,
+    sample_rate INTEGER NOT NULL,
+    channels INTEGER NOT NULL,
+    data_offset INTEGER NOT NULL,
+    bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS segments_stream_time ON segments (stream, start);
+CREATE TABLE IF NOT EXISTS marks (
+    segment_id INTEGER NOT NULL,
+    timestamp REAL NOT NULL,
+    offset INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS marks_segment_time ON marks (segment_id, timestamp);
+"""
+
+
+class RecordingIndex:
+    """SQLite index of segments and byte-offset marks, shared by all writers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets readers look up ranges while writers append
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(INDEX_SCHEMA)
+        self._db.commit()
+
+    def add_segment(
+        self,
+        stream: str,
+        start: float,
+        path: str,
+        fmt: str,
+        sample_rate: int,
+        channels: int,
+        data_offset: int,
+    ) -> int:
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO segments (stream, start, path, format, sample_rate, channels, data_offset)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (stream, start, path, fmt, sample_rate, channels, data_offset),
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def add_marks(self, segment_id: int, marks: List[tuple]):
+        """Store (timestamp, offset) pairs for a segment"""
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO marks (segment_id, timestamp, offset) VALUES (?, ?, ?)",
+                [(segment_id, timestamp, offset) for timestamp, offset in marks],
+            )
+            self._db.commit()
+
+    def finish_segment(self, segment_id: int, end: float, size: int):
+        with self._lock:
+            self._db.execute(
+                "UPDATE segments SET end = ?, bytes = ? WHERE id = ?",
+                (end, size, segment_id),
+            )
+            self._db.commit()
+
+    def lookup(self, stream: str, start: float, end: float) -> List[dict]:
+        """Segments of a stream overlapping [start, end), oldest first"""
+        with self._lock:
+            cursor = self._db.execute(
+                "SELECT id, stream, start, end, path, format, sample_rate, channels,"
+                " data_offset, bytes FROM segments"
+                " WHERE stream = ? AND start < ? AND (end IS NULL OR end > ?)"
+                " ORDER BY start",
+                (stream, end, start),
+            )
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def segment(self, segment_id: int) -> Optional[dict]:
+        with self._lock:
+            cursor = self._db.execute(
+                "SELECT id, stream, start, end, path, format, sample_rate, channels,"
+                " data_offset, bytes FROM segments WHERE id = ?",
+                (segment_id,),
+            )
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
+            return dict(zip(columns, row)) if row else None
+
+    def offset_at(self, segment_id: int, timestamp: float) -> Optional[tuple]:
+        """Latest (timestamp, offset) mark at or before `timestamp`"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT timestamp, offset FROM marks WHERE segment_id = ? AND timestamp <= ?"
+                " ORDER BY timestamp DESC LIMIT 1",
+                (segment_id, timestamp),
+            ).fetchone()
+
+    def streams(self) -> List[str]:
+        with self._lock:
+            return [
+                row[0]
+                for row in self._db.execute(
+                    "SELECT DISTINCT stream FROM segments ORDER BY stream"
+                )
+            ]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def wav_header(sample_rate: int, channels: int, data_bytes: int) -> bytes:
+    """44-byte header of a 16-bit PCM WAV file"""
+    frame_bytes = 2 * channels
+    return (
+        b"RIFF"
+        + struct.pack("<I", 36 + data_bytes)
+        + b"WAVE"
+        + b"fmt "
+        + struct.pack(
+            "<IHHIIHH",
+            16,
+            1,
+            channels,
+            sample_rate,
+            sample_rate * frame_bytes,
+            frame_bytes,
+            16,
+        )
+        + b"data"
+        + struct.pack("<I", data_bytes)
+    )
+
+
+class WavSegmentWriter:
+    """16-bit PCM WAV file whose sizes are filled in when it is closed"""
+
+    format = "wav"
+    extension = ".wav"
+    header_size = 44
+
+    def __init__(self, path: str, sample_rate: int, channels: int):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_bytes = 2 * channels
+        self._file = open(path, "wb", buffering=64 * 1024)
+        self._file.write(self._header(0))
+        self.size = self.header_size
+
+    def _header(self, data_bytes: int) -> bytes:
+        return wav_header(self.sample_rate, self.channels, data_bytes)
+
+    def write(self, data) -> int:
+        self._file.write(data)
+        self.size += len(data)
+        return len(data)
+
+    def write_silence(self, samples: int):
+        remaining = samples * self.frame_bytes
+        zeros = bytes(min(remaining, 64 * 1024))
+        while remaining:
+            remaining -= self.write(zeros[:remaining])
+
+    def close(self):
+        self._file.seek(0)
+        self._file.write(self._header(self.size - self.header_size))
+        self._file.close()
+
+
+def ogg_crc(data: bytes) -> int:
+    """Ogg page checksum: CRC-32, polynomial 0x04c11db7, unreflected, no xor"""
+    crc = zlib.crc32(data.translate(_BIT_REVERSED), 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return int(f"{crc:032b}"[::-1], 2)
+
+
+def opus_packet_samples(packet: bytes) -> int:
+    """Duration of an Opus packet in 48 kHz samples, from its TOC byte (RFC 6716)"""
+    config = packet[0] >> 3
+    if config < 12:
+        frame = OPUS_SILK_FRAME_SAMPLES[config % 4]
+    elif config < 16:
+        frame = OPUS_FRAME_SAMPLES[2 + config % 2]
+    else:
+        frame = OPUS_FRAME_SAMPLES[config % 4]
+    code = packet[0] & 0x3
+    if code == 0:
+        return frame
+    if code < 3:
+        return 2 * frame
+    return frame * (packet[1] & 0x3F) if len(packet) > 1 else 0
+
+
+class OggOpusSegmentWriter:
+    """Ogg/Opus file (RFC 7845) written from already-encoded Opus packets.
+
+    Packets are collected into a page until it is full or `flush_page` is
+    called, so byte offsets taken after a flush are page boundaries a
+    reader can seek to. Lost packets are replaced by empty Opus frames,
+    which decoders conceal like a lost packet, so granule positions keep
+    matching the sender's timeline.
+    """
+
+    format = "opus"
+    extension = ".opus"
+
+    def __init__(self, path: str, sample_rate: int, channels: int):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.granule = 0
+        self._serial = zlib.crc32(path.encode())
+        self._sequence = 0
+        self._segments = bytearray()
+        self._payload = bytearray()
+        self._plc_packet = b"\xf8"  # CELT 20 ms, code 0, no frame data
+        self._plc_samples = 960
+        self._file = open(path, "wb", buffering=64 * 1024)
+        self.size = 0
+
+        self._add_packet(
+            b"OpusHead" + struct.pack("<BBHIhB", 1, channels, 0, sample_rate, 0, 0)
+        )
+        self.flush_page(flags=0x02)
+        vendor = b"webrtc_voice_streaming"
+        self._add_packet(
+            b"OpusTags" + struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", 0)
+        )
+        self.flush_page()
+        self.header_size = self.size
+
+    def _add_packet(self, packet: bytes):
+        lacing = len(packet) // 255 + 1
+        if len(self._segments) + lacing > MAX_PAGE_SEGMENTS:
+            self.flush_page()
+        self._segments += b"\xff" * (lacing - 1) + bytes((len(packet) % 255,))
+        self._payload += packet
+
+    def write_packet(self, packet: bytes, samples: int) -> int:
+        self.granule += samples
+        self._add_packet(packet)
+        # Gaps after this packet are concealed with frames of the same mode
+        self._plc_packet = bytes((packet[0] & 0xFC,))
+        self._plc_samples = opus_packet_samples(self._plc_packet) or 960
+        return len(packet)
+
+    def write_silence(self, samples: int):
+        for _ in range(samples // self._plc_samples):
+            self.write_packet(self._plc_packet, self._plc_samples)
+
+    def flush_page(self, flags: int = 0):
+        if not self._segments and not flags:
+            return
+        page = bytearray(
+            b"OggS"
+            + struct.pack(
+                "<BBqIIIB",
+                0,
+                flags,
+                self.granule,
+                self._serial,
+                self._sequence,
+                0,
+                len(self._segments),
+            )
+        )
+        page += self._segments
+        page += self._payload
+        page[22:26] = struct.pack("<I", ogg_crc(bytes(page)))
+        self._file.write(page)
+        self.size += len(page)
+        self._sequence += 1
+        self._segments = bytearray()
+        self._payload = bytearray()
+
+    def close(self):
+        self.flush_page(flags=0x04)
+        self._file.close()
+
+
+WRITERS = {
+    WavSegmentWriter.format: WavSegmentWriter,
+    OggOpusSegmentWriter.format: OggOpusSegmentWriter,
+}
+
+
+class StreamRecording:
+    """Recording of one stream; write() is called on the event loop"""
+
+    def __init__(
+        self,
+        recorder: "Recorder",
+        stream: str,
+        sample_rate: int,
+        channels: int,
+        fmt: str,
+        worker: "WriterThread",
+    ):
+        self.recorder = recorder
+        self.stream = stream
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.format = fmt
+        self.worker = worker
+        self.closed = False
+        self._buffer = bytearray()
+        self._buffer_timestamp: Optional[float] = None
+        self._flush_bytes = (
+            max(1, sample_rate * recorder.buffer_ms // 1000) * 2 * channels
+        )
+        # (RTP timestamp, capture time, payload) of packets not yet handed over
+        self._packets: List[tuple] = []
+        self._flush_packets = max(1, recorder.buffer_ms // 20)
+
+        # Writer-side state, only touched by self.worker
+        self.segment: Optional[WavSegmentWriter] = None
+        self.segment_id: Optional[int] = None
+        self.segment_start = 0.0
+        self.segment_samples = 0
+        # RTP timestamp at the start of an "opus" segment
+        self.segment_rtp = 0
+        self.marks: List[tuple] = []
+        self.next_mark = 0.0
+
+    def write(self, samples: np.ndarray, timestamp: float = None):
+        """Buffer interleaved int16 samples captured at `timestamp`"""
+        if self.closed:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        if self._buffer_timestamp is None:
+            self._buffer_timestamp = timestamp
+        self._buffer += memoryview(np.ascontiguousarray(samples)).cast("B")
+        if len(self._buffer) >= self._flush_bytes:
+            self.flush()
+
+    def write_packet(self, payload: bytes, rtp_timestamp: int, timestamp: float = None):
+        """Buffer one encoded Opus packet with its RTP timestamp, for "opus" recordings"""
+        if self.closed:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        self._packets.append((rtp_timestamp, timestamp, payload))
+        if len(self._packets) >= self._flush_packets:
+            self.flush()
+
+    def flush(self):
+        """Hand the buffered audio to the writer, e.g. when speech ends"""
+        if self._buffer:
+            chunk, self._buffer = self._buffer, bytearray()
+            self.worker.submit(self, chunk, self._buffer_timestamp)
+            self._buffer_timestamp = None
+        if self._packets:
+            packets, self._packets = self._packets, []
+            self.worker.submit(self, packets, packets[0][1])
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self.closed = True
+            self.worker.submit(self, None, None)
+
+
+class WriterThread(threading.Thread):
+    """Writes queued chunks for the streams assigned to it"""
+
+    def __init__(self, recorder: "Recorder", name: str, maxsize: int, policy: str):
+        super().__init__(name=name, daemon=True)
+        self.recorder = recorder
+        self.maxsize = maxsize
+        self.policy = policy
+        self.chunks_written = 0
+        self.chunks_dropped = 0
+        self._queue = collections.deque()
+        self._ready = threading.Condition()
+        self._stopping = False
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def submit(
+        self,
+        recording: StreamRecording,
+        chunk: Optional[bytearray],
+        timestamp: Optional[float],
+    ):
+        """Queue a chunk without blocking; a None chunk closes the recording"""
+        with self._ready:
+            if chunk is not None and len(self._queue) >= self.maxsize:
+                self.chunks_dropped += 1
+                if self.policy == POLICY_DROP_NEWEST:
+                    return
+                self._drop_oldest_chunk()
+            self._queue.append((recording, chunk, timestamp))
+            self._ready.notify()
+
+    def _drop_oldest_chunk(self):
+        # Close requests are never dropped, or the file would stay open
+        for index, (_, chunk, _) in enumerate(self._queue):
+            if chunk is not None:
+                del self._queue[index]
+                return
+
+    def stop(self):
+        with self._ready:
+            self._stopping = True
+            self._ready.notify()
+
+    def run(self):
+        while True:
+            with self._ready:
+                while not self._queue and not self._stopping:
+                    self._ready.wait()
+                if not self._queue:
+                    return
+                recording, chunk, timestamp = self._queue.popleft()
+            try:
+                if chunk is None:
+                    self.recorder.finish_segment(recording)
+                elif isinstance(chunk, list):
+                    self.recorder.write_packets(recording, chunk)
+                    self.chunks_written += 1
+                else:
+                    self.recorder.write_chunk(recording, chunk, timestamp)
+                    self.chunks_written += 1
+            except Exception as e:
+                logger.error(f"Recording write failed for {recording.stream}: {e}")
+
+
+class Recorder:
+    """Per-stream segmented recordings written by a pool of writer threads"""
+
+    def __init__(
+        self,
+        directory: str,
+        segment_seconds: int = DEFAULT_SEGMENT_SECONDS,
+        writer_threads: int = DEFAULT_WRITER_THREADS,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        overflow_policy: str = POLICY_DROP_OLDEST,
+        buffer_ms: int = DEFAULT_BUFFER_MS,
+        max_gap_seconds: float = DEFAULT_MAX_GAP_SECONDS,
+    ):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.buffer_ms = buffer_ms
+        self.max_gap_seconds = max_gap_seconds
+        os.makedirs(directory, exist_ok=True)
+        self.index = RecordingIndex(os.path.join(directory, "index.db"))
+        self.recordings: Dict[str, StreamRecording] = {}
+        self.workers = [
+            WriterThread(self, f"recorder-{number}", queue_size, overflow_policy)
+            for number in range(max(1, writer_threads))
+        ]
+        for worker in self.workers:
+            worker.start()
+        self._next_worker = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> "Recorder":
+        return cls(
+            config["directory"],
+            segment_seconds=config.get("segment_seconds", DEFAULT_SEGMENT_SECONDS),
+            writer_threads=config.get("writer_threads", DEFAULT_WRITER_THREADS),
+            queue_size=config.get("queue_size", DEFAULT_QUEUE_SIZE),
+            overflow_policy=config.get("overflow_policy", POLICY_DROP_OLDEST),
+        )
+
+    def open_stream(
+        self,
+        stream: str,
+        sample_rate: int,
+        channels: int,
+        fmt: str = WavSegmentWriter.format,
+    ) -> StreamRecording:
+        """Start recording a stream; streams are spread over the writers in turn"""
+        stream = re.sub(r"[^A-Za-z0-9_.-]", "_", stream)
+        worker = self.workers[self._next_worker % len(self.workers)]
+        self._next_worker += 1
+        recording = StreamRecording(self, stream, sample_rate, channels, fmt, worker)
+        self.recordings[stream] = recording
+        return recording
+
+    def close_stream(self, recording: StreamRecording):
+        recording.close()
+        if self.recordings.get(recording.stream) is recording:
+            del self.recordings[recording.stream]
+
+    def stop(self):
+        """Close every recording and wait for the writers to drain; blocks"""
+        for recording in list(self.recordings.values()):
+            self.close_stream(recording)
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            worker.join()
+        self.index.close()
+
+    @property
+    def chunks_dropped(self) -> int:
+        return sum(worker.chunks_dropped for worker in self.workers)
+
+    # Writer thread side
+
+    def write_chunk(
+        self, recording: StreamRecording, chunk: bytearray, timestamp: float
+    ):
+        frame_bytes = 2 * recording.channels
+        samples = len(chunk) // frame_bytes
+        rate = recording.sample_rate
+
+        if recording.segment is not None:
+            expected = recording.segment_start + recording.segment_samples / rate
+            gap = timestamp - expected
+            if (
+                gap > self.max_gap_seconds
+                or expected - recording.segment_start >= self.segment_seconds
+            ):
+                self.finish_segment(recording)
+            elif gap >= MIN_GAP_SECONDS:
+                # Short pause: keep the file's timeline aligned with capture time
+                silence = int(gap * rate)
+                recording.segment.write_silence(silence)
+                recording.segment_samples += silence
+
+        if recording.segment is None:
+            self.start_segment(recording, timestamp)
+
+        segment = recording.segment
+        position = recording.segment_start + recording.segment_samples / rate
+        if position >= recording.next_mark:
+            recording.marks.append((position, segment.size))
+            recording.next_mark = position + MARK_INTERVAL
+        segment.write(chunk)
+        recording.segment_samples += samples
+
+        if recording.marks:
+            self.index.add_marks(recording.segment_id, recording.marks)
+            recording.marks = []
+
+    def write_packets(self, recording: StreamRecording, packets: List[tuple]):
+        """Append Opus packets, placing each by its RTP timestamp"""
+        rate = recording.sample_rate
+        for rtp_timestamp, timestamp, payload in packets:
+            samples = opus_packet_samples(payload)
+            if recording.segment is not None:
+                offset = (rtp_timestamp - recording.segment_rtp) & 0xFFFFFFFF
+                if offset >= 0x80000000:
+                    # Older than the segment start: late or reordered
+                    continue
+                gap = offset - recording.segment_samples
+                if gap < 0:
+                    continue
+                if (
+                    gap > self.max_gap_seconds * rate
+                    or recording.segment_samples >= self.segment_seconds * rate
+                ):
+                    self.finish_segment(recording)
+                elif gap:
+                    # Lost packets or DTX: conceal so granules stay on the RTP timeline
+                    recording.segment.write_silence(gap)
+                    recording.segment_samples = recording.segment.granule
+
+            if recording.segment is None:
+                self.start_segment(recording, timestamp)
+                recording.segment_rtp = rtp_timestamp
+
+            segment = recording.segment
+            position = recording.segment_start + recording.segment_samples / rate
+            if position >= recording.next_mark:
+                segment.flush_page()
+                recording.marks.append((position, segment.size))
+                recording.next_mark = position + MARK_INTERVAL
+            segment.write_packet(payload, samples)
+            recording.segment_samples = segment.granule
+
+        if recording.marks:
+            self.index.add_marks(recording.segment_id, recording.marks)
+            recording.marks = []
+
+    def start_segment(self, recording: StreamRecording, timestamp: float):
+        directory = os.path.join(self.directory, recording.stream)
+        os.makedirs(directory, exist_ok=True)
+        writer_class = WRITERS[recording.format]
+        name = datetime.fromtimestamp(timestamp).strftime("%Y%m%d-%H%M%S-%f")
+        path = os.path.join(directory, name + writer_class.extension)
+
+        recording.segment = writer_class(
+            path, recording.sample_rate, recording.channels
+        )
+        recording.segment_start = timestamp
+        recording.segment_samples = 0
+        recording.next_mark = timestamp
+        recording.segment_id = self.index.add_segment(
+            recording.stream,
+            timestamp,
+            os.path.relpath(path, self.directory),
+            writer_class.format,
+            recording.sample_rate,
+            recording.channels,
+            recording.segment.size,
+        )
+
+    def finish_segment(self, recording: StreamRecording):
+        segment = recording.segment
+        if segment is None:
+            return
+        segment.close()
+        end = (
+            recording.segment_start + recording.segment_samples / recording.sample_rate
+        )
+        self.index.finish_segment(recording.segment_id, end, segment.size)
+        recording.segment = None
+        recording.segment_id = None
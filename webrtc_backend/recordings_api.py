@@ -0,0 +1,301 @@
+"""
+HTTP access to recorded segments.
+
+    GET /api/recordings                             streams with recordings
+    GET /api/recordings/{stream}?start=&end=        segments overlapping a time range
+    GET /api/recordings/{stream}/audio?start=&end=  the range as one WAV or Ogg file
+    GET /api/recordings/{stream}/segments/{id}      one whole segment file
+
+Times are Unix timestamps. A time range is mapped to byte ranges of the
+segment files through the recording index, without listing or scanning
+the directory. Whole segments are sent with FileResponse, which uses
+sendfile and answers Range requests. A time range is sent as a generated
+header followed by slices of the segment files, read through mmap in the
+default executor a chunk at a time, and honours a single Range too, so a
+player can seek in it. Neither the index lookups nor the file reads run on
+the event loop, and no file is ever loaded whole.
+
+A pause between WAV segments is sent as silence, up to the recorder's
+max_gap_seconds, so positions keep their offset from X-Start-Time until
+the first longer pause; the segment list has the exact times. A WAV range
+that would not fit in a RIFF header is refused. An Ogg range chains the
+segments' streams, which play back to back.
+"""
+
+import asyncio
+import mmap
+import os
+import re
+import struct
+import time
+from typing import List, Tuple
+from urllib.parse import quote
+
+from aiohttp import web
+
+from recording import MIN_GAP_SECONDS, OPUS_SAMPLE_RATE, Recorder, wav_header
+
+CHUNK_SIZE = 256 * 1024
+DEFAULT_RANGE_SECONDS = 60
+CONTENT_TYPES = {"wav": "audio/wav", "opus": "audio/ogg"}
+OGG_PAGE_HEADER = struct.Struct("<4sBBqIIIB")
+# The RIFF size field counts the data and 36 bytes of header
+MAX_WAV_DATA_BYTES = 0xFFFFFFFF - 36
+UNSAFE_FILENAME = re.compile(r"[^A-Za-z0-9._-]")
+
+
+def read_slice(path: str, offset: int, length: int) -> bytes:
+    """Copy `length` bytes at `offset` out of a file through mmap; blocks"""
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            return view[offset : offset + length]
+
+
+def content_disposition(filename: str) -> str:
+    """An inline Content-Disposition for any file name (RFC 6266 and 5987)"""
+    fallback = UNSAFE_FILENAME.sub("_", filename)
+    return (
+        f"inline; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+    )
+
+
+def ogg_page_end(path: str, offset: int, granule: int, size: int) -> int:
+    """Offset just past the first complete page at or after `offset` whose
+    granule position reaches `granule`, or past the last complete page"""
+    if size <= offset:
+        return offset
+    end = offset
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            while end + OGG_PAGE_HEADER.size <= size:
+                fields = OGG_PAGE_HEADER.unpack_from(view, end)
+                lacing_end = end + OGG_PAGE_HEADER.size + fields[-1]
+                if fields[0] != b"OggS" or lacing_end > size:
+                    break
+                page_end = lacing_end + sum(
+                    view[end + OGG_PAGE_HEADER.size : lacing_end]
+                )
+                if page_end > size:
+                    break
+                end = page_end
+                if fields[3] >= granule:
+                    break
+    return end
+
+
+class RecordingsApi:
+    """aiohttp routes serving a Recorder's segments and time ranges"""
+
+    def __init__(self, recorder: Recorder, chunk_size: int = CHUNK_SIZE):
+        self.recorder = recorder
+        self.index = recorder.index
+        self.chunk_size = chunk_size
+
+    def add_routes(self, router):
+        router.add_get("/api/recordings", self.list_streams)
+        router.add_get("/api/recordings/{stream}", self.list_segments)
+        router.add_get("/api/recordings/{stream}/audio", self.serve_range)
+        router.add_get(
+            "/api/recordings/{stream}/segments/{segment_id}", self.serve_segment
+        )
+
+    async def _run(self, function, *args):
+        return await asyncio.get_event_loop().run_in_executor(None, function, *args)
+
+    def _time_range(self, request) -> Tuple[float, float]:
+        try:
+            end = float(request.query.get("end", time.time()))
+            start = float(request.query.get("start", end - DEFAULT_RANGE_SECONDS))
+        except ValueError:
+            raise web.HTTPBadRequest(text="start and end must be Unix timestamps")
+        if end <= start:
+            raise web.HTTPBadRequest(text="end must be after start")
+        return start, end
+
+    async def list_streams(self, request):
+        return web.json_response({"streams": await self._run(self.index.streams)})
+
+    async def list_segments(self, request):
+        stream = request.match_info["stream"]
+        start, end = self._time_range(request)
+        segments = await self._run(self.index.lookup, stream, start, end)
+        for segment in segments:
+            segment["url"] = f"/api/recordings/{stream}/segments/{segment['id']}"
+        return web.json_response({"stream": stream, "segments": segments})
+
+    async def serve_segment(self, request):
+        stream = request.match_info["stream"]
+        try:
+            segment_id = int(request.match_info["segment_id"])
+        except ValueError:
+            raise web.HTTPNotFound()
+        segment = await self._run(self.index.segment, segment_id)
+        if segment is None or segment["stream"] != stream:
+            raise web.HTTPNotFound(text=f"No segment {segment_id} for {stream}")
+        return web.FileResponse(
+            os.path.join(self.recorder.directory, segment["path"]),
+            chunk_size=self.chunk_size,
+            headers={
+                "Content-Type": CONTENT_TYPES[segment["format"]],
+                "X-Start-Time": f"{segment['start']:.6f}",
+            },
+        )
+
+    def plan_range(self, stream: str, start: float, end: float):
+        """Parts of the response for a time range: bytes, or (path, offset, length).
+
+        A path of None stands for that many bytes of silence. Only segments
+        with the same format and layout as the first one are included, since
+        a file cannot change them midway. Blocks; raises HTTP 413 for a WAV
+        range too long for one file.
+        """
+        segments = self.index.lookup(stream, start, end)
+        if not segments:
+            return None
+
+        def layout(segment):
+            return segment["format"], segment["sample_rate"], segment["channels"]
+
+        first = segments[0]
+        fmt = first["format"]
+        parts: List = []
+        data_bytes = 0
+        # Capture time just after the last WAV sample planned so far
+        cursor = None
+        for segment in segments:
+            if layout(segment) != layout(first):
+                continue
+            path = os.path.join(self.recorder.directory, segment["path"])
+            size = os.path.getsize(path)
+            if fmt == "wav":
+                part = self._wav_slice(segment, path, size, start, end)
+                if part:
+                    part, cursor = self._fill_gap(segment, part, cursor)
+            else:
+                part = self._ogg_slice(segment, path, size, start, end)
+            if part:
+                parts.extend(part)
+                data_bytes += sum(
+                    piece[2] for piece in part if not isinstance(piece, bytes)
+                )
+
+        if fmt == "wav":
+            if data_bytes > MAX_WAV_DATA_BYTES:
+                raise web.HTTPRequestEntityTooLarge(
+                    MAX_WAV_DATA_BYTES,
+                    data_bytes,
+                    text="Range too long for one WAV file, request a shorter one",
+                )
+            parts.insert(
+                0, wav_header(first["sample_rate"], first["channels"], data_bytes)
+            )
+        return parts, fmt, max(start, first["start"])
+
+    def _wav_slice(self, segment: dict, path: str, size: int, start, end):
+        rate = segment["sample_rate"]
+        frame_bytes = 2 * segment["channels"]
+        data_offset = segment["data_offset"]
+        # Open segments: only what has reached the disk, in whole frames
+        available = (size - data_offset) // frame_bytes * frame_bytes
+
+        def offset(timestamp):
+            frames = int(max(0.0, timestamp - segment["start"]) * rate)
+            return min(frames * frame_bytes, available)
+
+        first, last = offset(start), offset(end)
+        if last <= first:
+            return None
+        return [(path, data_offset + first, last - first)]
+
+    def _fill_gap(self, segment: dict, part: list, cursor):
+        """`part` preceded by the silence since `cursor`, and the new cursor.
+
+        Longer pauses than the recorder fills within a segment are shortened
+        to that much silence.
+        """
+        rate = segment["sample_rate"]
+        frame_bytes = 2 * segment["channels"]
+        _, offset, length = part[0]
+        begins = (
+            segment["start"] + (offset - segment["data_offset"]) / frame_bytes / rate
+        )
+        if cursor is not None and begins - cursor >= MIN_GAP_SECONDS:
+            pause = min(begins - cursor, self.recorder.max_gap_seconds)
+            silence = round(pause * rate) * frame_bytes
+            part = [(None, 0, silence)] + part
+        return part, begins + length / frame_bytes / rate
+
+    def _ogg_slice(self, segment: dict, path: str, size: int, start, end):
+        # Each segment is a complete Ogg stream, so several chain into one file
+        data_offset = segment["data_offset"]
+        mark = self.index.offset_at(segment["id"], start)
+        first = mark[1] if mark else data_offset
+        granule = int((end - segment["start"]) * OPUS_SAMPLE_RATE)
+        last = ogg_page_end(path, first, granule, size)
+        if last <= first:
+            return None
+        return [(path, 0, data_offset), (path, first, last - first)]
+
+    async def serve_range(self, request):
+        stream = request.match_info["stream"]
+        start, end = self._time_range(request)
+        plan = await self._run(self.plan_range, stream, start, end)
+        if plan is None:
+            raise web.HTTPNotFound(text=f"No recording of {stream} in that range")
+        parts, fmt, start_time = plan
+
+        total = sum(len(part) if isinstance(part, bytes) else part[2] for part in parts)
+        try:
+            http_range = request.http_range
+        except ValueError:
+            raise web.HTTPRequestRangeNotSatisfiable(
+                headers={"Content-Range": f"bytes */{total}"}
+            )
+        begin, stop, _ = http_range.indices(total)
+        partial = http_range.start is not None or http_range.stop is not None
+        if partial and begin >= stop:
+            raise web.HTTPRequestRangeNotSatisfiable(
+                headers={"Content-Range": f"bytes */{total}"}
+            )
+
+        extension = "wav" if fmt == "wav" else "ogg"
+        response = web.StreamResponse(
+            status=206 if partial else 200,
+            headers={
+                "Content-Type": CONTENT_TYPES[fmt],
+                "Accept-Ranges": "bytes",
+                "X-Start-Time": f"{start_time:.6f}",
+                "Content-Disposition": content_disposition(
+                    f"{stream}-{int(start_time)}.{extension}"
+                ),
+            },
+        )
+        if partial:
+            response.headers["Content-Range"] = f"bytes {begin}-{stop - 1}/{total}"
+        response.content_length = stop - begin
+        await response.prepare(request)
+
+        position = 0
+        for part in parts:
+            length = len(part) if isinstance(part, bytes) else part[2]
+            part_begin = max(begin - position, 0)
+            part_stop = min(stop - position, length)
+            position += length
+            if part_begin >= part_stop:
+                continue
+            if isinstance(part, bytes):
+                await response.write(part[part_begin:part_stop])
+                continue
+            path, offset, _ = part
+            for chunk_start in range(part_begin, part_stop, self.chunk_size):
+                chunk_length = min(self.chunk_size, part_stop - chunk_start)
+                if path is None:
+                    await response.write(bytes(chunk_length))
+                    continue
+                await response.write(
+                    await self._run(
+                        read_slice, path, offset + chunk_start, chunk_length
+                    )
+                )
+        await response.write_eof()
+        return response
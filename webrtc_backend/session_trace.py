@@ -0,0 +1,86 @@
+"""
+Connection-setup trace for relay receivers.
+
+A receiver session starts when ``start_receiving`` arrives and goes
+through the relay's offer, the client's answer, ICE and DTLS before the
+first audio frame is handed to its RTP sender. ``SessionTrace`` records
+when each phase finished, in seconds since the session started, except
+``ice_gathering``, which is how long the relay spent gathering its own
+candidates. Every phase is observed once in the
+``voice_session_phase_seconds`` histogram, and clients that ask for it
+get the whole trace in a ``session_stats`` message once audio flows.
+"""
+
+import logging
+import time
+from typing import Dict, Optional
+
+from metrics import SESSION_PHASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PHASE_OFFER = "offer"  # relay's offer sent
+PHASE_ICE_GATHERING = "ice_gathering"  # duration of the relay's gathering
+PHASE_ANSWER = "answer"  # client's answer received
+PHASE_ICE_CONNECTED = "ice_connected"  # a candidate pair succeeded
+PHASE_DTLS_CONNECTED = "dtls_connected"  # DTLS handshake done, SRTP keys ready
+PHASE_FIRST_FRAME = "first_frame"  # first audio frame given to the RTP sender
+PHASES = (
+    PHASE_OFFER,
+    PHASE_ICE_GATHERING,
+    PHASE_ANSWER,
+    PHASE_ICE_CONNECTED,
+    PHASE_DTLS_CONNECTED,
+    PHASE_FIRST_FRAME,
+)
+
+
+class SessionTrace:
+    """Phase timings of one receiver session"""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self._begun: Dict[str, float] = {}
+
+    def mark(self, phase: str):
+        """Record that `phase` finished now"""
+        self._record(phase, time.perf_counter() - self.started)
+
+    def begin(self, phase: str):
+        """Start timing a phase measured on its own, ended by `end`"""
+        self._begun.setdefault(phase, time.perf_counter())
+
+    def end(self, phase: str):
+        started = self._begun.pop(phase, None)
+        if started is not None:
+            self._record(phase, time.perf_counter() - started)
+
+    def elapsed(self, phase: str) -> Optional[float]:
+        return self.phases.get(phase)
+
+    def as_message(self) -> dict:
+        """Milliseconds per finished phase, for a session_stats message"""
+        return {
+            "type": "session_stats",
+            "phases_ms": {
+                phase: round(self.phases[phase] * 1000, 1)
+                for phase in PHASES
+                if phase in self.phases
+            },
+        }
+
+    def _record(self, phase: str, seconds: float):
+        # Renegotiation and repeated state changes keep the first timing
+        if phase in self.phases:
+            return
+        self.phases[phase] = seconds
+        SESSION_PHASE_SECONDS.labels(phase).observe(seconds)
+        if phase == PHASE_FIRST_FRAME:
+            summary = ", ".join(
+                f"{name} {self.phases[name] * 1000:.0f} ms"
+                for name in PHASES
+                if name in self.phases
+            )
+            logger.info(f"Session {self.session_id} set up: {summary}")
@@ -0,0 +1,163 @@
+"""
+Shared-memory packet rings between relay worker processes.
+
+In worker mode a sender's stream lives on the worker that accepted its
+WebSocket, while its receivers may be connected to any worker. The owning
+worker writes every forwarded Opus packet into a single-producer ring in
+shared memory, and each other worker with receivers for the stream reads
+the ring and feeds the packets to its own proxy tracks. A packet crosses
+processes with one copy in and one copy out, with no socket or pickling
+in between.
+
+Every slot carries the number of the packet in it, written before and
+after the payload, so a reader that races the writer sees a mismatch and
+skips the slot instead of returning a torn packet. A reader that falls a
+whole ring behind jumps to the oldest packet still in the ring and counts
+the rest as dropped.
+"""
+
+import asyncio
+import logging
+import struct
+import uuid
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+
+from packet_forwarding import RemotePacketSource
+from stream_fanout import DEFAULT_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# 5 s of 20 ms packets
+DEFAULT_RING_SLOTS = 256
+MAX_PACKET_SIZE = 1500
+# How often a reading worker looks for new packets
+DEFAULT_POLL_INTERVAL = 0.005
+
+RING_HEADER = struct.Struct("<IIQ")  # slots, slot size, packets written
+SLOT_HEADER = struct.Struct("<QIH")  # packet number + 1, RTP timestamp, length
+SLOT_NUMBER = struct.Struct("<Q")
+
+
+class PacketRing:
+    """Fixed-size ring of packets in a named shared-memory block"""
+
+    def __init__(self, memory: shared_memory.SharedMemory, owner: bool):
+        self.memory = memory
+        self.name = memory.name
+        self.owner = owner
+        self.slots, self.slot_size, _ = RING_HEADER.unpack_from(memory.buf, 0)
+        self._buf = memory.buf
+
+    @classmethod
+    def create(
+        cls, slots: int = DEFAULT_RING_SLOTS, max_packet_size: int = MAX_PACKET_SIZE
+    ) -> "PacketRing":
+        slot_size = SLOT_HEADER.size + max_packet_size + SLOT_NUMBER.size
+        memory = shared_memory.SharedMemory(
+            name=f"vs-{uuid.uuid4().hex[:16]}",
+            create=True,
+            size=RING_HEADER.size + slots * slot_size,
+        )
+        RING_HEADER.pack_into(memory.buf, 0, slots, slot_size, 0)
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "PacketRing":
+        # Workers share their parent's resource tracker, which also removes
+        # the blocks of a worker that dies without unlinking them
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def written(self) -> int:
+        return RING_HEADER.unpack_from(self._buf, 0)[2]
+
+    def write(self, payload: bytes, timestamp: int):
+        """Append one packet; only the owning worker writes"""
+        if len(payload) > self.slot_size - SLOT_HEADER.size - SLOT_NUMBER.size:
+            logger.warning(f"Dropping {len(payload)} byte packet, too large for ring")
+            return
+        number = self.written
+        offset = RING_HEADER.size + (number % self.slots) * self.slot_size
+        # 0 marks the slot as being rewritten while the payload changes
+        SLOT_NUMBER.pack_into(self._buf, offset, 0)
+        SLOT_HEADER.pack_into(
+            self._buf, offset, 0, timestamp & 0xFFFFFFFF, len(payload)
+        )
+        end = offset + SLOT_HEADER.size + len(payload)
+        self._buf[offset + SLOT_HEADER.size : end] = payload
+        SLOT_NUMBER.pack_into(self._buf, end, number + 1)
+        SLOT_NUMBER.pack_into(self._buf, offset, number + 1)
+        RING_HEADER.pack_into(self._buf, 0, self.slots, self.slot_size, number + 1)
+
+    def read(self, number: int) -> Optional[Tuple[int, bytes]]:
+        """Packet `number` as (RTP timestamp, payload), or None if overwritten"""
+        offset = RING_HEADER.size + (number % self.slots) * self.slot_size
+        start, timestamp, length = SLOT_HEADER.unpack_from(self._buf, offset)
+        if start != number + 1:
+            return None
+        end = offset + SLOT_HEADER.size + length
+        payload = bytes(self._buf[offset + SLOT_HEADER.size : end])
+        if SLOT_NUMBER.unpack_from(self._buf, end)[0] != number + 1:
+            return None
+        if SLOT_NUMBER.unpack_from(self._buf, offset)[0] != number + 1:
+            return None
+        return timestamp, payload
+
+    def close(self):
+        self._buf = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class RingReader:
+    """One worker's read position in a PacketRing"""
+
+    def __init__(self, ring: PacketRing):
+        self.ring = ring
+        self.position = ring.written
+        self.packets_dropped = 0
+
+    def read(self) -> List[Tuple[int, bytes]]:
+        """Every packet written since the last call"""
+        written = self.ring.written
+        if written - self.position > self.ring.slots - 1:
+            oldest = written - self.ring.slots + 1
+            self.packets_dropped += oldest - self.position
+            self.position = oldest
+
+        packets = []
+        while self.position < written:
+            packet = self.ring.read(self.position)
+            if packet is None:
+                self.packets_dropped += 1
+            else:
+                packets.append(packet)
+            self.position += 1
+        return packets
+
+
+class RingPacketSource(RemotePacketSource):
+    """Feeds a stream owned by another worker to this worker's receivers"""
+
+    def __init__(
+        self,
+        ring_name: str,
+        stream_id: str,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ):
+        super().__init__(stream_id, queue_size)
+        self.poll_interval = poll_interval
+        self.ring = PacketRing.attach(ring_name)
+        self.reader = RingReader(self.ring)
+
+    async def _run(self):
+        while True:
+            for timestamp, payload in self.reader.read():
+                self.push_packet(timestamp, payload)
+            await asyncio.sleep(self.poll_interval)
+
+    def _close(self):
+        self.ring.close()
@@ -0,0 +1,152 @@
+"""
+Per-stream audio fan-out for the relay server.
+
+A remote track can only be read by one consumer: every ``recv()`` hands the
+next frame to whoever asked first. ``StreamFanout`` owns that single consumer
+and copies each frame reference into one bounded queue per receiver, so every
+listener sees every frame and a slow listener only ever loses its own oldest
+frames. Listeners that only need to look at frames in passing, such as the
+PCM history, are called synchronously instead and get no queue.
+"""
+
+import asyncio
+import logging
+from typing import Callable, List, Optional, Set
+
+from aiortc import MediaStreamTrack
+from aiortc.mediastreams import MediaStreamError
+
+from metrics import FRAMES_FORWARDED, FRAMES_RECEIVED, RECEIVER_DROPS
+
+logger = logging.getLogger(__name__)
+
+# 10 x 20 ms frames: a receiver may lag 200 ms behind before it starts dropping
+DEFAULT_QUEUE_SIZE = 10
+
+
+class FanoutTrack(MediaStreamTrack):
+    """Lightweight per-receiver proxy fed by a StreamFanout or PacketForwarder"""
+
+    kind = "audio"
+
+    def __init__(self, fanout, receiver_id: str, queue_size: int):
+        super().__init__()
+        self.receiver_id = receiver_id
+        self.frames_delivered = 0
+        self.frames_dropped = 0
+        self._dropped_metric = RECEIVER_DROPS.labels(fanout.stream_id)
+        self._fanout = fanout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        # Called once, when the first frame is handed to the receiver
+        self.on_first_frame: Optional[Callable] = None
+
+    def push(self, frame):
+        """Queue a frame without blocking, dropping the oldest one when full"""
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.frames_dropped += 1
+            self._dropped_metric.inc()
+        self._queue.put_nowait(frame)
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+
+        frame = await self._queue.get()
+        if frame is None:
+            self.stop()
+            raise MediaStreamError
+
+        self.frames_delivered += 1
+        if self.frames_delivered == 1 and self.on_first_frame:
+            self.on_first_frame()
+        return frame
+
+    def stop(self):
+        super().stop()
+        self._fanout.unsubscribe(self)
+
+
+class StreamFanout:
+    """Reads one source track and pushes each frame to every subscribed receiver"""
+
+    def __init__(
+        self,
+        source: MediaStreamTrack,
+        stream_id: str,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ):
+        self.source = source
+        self.stream_id = stream_id
+        self.queue_size = queue_size
+        self.frames_received = 0
+        self._received_metric = FRAMES_RECEIVED.labels(stream_id)
+        self._forwarded_metric = FRAMES_FORWARDED.labels(stream_id)
+        self._tracks: Set[FanoutTrack] = set()
+        self._listeners: List[Callable] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def receiver_count(self) -> int:
+        return len(self._tracks)
+
+    def start(self):
+        """Start draining the source track, even before anyone subscribes"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._consume())
+
+    def subscribe(self, receiver_id: str) -> FanoutTrack:
+        """Create a proxy track for a new receiver"""
+        track = FanoutTrack(self, receiver_id, self.queue_size)
+        self._tracks.add(track)
+        return track
+
+    def unsubscribe(self, track: FanoutTrack):
+        self._tracks.discard(track)
+
+    def add_listener(self, callback: Callable):
+        """Call `callback(frame)` for every frame; it must not block"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback: Callable):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    async def stop(self):
+        """Stop the consumer and end every proxy track"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._end_tracks()
+
+    async def _consume(self):
+        try:
+            while True:
+                try:
+                    frame = await self.source.recv()
+                except MediaStreamError:
+                    logger.info(f"Source track for {self.stream_id} ended")
+                    break
+
+                self.frames_received += 1
+                self._received_metric.inc()
+                tracks = tuple(self._tracks)
+                for track in tracks:
+                    track.push(frame)
+                self._forwarded_metric.inc(len(tracks))
+                for listener in tuple(self._listeners):
+                    try:
+                        listener(frame)
+                    except Exception as e:
+                        logger.error(f"Frame listener for {self.stream_id} failed: {e}")
+        finally:
+            self._end_tracks()
+
+    def _end_tracks(self):
+        for track in tuple(self._tracks):
+            track.push(None)
+        self._tracks.clear()
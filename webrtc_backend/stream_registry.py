@@ -0,0 +1,318 @@
+"""
+Registry of which node and worker owns each relayed stream.
+
+A single relay process keeps the table in its own memory. In worker mode
+the table is a dict held by a multiprocessing manager and shared by every
+worker, so a worker can list streams published on the others and find the
+shared-memory ring to read one from. Each worker reads a local mirror of it
+and talks to the manager from one thread, since every manager call is a
+round trip to another process. In cluster mode every worker of every
+node connects to a RegistryBroker over TCP and keeps a local mirror of the
+table that the broker keeps current, so lookups never wait for the
+network. Entries are small dicts such as
+``{"node": "hall", "worker": 2, "ring": "vs-1a2b...", "bridge": "http://hall:8080"}``.
+They only change when a stream starts or ends, so the registry stays off
+the media path.
+
+The broker protocol is one JSON object per line. A client sends
+``{"op": "publish", "stream": ..., "owner": {...}}`` and
+``{"op": "unpublish", "stream": ...}``; the broker answers a new client
+with ``{"op": "snapshot", "streams": {...}}`` and then relays every
+publish and unpublish to all clients. When a client disconnects, the
+broker unpublishes its streams, so a failed node's streams disappear from
+the cluster.
+
+Run a stand-in broker with ``python stream_registry.py --port 8765``.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BROKER_PORT = 8765
+DEFAULT_RECONNECT_INTERVAL = 1.0
+# How long a node waits at startup for the cluster's streams
+DEFAULT_CONNECT_TIMEOUT = 5.0
+
+
+class StreamRegistry:
+    """In-process registry, for a relay running as a single worker"""
+
+    # Whether other processes see this registry, so streams need rings
+    shared = False
+
+    def __init__(self, table=None):
+        self._streams = {} if table is None else table
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def publish(self, stream_id: str, owner: dict):
+        self._streams[stream_id] = owner
+
+    def unpublish(self, stream_id: str):
+        self._streams.pop(stream_id, None)
+
+    def owner(self, stream_id: str) -> Optional[dict]:
+        return self._streams.get(stream_id)
+
+    def streams(self) -> Dict[str, dict]:
+        """A snapshot of every published stream and its owner"""
+        return self._streams.copy()
+
+    async def refresh(self) -> Dict[str, dict]:
+        """Bring the table up to date, then return streams()"""
+        return self.streams()
+
+
+class SharedStreamRegistry(StreamRegistry):
+    """Registry over a multiprocessing manager dict shared by all workers.
+
+    Lookups read a mirror that refresh() reloads. publish and unpublish
+    change the mirror at once and the manager's dict from the registry's
+    own thread, in order, so the event loop never waits on the manager.
+    """
+
+    shared = True
+
+    def __init__(self, table):
+        super().__init__()
+        self._table = table
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="registry"
+        )
+        # (stream_id, owner or None) not yet written; applied over snapshots
+        self._pending: List[tuple] = []
+
+    async def start(self):
+        await self.refresh()
+
+    async def stop(self):
+        await asyncio.get_event_loop().run_in_executor(None, self._executor.shutdown)
+
+    def publish(self, stream_id: str, owner: dict):
+        super().publish(stream_id, owner)
+        self._submit(stream_id, owner)
+
+    def unpublish(self, stream_id: str):
+        super().unpublish(stream_id)
+        self._submit(stream_id, None)
+
+    async def refresh(self) -> Dict[str, dict]:
+        """Reload the mirror from the manager; raises if the manager is gone"""
+        snapshot = await asyncio.get_event_loop().run_in_executor(
+            self._executor, self._table.copy
+        )
+        for stream_id, owner in self._pending:
+            if owner is None:
+                snapshot.pop(stream_id, None)
+            else:
+                snapshot[stream_id] = owner
+        self._streams = snapshot
+        return self.streams()
+
+    def _submit(self, stream_id: str, owner: Optional[dict]):
+        change = (stream_id, owner)
+        self._pending.append(change)
+        future = asyncio.get_event_loop().run_in_executor(
+            self._executor, self._write, stream_id, owner
+        )
+        future.add_done_callback(lambda future: self._written(change, future))
+
+    def _write(self, stream_id: str, owner: Optional[dict]):
+        if owner is None:
+            self._table.pop(stream_id, None)
+        else:
+            self._table[stream_id] = owner
+
+    def _written(self, change: tuple, future):
+        self._pending.remove(change)
+        if not future.cancelled() and future.exception():
+            logger.error(f"Could not update stream {change[0]}: {future.exception()}")
+
+
+class BrokerStreamRegistry(StreamRegistry):
+    """Registry mirrored from a RegistryBroker, shared by every node of a cluster"""
+
+    shared = True
+
+    def __init__(
+        self,
+        address: str,
+        reconnect_interval: float = DEFAULT_RECONNECT_INTERVAL,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+    ):
+        super().__init__()
+        host, _, port = address.rpartition(":")
+        self.host = host or "127.0.0.1"
+        self.port = int(port or DEFAULT_BROKER_PORT)
+        self.reconnect_interval = reconnect_interval
+        self.connect_timeout = connect_timeout
+        # Streams published here, published again after a reconnect
+        self._own: Dict[str, dict] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._synced = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    async def start(self):
+        """Connect and wait for the broker's table, or run local-only until it answers"""
+        self._task = asyncio.ensure_future(self._run())
+        try:
+            await asyncio.wait_for(self._synced.wait(), self.connect_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Registry broker {self.host}:{self.port} not reachable, retrying"
+            )
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def publish(self, stream_id: str, owner: dict):
+        self._own[stream_id] = owner
+        self._streams[stream_id] = owner
+        self._send({"op": "publish", "stream": stream_id, "owner": owner})
+
+    def unpublish(self, stream_id: str):
+        self._own.pop(stream_id, None)
+        self._streams.pop(stream_id, None)
+        self._send({"op": "unpublish", "stream": stream_id})
+
+    def _send(self, message: dict):
+        if self._writer is not None:
+            self._writer.write(json.dumps(message).encode() + b"\n")
+
+    def _apply(self, message: dict):
+        op = message.get("op")
+        if op == "snapshot":
+            self._streams = dict(message["streams"], **self._own)
+            self._synced.set()
+        elif op == "publish":
+            self._streams[message["stream"]] = message["owner"]
+        elif op == "unpublish" and message["stream"] not in self._own:
+            self._streams.pop(message["stream"], None)
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                logger.debug(f"Registry broker connection failed: {e}")
+                await asyncio.sleep(self.reconnect_interval)
+                continue
+
+            logger.info(f"Connected to registry broker {self.host}:{self.port}")
+            self._writer = writer
+            for stream_id, owner in self._own.items():
+                self._send({"op": "publish", "stream": stream_id, "owner": owner})
+            try:
+                async for line in reader:
+                    self._apply(json.loads(line))
+            except (ConnectionError, ValueError) as e:
+                logger.error(f"Registry broker connection lost: {e}")
+            finally:
+                self._writer = None
+                writer.close()
+                # Other nodes' streams are unknown until the next snapshot
+                self._streams = dict(self._own)
+                self._synced.clear()
+            await asyncio.sleep(self.reconnect_interval)
+
+
+class RegistryBroker:
+    """Holds the cluster's stream table and relays every change to all nodes"""
+
+    def __init__(self):
+        self.streams: Dict[str, dict] = {}
+        self._publishers: Dict[str, asyncio.StreamWriter] = {}
+        self._clients = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "0.0.0.0", port: int = DEFAULT_BROKER_PORT):
+        self._server = await asyncio.start_server(self._handle_client, host, port)
+        logger.info(f"Registry broker listening on {host}:{port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in tuple(self._clients):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def _broadcast(self, message: dict):
+        line = json.dumps(message).encode() + b"\n"
+        for writer in tuple(self._clients):
+            writer.write(line)
+
+    def _unpublish(self, stream_id: str):
+        self.streams.pop(stream_id, None)
+        self._publishers.pop(stream_id, None)
+        self._broadcast({"op": "unpublish", "stream": stream_id})
+
+    async def _handle_client(self, reader, writer):
+        self._clients.add(writer)
+        writer.write(
+            json.dumps({"op": "snapshot", "streams": self.streams}).encode() + b"\n"
+        )
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                stream_id = message.get("stream")
+                if message.get("op") == "publish":
+                    self.streams[stream_id] = message["owner"]
+                    self._publishers[stream_id] = writer
+                    self._broadcast(message)
+                elif message.get("op") == "unpublish":
+                    if self._publishers.get(stream_id) is writer:
+                        self._unpublish(stream_id)
+        except (ConnectionError, ValueError) as e:
+            logger.error(f"Registry client failed: {e}")
+        finally:
+            self._clients.discard(writer)
+            # The node is gone, and so are its streams
+            for stream_id, publisher in tuple(self._publishers.items()):
+                if publisher is writer:
+                    self._unpublish(stream_id)
+            writer.close()
+
+
+async def run_broker(host: str, port: int):
+    broker = RegistryBroker()
+    await broker.start(host, port)
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await broker.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream registry broker")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_BROKER_PORT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        asyncio.run(run_broker(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Broker stopped")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Test script to verify that a recorded time range spanning a long pause
+is served as one bounded WAV file
+"""
+
+import asyncio
+import io
+import sys
+import tempfile
+import wave
+
+import numpy as np
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import recordings_api
+from recording import Recorder
+from recordings_api import RecordingsApi
+
+SAMPLE_RATE = 48000
+CHANNELS = 2
+FRAME = SAMPLE_RATE // 50
+START = 1700000000.0
+PAUSE = 8 * 3600
+
+
+def record_two_segments(directory: str):
+    """One second of tone at START and another PAUSE seconds later"""
+    recorder = Recorder(directory, writer_threads=1, buffer_ms=20, queue_size=1024)
+    recording = recorder.open_stream("s1", SAMPLE_RATE, CHANNELS)
+    tone = np.full(FRAME * CHANNELS, 1000, dtype=np.int16)
+    for offset in (0, PAUSE):
+        for i in range(50):
+            recording.write(tone, START + offset + i * 0.02)
+        recording.flush()
+    recorder.close_stream(recording)
+    recorder.stop()
+
+
+async def fetch_range(directory: str):
+    recorder = Recorder(directory, writer_threads=1)
+    app = web.Application()
+    RecordingsApi(recorder).add_routes(app.router)
+    try:
+        async with TestClient(TestServer(app)) as client:
+            response = await client.get(
+                "/api/recordings/s1/audio",
+                params={"start": START, "end": START + PAUSE + 1},
+            )
+            return response.status, await response.read(), recorder.max_gap_seconds
+    finally:
+        recorder.stop()
+
+
+def test_long_pause_is_shortened():
+    """The pause between segments becomes at most max_gap_seconds of silence"""
+    with tempfile.TemporaryDirectory() as directory:
+        record_two_segments(directory)
+        status, body, max_gap = asyncio.run(fetch_range(directory))
+
+    assert status == 200, f"status {status}: {body[:200]!r}"
+    audio = wave.open(io.BytesIO(body))
+    frames = audio.getnframes()
+    expected = round((2 + max_gap) * SAMPLE_RATE)
+    assert frames == expected, f"{frames} frames, expected {expected}"
+    samples = np.frombuffer(audio.readframes(frames), dtype=np.int16)
+    assert samples[int(1.5 * SAMPLE_RATE) * CHANNELS] == 0, "no silence in the pause"
+    assert samples[-CHANNELS] == 1000, "second segment missing after the pause"
+
+
+def test_oversized_range_is_refused():
+    """A WAV range too long for a RIFF header is answered with 413"""
+    limit = recordings_api.MAX_WAV_DATA_BYTES
+    recordings_api.MAX_WAV_DATA_BYTES = SAMPLE_RATE * CHANNELS * 2
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            record_two_segments(directory)
+            status, body, _ = asyncio.run(fetch_range(directory))
+    finally:
+        recordings_api.MAX_WAV_DATA_BYTES = limit
+    assert status == 413, f"status {status}, expected 413"
+
+
+if __name__ == "__main__":
+    print("Testing recorded range downloads...")
+    print("=" * 40)
+    failed = 0
+    for test in (test_long_pause_is_shortened, test_oversized_range_is_refused):
+        try:
+            test()
+            print(f"✓ {test.__name__}: SUCCESS")
+        except AssertionError as e:
+            failed += 1
+            print(f"✗ {test.__name__}: FAILED - {e}")
+
+    print("=" * 40)
+    sys.exit(1 if failed else 0)
@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import json
 import logging
@@ -5,13 +6,27 @@ import uuid
 import os
 from typing import Dict, Optional
 from aiohttp import web, WSMsgType
+from admission import AdmissionController
+from frame_aggregator import DEFAULT_MAX_LATENCY_MS, DEFAULT_WINDOW_MS, FrameAggregator
+from metrics import (CONNECTED_CLIENTS, MESSAGE_SECONDS, NEGOTIATIONS_IN_FLIGHT,
+                     handle_metrics, monitor_loop_lag)
+from opus_profiles import apply_profile, check_profile
+from recording import (DEFAULT_SEGMENT_SECONDS, DEFAULT_WRITER_THREADS,
+                       OPUS_SAMPLE_RATE, Recorder)
+from recordings_api import RecordingsApi
+from workers import run_workers
 
 logger = logging.getLogger(__name__)
 
 # Try to import aiortc, but handle the case where it's not available
 try:
-    from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack
-    from aiortc.contrib.media import MediaRecorder
+    from aiortc import (RTCConfiguration, RTCIceServer, RTCPeerConnection,
+                        RTCSessionDescription, MediaStreamTrack)
+    from aiortc.mediastreams import MediaStreamError
+    from ice_candidates import (MAX_PENDING_CANDIDATES, add_candidate,
+                                add_pending_candidates, candidate_messages,
+                                parse_candidate)
+    from packet_forwarding import PacketForwarder
     WEBRTC_AVAILABLE = True
 except ImportError:
     logger.warning("aiortc not available, WebRTC functionality will be limited")
@@ -44,7 +59,10 @@ class VoiceStreamingServer:
                     "channels": 1,
                     "echo_cancellation": True,
                     "noise_suppression": True,
-                    "auto_gain_control": True
+                    "auto_gain_control": True,
+                    # Opus profile from opus_profiles.PROFILES asked of
+                    # senders, e.g. "robust-wifi"; None keeps aiortc's answer
+                    "opus_profile": None
                 },
                 "connection_timeout": 30,
                 "reconnect_attempts": 3
@@ -53,21 +71,61 @@ class VoiceStreamingServer:
                 "port": 8080,
                 "host": "0.0.0.0",
                 "max_connections": 10,
-                "queue_size": 100
+                # Peer connections being set up at once; further streams are refused
+                "queue_size": 100,
+                # Refuse new streams while the event loop lags this many
+                # seconds or the process uses this percent of a core
+                "max_loop_lag": 0.5,
+                "max_cpu_percent": None,
+                "retry_after": 5
+            },
+            "aggregation": {
+                "window_ms": DEFAULT_WINDOW_MS,
+                "max_latency_ms": DEFAULT_MAX_LATENCY_MS
+            },
+            "recording": {
+                # Off unless asked for; recordings keep what was said on disk
+                "enabled": False,
+                "directory": "/tmp/recordings",
+                # "wav" decodes to PCM, "opus" stores the sender's packets as sent
+                "format": "wav",
+                "segment_seconds": DEFAULT_SEGMENT_SECONDS,
+                "writer_threads": DEFAULT_WRITER_THREADS,
+                "queue_size": 256,
+                "overflow_policy": "drop_oldest"
             }
         }
         
         self.connections: Dict[str, dict] = {}
+
+        # Refuse new clients and streams early instead of degrading live ones
+        server = self.config['server']
+        self.admission = AdmissionController(
+            max_connections=server['max_connections'],
+            max_negotiations=server['queue_size'],
+            max_loop_lag=server['max_loop_lag'],
+            max_cpu_percent=server['max_cpu_percent'],
+            retry_after=server['retry_after'])
+
+        # Segmented recordings, written by the recorder's own threads
+        recording = self.config['recording']
+        self.recorder = Recorder.from_config(recording) if recording['enabled'] else None
+
         self.app = web.Application()
+        self.app.on_startup.append(self.on_startup)
+        self.app.on_shutdown.append(self.on_shutdown)
         self.setup_routes()
         
     def setup_routes(self):
         self.app.router.add_get('/health', self.health_check)
+        self.app.router.add_get('/metrics', handle_metrics)
         self.app.router.add_get('/ws', self.websocket_handler)
         self.app.router.add_get('/api/voice-streaming/ws', self.websocket_handler)
         self.app.router.add_post('/webrtc/offer', self.handle_webrtc_offer_endpoint)
         self.app.router.add_post('/webrtc/answer', self.handle_webrtc_answer_endpoint)
         self.app.router.add_post('/webrtc/candidate', self.handle_webrtc_candidate_endpoint)
+        if self.recorder:
+            RecordingsApi(self.recorder).add_routes(self.app.router)
         # Only add static route if directory exists
         if os.path.exists('/app/www'):
             self.app.router.add_static('/', '/app/www')
@@ -79,18 +137,31 @@ class VoiceStreamingServer:
         ws = web.WebSocketResponse()
         await ws.prepare(request)
         
+        reason = self.admission.admit_connection(len(self.connections))
+        if reason:
+            await self.admission.reject_connection(ws, reason)
+            return ws
+        
         connection_id = str(uuid.uuid4())
         self.connections[connection_id] = {
             'ws': ws,
             'pc': None,
-            'recorder': None
+            'recording': None,
+            'trickle': False,
+            'opus_profile': None,
+            'pending_candidates': []
         }
         
         try:
             async for msg in ws:
                 if msg.type == WSMsgType.TEXT:
                     data = json.loads(msg.data)
-                    await self.handle_message(connection_id, data)
+                    message_type = data.get('type')
+                    if message_type not in ('start_stream', 'stop_stream', 'webrtc_offer',
+                                            'ice_candidate'):
+                        message_type = 'other'
+                    with MESSAGE_SECONDS.labels(message_type).time():
+                        await self.handle_message(connection_id, data)
                 elif msg.type == WSMsgType.ERROR:
                     logger.error(f'WebSocket error: {ws.exception()}')
                     
@@ -109,11 +180,13 @@ class VoiceStreamingServer:
             return
             
         if message_type == 'start_stream':
-            await self.start_voice_stream(connection_id)
+            await self.start_voice_stream(connection_id, data)
         elif message_type == 'stop_stream':
             await self.stop_voice_stream(connection_id)
         elif message_type == 'webrtc_offer':
             await self.handle_webrtc_offer(connection_id, data)
+        elif message_type == 'ice_candidate':
+            await self.handle_ice_candidate(connection_id, data)
             
     async def stop_voice_stream(self, connection_id: str):
         """Stop voice streaming for a connection"""
@@ -127,19 +200,41 @@ class VoiceStreamingServer:
         # Send confirmation to client
         if connection.get('ws'):
             try:
-                await connection['ws'].send_text(json.dumps({
+                await connection['ws'].send_str(json.dumps({
                     'type': 'stream_stopped',
                     'connection_id': connection_id
                 }))
             except:
                 pass
             
-    async def start_voice_stream(self, connection_id: str):
+    async def start_voice_stream(self, connection_id: str, options: dict = None):
         connection = self.connections[connection_id]
+        options = options or {}
+
+        streams = sum(1 for conn in self.connections.values() if conn['pc'])
+        reason = self.admission.admit_stream(streams)
+        if reason:
+            await connection['ws'].send_str(json.dumps(self.admission.rejection(reason)))
+            return
+
+        # Clients trade latency for fewer, larger messages per stream
+        aggregation = self.config['aggregation']
+        connection['window_ms'] = int(options.get('window_ms') or aggregation['window_ms'])
+        connection['max_latency_ms'] = int(
+            options.get('max_latency_ms') or aggregation['max_latency_ms'])
+        # Send the answer before gathering, and the candidates after it
+        connection['trickle'] = bool(options.get('trickle'))
+        try:
+            connection['opus_profile'] = check_profile(
+                options.get('opus_profile')
+                or self.config['webrtc']['audio_constraints'].get('opus_profile'))
+        except ValueError as e:
+            await connection['ws'].send_str(json.dumps({'type': 'error', 'message': str(e)}))
+            return
         
         if not WEBRTC_AVAILABLE:
             # Send mock response when WebRTC is not available
-            await connection['ws'].send_text(json.dumps({
+            await connection['ws'].send_str(json.dumps({
                 'type': 'stream_ready',
                 'connection_id': connection_id,
                 'warning': 'WebRTC not available'
@@ -147,58 +242,117 @@ class VoiceStreamingServer:
             return
             
         # Create RTCPeerConnection with optimized settings
-        rtc_config = self.config['webrtc']['rtc_config']
-        rtc_config['iceServers'] = self.config['webrtc']['ice_servers']
+        # aiortc only takes ICE servers; bundle/rtcp-mux are always on
+        rtc_config = RTCConfiguration(iceServers=[
+            RTCIceServer(urls=server['urls'])
+            for server in self.config['webrtc']['ice_servers']
+        ])
         
         pc = RTCPeerConnection(configuration=rtc_config)
         connection['pc'] = pc
+        self.admission.begin_negotiation(connection_id)
+        
+        @pc.on("connectionstatechange")
+        def on_connectionstatechange():
+            if pc.connectionState in ("connected", "failed", "closed"):
+                self.admission.end_negotiation(connection_id)
         
         # Set up audio track handling
         @pc.on("track")
         async def on_track(track):
             if track.kind == "audio":
                 logger.info("Received audio track")
-                
-                # Create recorder for processing
-                recorder = MediaRecorder("/tmp/stream.wav")
-                await recorder.addTrack(track)
-                await recorder.start()
-                connection['recorder'] = recorder
+                if self.recorder and self.config['recording']['format'] == 'opus':
+                    self.record_packets(connection_id, pc)
                 
                 # Process audio frames in real-time
                 asyncio.create_task(self.process_audio_stream(track, connection_id))
                 
         # Send ready signal
-        await connection['ws'].send_text(json.dumps({
+        await connection['ws'].send_str(json.dumps({
             'type': 'stream_ready',
             'connection_id': connection_id
         }))
         
     async def process_audio_stream(self, track: MediaStreamTrack, connection_id: str):
         """Process incoming audio frames with minimal latency"""
+        connection = self.connections[connection_id]
+        aggregator = None
         try:
             while True:
-                frame = await track.recv()
+                # Wait no longer than the partial window's latency cap
+                deadline = aggregator.time_to_deadline() if aggregator else None
+                try:
+                    frame = await asyncio.wait_for(track.recv(), deadline)
+                except asyncio.TimeoutError:
+                    await self.emit_windows(connection_id, aggregator, aggregator.flush())
+                    continue
                 
                 # Convert frame to numpy array (simplified)
                 # In a real implementation, you would process the audio data here
                 # and potentially send it to Home Assistant for further processing
+                if aggregator is None:
+                    aggregator = FrameAggregator(
+                        frame.sample_rate, len(frame.layout.channels),
+                        connection['window_ms'], connection['max_latency_ms'])
+                    if self.recorder and not self.recording_packets(connection_id):
+                        connection['recording'] = self.recorder.open_stream(
+                            connection_id, frame.sample_rate, len(frame.layout.channels))
+
+                samples = frame.to_ndarray()
+                if connection['recording'] and connection['recording'].format == 'wav':
+                    connection['recording'].write(samples)
                 
-                # Trigger Home Assistant events
-                await self.trigger_voice_event(connection_id, frame)
+                # Trigger Home Assistant events, one per completed window
+                await self.emit_windows(connection_id, aggregator, aggregator.add(samples))
                 
+        except MediaStreamError:
+            # End of stream: deliver the last partial window
+            if aggregator and connection_id in self.connections:
+                await self.emit_windows(connection_id, aggregator, aggregator.flush())
         except Exception as e:
             logger.error(f"Audio processing error: {e}")
+
+    def record_packets(self, connection_id: str, pc):
+        """Record the sender's Opus packets without decoding them"""
+        connection = self.connections[connection_id]
+        forwarder = PacketForwarder(pc, connection_id)
+        for transceiver in pc.getTransceivers():
+            if transceiver.kind == 'audio':
+                forwarder.attach(transceiver.receiver)
+        connection['forwarder'] = forwarder
+
+        def on_packet(packet):
+            if connection['recording'] is None:
+                # Browsers always negotiate Opus as two channels
+                connection['recording'] = self.recorder.open_stream(
+                    connection_id, OPUS_SAMPLE_RATE, 2, 'opus')
+            connection['recording'].write_packet(packet.payload, packet.timestamp)
+
+        forwarder.add_listener(on_packet)
+
+    def recording_packets(self, connection_id: str) -> bool:
+        # Falls back to decoded PCM when the sender did not negotiate Opus
+        forwarder = self.connections[connection_id].get('forwarder')
+        return forwarder is not None and forwarder.forwarding
+
+    async def emit_windows(self, connection_id: str, aggregator, windows):
+        """Send each aggregated window as one audio event"""
+        for block, timestamp in windows:
+            await self.trigger_voice_event(
+                connection_id, block.size // aggregator.channels, aggregator.sample_rate)
             
-    async def trigger_voice_event(self, connection_id: str, frame):
+    async def trigger_voice_event(self, connection_id: str, samples: int, sample_rate: int):
         """Send audio data to Home Assistant for processing"""
         connection = self.connections[connection_id]
         
         # Send processed audio event
-        await connection['ws'].send_text(json.dumps({
+        await connection['ws'].send_str(json.dumps({
             'type': 'audio_data',
             'connection_id': connection_id,
-            'timestamp': asyncio.get_event_loop().time()
+            'timestamp': asyncio.get_event_loop().time(),
+            'samples': samples,
+            'sample_rate': sample_rate
         }))
         
     async def handle_webrtc_offer_endpoint(self, request):
@@ -230,56 +384,110 @@ class VoiceStreamingServer:
         offer = RTCSessionDescription(sdp=data['offer']['sdp'], 
                                     type=data['offer']['type'])
         await pc.setRemoteDescription(offer)
+        await add_pending_candidates(pc, connection['pending_candidates'])
         
         # Create and send answer
         answer = await pc.createAnswer()
-        await pc.setLocalDescription(answer)
+        if connection['trickle']:
+            # The answer already carries the ICE credentials
+            await self.send_answer(connection_id, answer)
+            await pc.setLocalDescription(answer)
+            for message in candidate_messages(pc):
+                await connection['ws'].send_str(json.dumps(message))
+        else:
+            await pc.setLocalDescription(answer)
+            await self.send_answer(connection_id, pc.localDescription)
         
-        await connection['ws'].send_text(json.dumps({
+    async def send_answer(self, connection_id: str, answer):
+        connection = self.connections[connection_id]
+        await connection['ws'].send_str(json.dumps({
             'type': 'webrtc_answer',
             'answer': {
-                'sdp': pc.localDescription.sdp,
-                'type': pc.localDescription.type
+                'sdp': apply_profile(answer.sdp, connection['opus_profile']),
+                'type': answer.type
             }
         }))
         
+    async def handle_ice_candidate(self, connection_id: str, data: dict):
+        connection = self.connections[connection_id]
+        if not WEBRTC_AVAILABLE:
+            return
+        try:
+            candidate = parse_candidate(data.get('candidate'))
+        except ValueError as e:
+            logger.error(str(e))
+            return
+            
+        pc = connection['pc']
+        if pc and pc.remoteDescription:
+            await add_candidate(pc, candidate)
+        elif len(connection['pending_candidates']) < MAX_PENDING_CANDIDATES:
+            # Too early: keep it until the offer is set
+            connection['pending_candidates'].append(candidate)
+        
     async def cleanup_connection(self, connection_id: str):
         if connection_id in self.connections:
             connection = self.connections[connection_id]
             
-            if connection.get('recorder') and WEBRTC_AVAILABLE:
-                await connection['recorder'].stop()
+            if connection.get('recording'):
+                self.recorder.close_stream(connection['recording'])
                 
             if connection.get('pc') and WEBRTC_AVAILABLE:
                 await connection['pc'].close()
+            self.admission.end_negotiation(connection_id)
                 
             del self.connections[connection_id]
             
-    async def run_server(self):
+    async def on_startup(self, app):
+        CONNECTED_CLIENTS.set_function(lambda: len(self.connections))
+        NEGOTIATIONS_IN_FLIGHT.set_function(self.admission.negotiations)
+        self._loop_lag_task = asyncio.create_task(
+            monitor_loop_lag(on_lag=self.admission.sample))
+
+    async def on_shutdown(self, app):
+        self._loop_lag_task.cancel()
+        # Let the writers drain and finalize open segments
+        if self.recorder:
+            await asyncio.get_event_loop().run_in_executor(None, self.recorder.stop)
+
+    async def run_server(self, reuse_port: bool = False):
         port = self.config['server']['port']
         host = self.config['server']['host']
         
         runner = web.AppRunner(self.app)
         await runner.setup()
         
-        site = web.TCPSite(runner, host, port)
+        # Workers share the port; the kernel spreads connections over them
+        site = web.TCPSite(runner, host, port, reuse_port=reuse_port or None)
         await site.start()
         
         logger.info(f"Voice streaming server started on {host}:{port}")
         
         # Keep the server running
-        while True:
-            await asyncio.sleep(3600)  # Sleep for an hour, or until interrupted
+        try:
+            while True:
+                await asyncio.sleep(3600)  # Sleep for an hour, or until interrupted
+        finally:
+            await runner.cleanup()
 
 # Example usage
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='WebRTC voice streaming server')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes sharing the port (SO_REUSEPORT)')
+    args = parser.parse_args()
+
     # Configure logging
     logging.basicConfig(level=logging.INFO)
     
-    # Create and run the server
-    server = VoiceStreamingServer()
-    
-    try:
-        asyncio.run(server.run_server())
-    except KeyboardInterrupt:
-        print("Server stopped")
\ No newline at end of file
+    if args.workers > 1:
+        # Each worker records its own senders; the recording index is shared
+        run_workers(VoiceStreamingServer, args.workers, shared_registry=False)
+    else:
+        # Create and run the server
+        server = VoiceStreamingServer()
+
+        try:
+            asyncio.run(server.run_server())
+        except KeyboardInterrupt:
+            print("Server stopped")
\ No newline at end of file
@@ -1,25 +1,164 @@
+import argparse
 import asyncio
 import json
 import logging
+import socket
 import uuid
-from typing import Dict
+from typing import Dict, Optional
 
 from aiohttp import WSMsgType, web
-from aiortc import RTCPeerConnection, RTCSessionDescription
+from aiortc import (
+    RTCConfiguration,
+    RTCIceServer,
+    RTCPeerConnection,
+    RTCSessionDescription,
+)
+
+from admission import DEFAULT_RETRY_AFTER, AdmissionController
+from diagnostics import LoopWatchdog, Profiler
+from ice_candidates import (
+    MAX_PENDING_CANDIDATES,
+    add_candidate,
+    add_pending_candidates,
+    candidate_messages,
+    parse_candidate,
+)
+from outbound import (
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_SEND_TIMEOUT,
+    POLICY_DISCONNECT,
+    OutboundQueue,
+)
+from media_bridge import BridgePacketSource, bridge_url, serve_bridge
+from metrics import (
+    ACTIVE_STREAMS,
+    CONNECTED_CLIENTS,
+    MESSAGE_SECONDS,
+    NEGOTIATIONS_IN_FLIGHT,
+    PC_STATE_TRANSITIONS,
+    REGISTRY,
+    handle_metrics,
+    monitor_loop_lag,
+)
+from opus_profiles import PROFILES, apply_profile, check_profile
+from packet_forwarding import OPUS_MIME_TYPE, PacketForwarder, negotiated_audio_codec
+from pcm_history import (
+    DEFAULT_HISTORY_SECONDS,
+    SNAPSHOT_FORMATS,
+    PcmHistory,
+    encode_snapshot,
+)
+from peer_pool import DEFAULT_MAX_SIZE, PeerConnectionPool
+from session_trace import (
+    PHASE_ANSWER,
+    PHASE_DTLS_CONNECTED,
+    PHASE_FIRST_FRAME,
+    PHASE_ICE_CONNECTED,
+    PHASE_ICE_GATHERING,
+    PHASE_OFFER,
+    SessionTrace,
+)
+from shared_ring import PacketRing, RingPacketSource
+from stream_fanout import StreamFanout
+from stream_registry import BrokerStreamRegistry, StreamRegistry
+from workers import run_workers
 
 logger = logging.getLogger(__name__)
 
+# How often each worker looks for streams started or ended on other workers
+# and nodes
+REGISTRY_POLL_INTERVAL = 0.5
+# Client message types timed separately; anything else is timed as "other"
+MESSAGE_TYPES = (
+    "start_sending",
+    "start_receiving",
+    "webrtc_offer",
+    "webrtc_answer",
+    "ice_candidate",
+    "get_history",
+)
+
 
 class VoiceStreamingServer:
-    def __init__(self):
+    def __init__(
+        self,
+        forward_packets: bool = True,
+        outbound_queue_size: int = DEFAULT_QUEUE_SIZE,
+        send_timeout: float = DEFAULT_SEND_TIMEOUT,
+        slow_consumer_policy: str = POLICY_DISCONNECT,
+        history_seconds: float = DEFAULT_HISTORY_SECONDS,
+        registry: StreamRegistry = None,
+        worker_id: int = 0,
+        node_id: str = None,
+        advertise_url: str = None,
+        loop_lag_threshold: float = None,
+        enable_profiler: bool = False,
+        admission: AdmissionController = None,
+        ice_servers: list = None,
+        peer_pool_size: int = 0,
+        peer_pool_gather: bool = True,
+        opus_profile: str = None,
+    ):
+        # Forward the sender's Opus packets to receivers instead of re-encoding
+        self.forward_packets = forward_packets
+        # Per-connection outbound queues: size, send timeout and what to do
+        # with a client whose queue fills up ('disconnect' or 'drop_oldest')
+        self.outbound_queue_size = outbound_queue_size
+        self.send_timeout = send_timeout
+        self.slow_consumer_policy = slow_consumer_policy
+        # Seconds of decoded audio kept in memory per stream for snapshots
+        self.history_seconds = history_seconds
+        # Which node and worker owns each stream; shared by all workers in
+        # worker mode and by all nodes in cluster mode
+        self.registry = registry or StreamRegistry()
+        self.worker_id = worker_id
+        self.node_id = node_id or socket.gethostname()
+        # Where other nodes reach this one to bridge its streams
+        self.advertise_url = advertise_url
+        # Log the blocking stack when the event loop stalls this many seconds
+        self.loop_lag_threshold = loop_lag_threshold
+        # Serve GET /admin/profile, a sampling profile of the live process
+        self.enable_profiler = enable_profiler
+        # Limits on new connections and sessions; none by default
+        self.admission = admission or AdmissionController()
+        # STUN/TURN URLs for every peer connection; None uses aiortc's default
+        self.ice_servers = ice_servers
+        # Up to `peer_pool_size` peer connections per role prepared ahead,
+        # with their ICE candidates already gathered if `peer_pool_gather`
+        self.peer_pools: Dict[str, PeerConnectionPool] = {}
+        if peer_pool_size:
+            for role, direction in (("sender", "recvonly"), ("receiver", "sendonly")):
+                self.peer_pools[role] = PeerConnectionPool(
+                    self.new_peer_connection,
+                    direction,
+                    role,
+                    gather=peer_pool_gather,
+                    max_size=peer_pool_size,
+                )
+        # Opus parameters asked of senders and announced to receivers;
+        # None leaves aiortc's descriptions as they are
+        self.opus_profile = check_profile(opus_profile)
         self.connections: Dict[str, dict] = {}
-        self.active_streams: Dict[str, Dict] = {}  # stream_id -> {track, receivers[]}
+        # stream_id -> {track, fanout, forwarder, history, ring, receivers[], bridges}
+        self.active_streams: Dict[str, Dict] = {}
+        # Streams owned by other workers or nodes with receivers or bridges
+        # here: stream_id -> {forwarder (a RemotePacketSource), receivers[], bridges}
+        self.remote_streams: Dict[str, Dict] = {}
         self.app = web.Application()
+        self.app.on_startup.append(self.on_startup)
+        self.app.on_shutdown.append(self.on_shutdown)
         self.setup_routes()
 
     def setup_routes(self):
         self.app.router.add_get("/health", self.health_check)
         self.app.router.add_get("/ws", self.websocket_handler)
+        self.app.router.add_get(
+            "/api/streams/{stream_id}/history", self.handle_history_request
+        )
+        self.app.router.add_get("/api/bridge/{stream_id}", self.handle_bridge_request)
+        self.app.router.add_get("/metrics", handle_metrics)
+        if self.enable_profiler:
+            self.app.router.add_get("/admin/profile", Profiler().handle_profile)
 
     async def health_check(self, request):
         return web.json_response(
@@ -28,6 +167,8 @@ class VoiceStreamingServer:
                 "webrtc_available": True,
                 "active_streams": len(self.active_streams),
                 "connected_clients": len(self.connections),
+                "node": self.node_id,
+                "worker": self.worker_id,
             }
         )
 
@@ -35,22 +176,47 @@ class VoiceStreamingServer:
         ws = web.WebSocketResponse()
         await ws.prepare(request)
 
+        reason = self.admission.admit_connection(len(self.connections))
+        if reason:
+            await self.admission.reject_connection(ws, reason)
+            return ws
+
         connection_id = str(uuid.uuid4())
+        outbound = OutboundQueue(
+            ws,
+            connection_id,
+            maxsize=self.outbound_queue_size,
+            send_timeout=self.send_timeout,
+            policy=self.slow_consumer_policy,
+            transport=request.transport,
+        )
+        outbound.start()
         self.connections[connection_id] = {
             "ws": ws,
+            "outbound": outbound,
             "pc": None,
             "role": None,  # 'sender' or 'receiver'
             "stream_id": None,
+            "track": None,  # receiver's fan-out proxy track
+            "forwarded": False,  # proxy carries encoded packets, not frames
+            "trace": None,  # receiver's SessionTrace
+            "session_stats": False,  # send the trace once audio flows
+            "trickle": False,  # send local candidates after the description
+            "pending_candidates": [],  # arrived before the remote description
         }
 
         try:
             # Notify the client of available streams
-            await self.send_available_streams(connection_id)
+            self.send_available_streams(connection_id)
 
             async for msg in ws:
                 if msg.type == WSMsgType.TEXT:
                     data = json.loads(msg.data)
-                    await self.handle_message(connection_id, data)
+                    message_type = data.get("type")
+                    if message_type not in MESSAGE_TYPES:
+                        message_type = "other"
+                    with MESSAGE_SECONDS.labels(message_type).time():
+                        await self.handle_message(connection_id, data)
                 elif msg.type == WSMsgType.ERROR:
                     logger.error(f"WebSocket error: {ws.exception()}")
 
@@ -69,39 +235,91 @@ class VoiceStreamingServer:
             return
 
         if message_type == "start_sending":
-            await self.setup_sender(connection_id)
+            await self.setup_sender(connection_id, bool(data.get("trickle")))
         elif message_type == "start_receiving":
-            await self.setup_receiver(connection_id, data.get("stream_id"))
+            await self.setup_receiver(
+                connection_id,
+                data.get("stream_id"),
+                bool(data.get("session_stats")),
+                bool(data.get("trickle")),
+            )
         elif message_type == "webrtc_offer":
             await self.handle_webrtc_offer(connection_id, data)
         elif message_type == "webrtc_answer":
             await self.handle_webrtc_answer(connection_id, data)
         elif message_type == "ice_candidate":
             await self.handle_ice_candidate(connection_id, data)
+        elif message_type == "get_history":
+            await self.send_history(connection_id, data)
 
-    async def setup_sender(self, connection_id: str):
-        """Set up a client as an audio sender"""
+    async def setup_sender(self, connection_id: str, trickle: bool = False):
+        """Set up a client as an audio sender.
+
+        With `trickle`, the answer to the client's offer is sent before the
+        relay gathers its candidates, which follow as ice_candidate messages.
+        """
         logger.info(f"Setting up sender for connection {connection_id}")
+        senders = sum(
+            1 for conn in self.connections.values() if conn["role"] == "sender"
+        )
+        reason = self.admission.admit_stream(senders)
+        if reason:
+            self.send_message(connection_id, self.admission.rejection(reason))
+            return
         connection = self.connections[connection_id]
         connection["role"] = "sender"
+        connection["trickle"] = trickle
 
         # Create RTCPeerConnection for receiving audio
-        pc = RTCPeerConnection()
+        pc = self.create_peer_connection("sender")
         connection["pc"] = pc
+        self.count_state_transitions(pc, "sender")
+        self.track_negotiation(pc, connection_id)
 
         @pc.on("track")
         async def on_track(track):
             if track.kind == "audio":
                 logger.info(f"Received audio track from sender {connection_id}")
 
-                # Store the audio stream
+                # Store the audio stream; the fan-out is its only reader
                 stream_id = f"stream_{connection_id}"
+                fanout = StreamFanout(track, stream_id)
+                fanout.start()
+                forwarder = PacketForwarder(pc, stream_id)
+                for transceiver in pc.getTransceivers():
+                    if transceiver.receiver.track is track:
+                        forwarder.attach(transceiver.receiver)
+                history = None
+                if self.history_seconds:
+                    history = PcmHistory(self.history_seconds)
+                    fanout.add_listener(history.add_frame)
+                ring = None
+                if self.registry.shared:
+                    # Other workers read the stream's packets from shared memory
+                    ring = PacketRing.create()
+                    forwarder.add_listener(
+                        lambda packet: ring.write(packet.payload, packet.timestamp)
+                    )
                 self.active_streams[stream_id] = {
                     "track": track,
+                    "fanout": fanout,
+                    "forwarder": forwarder,
+                    "history": history,
+                    "ring": ring,
                     "receivers": [],
+                    "bridges": set(),
                     "sender_id": connection_id,
                 }
                 connection["stream_id"] = stream_id
+                self.registry.publish(
+                    stream_id,
+                    {
+                        "node": self.node_id,
+                        "worker": self.worker_id,
+                        "ring": ring.name if ring else None,
+                        "bridge": self.advertise_url,
+                    },
+                )
 
                 logger.info(f"Stored stream {stream_id} for sender {connection_id}")
                 logger.info(f"Active streams: {list(self.active_streams.keys())}")
@@ -113,117 +331,448 @@ class VoiceStreamingServer:
                 @track.on("ended")
                 async def on_ended():
                     logger.info(f"Audio track ended for {connection_id}")
-                    if stream_id in self.active_streams:
-                        # Notify receivers that stream ended
-                        for receiver_id in self.active_streams[stream_id]["receivers"]:
-                            if receiver_id in self.connections:
-                                try:
-                                    await self.connections[receiver_id]["ws"].send_str(
-                                        json.dumps(
-                                            {
-                                                "type": "stream_ended",
-                                                "stream_id": stream_id,
-                                            }
-                                        )
-                                    )
-                                except:
-                                    pass
-                        del self.active_streams[stream_id]
-                    await self.broadcast_stream_ended(stream_id)
+                    await self.end_stream(stream_id)
 
         # Don't create offer here, wait for the client to send an offer after adding tracks
-        await connection["ws"].send_str(
-            json.dumps({"type": "sender_ready", "connection_id": connection_id})
+        self.send_message(
+            connection_id, {"type": "sender_ready", "connection_id": connection_id}
         )
 
-    async def setup_receiver(self, connection_id: str, stream_id: str = None):
-        """Set up a client as an audio receiver"""
+    async def setup_receiver(
+        self,
+        connection_id: str,
+        stream_id: str = None,
+        session_stats: bool = False,
+        trickle: bool = False,
+    ):
+        """Set up a client as an audio receiver.
+
+        With `session_stats`, the client gets a session_stats message with
+        its connection-setup trace once its first audio frame is sent. With
+        `trickle`, the offer is sent before the relay gathers its candidates,
+        which follow as ice_candidate messages.
+        """
         connection = self.connections[connection_id]
         connection["role"] = "receiver"
+        connection["trace"] = SessionTrace(connection_id)
+        connection["session_stats"] = session_stats
+        connection["trickle"] = trickle
 
         # If no specific stream requested, use the first available
-        if not stream_id and self.active_streams:
-            stream_id = next(iter(self.active_streams))
+        if not stream_id:
+            stream_id = next(iter(self.active_streams), None) or next(
+                iter(self.registry.streams()), None
+            )
 
-        if stream_id not in self.active_streams:
-            await connection["ws"].send_str(
-                json.dumps({"type": "error", "message": "No audio stream available"})
+        stream = self.find_stream(stream_id) or self.attach_remote_stream(stream_id)
+        if not stream:
+            self.send_message(
+                connection_id, {"type": "error", "message": "No audio stream available"}
             )
             return
 
+        reason = self.admission.admit_receiver(len(stream["receivers"]))
+        if reason:
+            self.send_message(connection_id, self.admission.rejection(reason))
+            await self.release_remote_stream(stream_id)
+            return
+
         # Add this receiver to the stream
-        self.active_streams[stream_id]["receivers"].append(connection_id)
+        stream["receivers"].append(connection_id)
         connection["stream_id"] = stream_id
 
         # Create RTCPeerConnection for sending audio
-        pc = RTCPeerConnection()
+        pc = self.create_peer_connection("receiver")
         connection["pc"] = pc
+        self.count_state_transitions(pc, "receiver")
+        self.track_negotiation(pc, connection_id)
+        self.trace_session(pc, connection["trace"])
 
-        # Add the audio track from the sender
-        source_track = self.active_streams[stream_id]["track"]
-        pc.addTrack(source_track)
+        # Give the receiver its own proxy of the sender's stream. Forwarded
+        # proxies carry the sender's Opus packets; handle_webrtc_answer falls
+        # back to decoded frames if the receiver negotiates another codec.
+        # Streams from other workers only come as packets.
+        if self.forward_packets or stream["fanout"] is None:
+            connection["track"] = stream["forwarder"].subscribe(connection_id)
+            connection["forwarded"] = True
+        else:
+            connection["track"] = stream["fanout"].subscribe(connection_id)
+        connection["track"].on_first_frame = lambda: self.first_frame_sent(
+            connection_id
+        )
+        pc.addTrack(connection["track"])
 
         # Create and send offer to the receiver
         try:
             offer = await pc.createOffer()
-            await pc.setLocalDescription(offer)
-
-            await connection["ws"].send_str(
-                json.dumps(
-                    {
-                        "type": "webrtc_offer",
-                        "offer": {
-                            "sdp": pc.localDescription.sdp,
-                            "type": pc.localDescription.type,
-                        },
-                    }
-                )
-            )
+            await self.send_local_description(connection_id, offer)
         except Exception as e:
             logger.error(f"Error creating offer for receiver {connection_id}: {e}")
-            await connection["ws"].send_str(
-                json.dumps(
-                    {"type": "error", "message": f"Error creating offer: {str(e)}"}
-                )
+            self.send_message(
+                connection_id,
+                {"type": "error", "message": f"Error creating offer: {str(e)}"},
             )
 
-    async def send_available_streams(self, connection_id: str):
-        """Send list of available streams to a client"""
+    def create_peer_connection(self, role: str) -> RTCPeerConnection:
+        """A prepared peer connection from the role's pool, if pooling, or a new one"""
+        pool = self.peer_pools.get(role)
+        return pool.take() if pool else self.new_peer_connection()
+
+    def new_peer_connection(self) -> RTCPeerConnection:
+        if self.ice_servers is None:
+            return RTCPeerConnection()
+        return RTCPeerConnection(
+            RTCConfiguration(
+                iceServers=[RTCIceServer(urls) for urls in self.ice_servers]
+            )
+        )
+
+    async def send_local_description(
+        self, connection_id: str, description: RTCSessionDescription
+    ):
+        """Set and send the relay's offer or answer.
+
+        Trickling clients get the description before ICE gathering and the
+        candidates after it; others get it once it holds every candidate.
+        """
+        connection = self.connections[connection_id]
+        pc = connection["pc"]
+        if connection["trickle"]:
+            self.send_description(connection_id, description)
+            await pc.setLocalDescription(description)
+            for message in candidate_messages(pc):
+                self.send_message(connection_id, message)
+        else:
+            await pc.setLocalDescription(description)
+            self.send_description(connection_id, pc.localDescription)
+
+    def send_description(self, connection_id: str, description: RTCSessionDescription):
+        sdp = apply_profile(description.sdp, self.opus_profile)
+        self.send_message(
+            connection_id,
+            {
+                "type": f"webrtc_{description.type}",
+                description.type: {"sdp": sdp, "type": description.type},
+            },
+        )
         connection = self.connections.get(connection_id)
-        if not connection:
+        if connection and connection["trace"] and description.type == "offer":
+            connection["trace"].mark(PHASE_OFFER)
+
+    def count_state_transitions(self, pc: RTCPeerConnection, role: str):
+        @pc.on("connectionstatechange")
+        def on_connectionstatechange():
+            PC_STATE_TRANSITIONS.labels(role, pc.connectionState).inc()
+
+    def track_negotiation(self, pc: RTCPeerConnection, connection_id: str):
+        """Hold a negotiation slot until the peer connection settles"""
+        self.admission.begin_negotiation(connection_id)
+
+        @pc.on("connectionstatechange")
+        def on_connectionstatechange():
+            if pc.connectionState in ("connected", "failed", "closed"):
+                self.admission.end_negotiation(connection_id)
+
+    def trace_session(self, pc: RTCPeerConnection, trace: SessionTrace):
+        if pc.iceGatheringState == "complete":
+            # Gathered ahead of time by the pool
+            trace.begin(PHASE_ICE_GATHERING)
+            trace.end(PHASE_ICE_GATHERING)
+
+        @pc.on("icegatheringstatechange")
+        def on_icegatheringstatechange():
+            if pc.iceGatheringState == "gathering":
+                trace.begin(PHASE_ICE_GATHERING)
+            elif pc.iceGatheringState == "complete":
+                trace.end(PHASE_ICE_GATHERING)
+
+        @pc.on("iceconnectionstatechange")
+        def on_iceconnectionstatechange():
+            # aiortc reports "completed" where browsers report "connected"
+            if pc.iceConnectionState in ("connected", "completed"):
+                trace.mark(PHASE_ICE_CONNECTED)
+
+        @pc.on("connectionstatechange")
+        def on_connectionstatechange():
+            if pc.connectionState == "connected":
+                trace.mark(PHASE_DTLS_CONNECTED)
+
+    def first_frame_sent(self, connection_id: str):
+        connection = self.connections.get(connection_id)
+        if not connection or not connection["trace"]:
             return
+        trace = connection["trace"]
+        trace.mark(PHASE_FIRST_FRAME)
+        if connection["session_stats"]:
+            self.send_message(
+                connection_id,
+                dict(trace.as_message(), stream_id=connection["stream_id"]),
+            )
 
-        stream_list = list(self.active_streams.keys())
-        logger.info(f"Sending available streams to {connection_id}: {stream_list}")
+    def find_stream(self, stream_id: str) -> Optional[Dict]:
+        """A stream sent to this worker, or one relayed here from another worker or node"""
+        return self.active_streams.get(stream_id) or self.remote_streams.get(stream_id)
+
+    def is_local(self, owner: dict) -> bool:
+        return owner.get("node") == self.node_id and owner["worker"] == self.worker_id
+
+    def attach_remote_stream(self, stream_id: str) -> Optional[Dict]:
+        """Start receiving a stream owned by another worker or node.
+
+        Streams of this node's other workers are read from their packet
+        ring, those of other nodes over a media bridge.
+        """
+        owner = self.registry.owner(stream_id) if stream_id else None
+        if not owner or self.is_local(owner):
+            return None
+        if owner.get("node") == self.node_id and owner.get("ring"):
+            try:
+                source = RingPacketSource(owner["ring"], stream_id)
+            except FileNotFoundError:
+                # The stream ended while the registry still listed it
+                return None
+            logger.info(f"Relaying {stream_id} from worker {owner['worker']}")
+        elif owner.get("node") != self.node_id and owner.get("bridge"):
+            source = BridgePacketSource(
+                bridge_url(owner["bridge"], stream_id), stream_id
+            )
+            logger.info(f"Relaying {stream_id} from node {owner['node']}")
+        else:
+            return None
+        source.on_ended = lambda: self.forget_remote_stream(stream_id, source)
+        source.start()
+        self.remote_streams[stream_id] = {
+            "fanout": None,
+            "forwarder": source,
+            "receivers": [],
+            "bridges": set(),
+        }
+        return self.remote_streams[stream_id]
+
+    async def detach_remote_stream(self, stream_id: str):
+        stream = self.remote_streams.pop(stream_id, None)
+        if stream:
+            await self.close_bridges(stream)
+            await stream["forwarder"].stop()
+            REGISTRY.forget_stream(stream_id)
+
+    def forget_remote_stream(self, stream_id: str, source):
+        """Drop a remote stream whose source ended, so it is not handed out again"""
+        stream = self.remote_streams.get(stream_id)
+        if stream and stream["forwarder"] is source:
+            del self.remote_streams[stream_id]
+            REGISTRY.forget_stream(stream_id)
+
+    async def release_remote_stream(self, stream_id: str):
+        """Stop receiving a remote stream once nothing here uses it"""
+        stream = self.remote_streams.get(stream_id)
+        if stream and not stream["receivers"] and not stream["bridges"]:
+            await self.detach_remote_stream(stream_id)
+
+    async def close_bridges(self, stream: Dict):
+        for ws in tuple(stream["bridges"]):
+            await ws.close()
+
+    async def handle_bridge_request(self, request):
+        """Media bridge from another node to one of this node's streams"""
+        stream_id = request.match_info["stream_id"]
+        stream = self.find_stream(stream_id)
+        owner = self.registry.owner(stream_id)
+        if not stream and owner and owner.get("node") == self.node_id:
+            # Owned by another worker of this node
+            stream = self.attach_remote_stream(stream_id)
+        if not stream:
+            raise web.HTTPNotFound(text=f"No stream {stream_id} on this node")
         try:
-            await connection["ws"].send_str(
-                json.dumps({"type": "available_streams", "streams": stream_list})
+            return await serve_bridge(request, stream["forwarder"], stream["bridges"])
+        finally:
+            await self.release_remote_stream(stream_id)
+
+    async def watch_registry(self):
+        """Tell this worker's clients about streams starting and ending on other workers"""
+        known = set()
+        while True:
+            try:
+                streams = await self.registry.refresh()
+            except Exception as e:
+                logger.error(f"Stream registry unavailable: {e}")
+                await asyncio.sleep(REGISTRY_POLL_INTERVAL)
+                continue
+            remote = {
+                stream_id
+                for stream_id, owner in streams.items()
+                if not self.is_local(owner)
+            }
+            for stream_id in remote - known:
+                await self.broadcast_stream_available(stream_id)
+            for stream_id in known - remote:
+                await self.detach_remote_stream(stream_id)
+                await self.broadcast_stream_ended(stream_id)
+            known = remote
+            await asyncio.sleep(REGISTRY_POLL_INTERVAL)
+
+    async def on_startup(self, app):
+        ACTIVE_STREAMS.set_function(lambda: len(self.active_streams))
+        CONNECTED_CLIENTS.set_function(lambda: len(self.connections))
+        NEGOTIATIONS_IN_FLIGHT.set_function(self.admission.negotiations)
+        if self.registry.shared:
+            # Each worker serves its own /metrics; tell their series apart
+            REGISTRY.const_labels.update(
+                {"node": self.node_id, "worker": str(self.worker_id)}
             )
-        except Exception as e:
-            logger.error(f"Error sending available streams: {e}")
+        watchdog = None
+        if self.loop_lag_threshold:
+            watchdog = LoopWatchdog(self.loop_lag_threshold)
+        self._loop_lag_task = asyncio.ensure_future(
+            monitor_loop_lag(watchdog=watchdog, on_lag=self.admission.sample)
+        )
+        for pool in self.peer_pools.values():
+            pool.start()
+        await self.registry.start()
+        if self.registry.shared:
+            self._registry_task = asyncio.ensure_future(self.watch_registry())
+
+    async def on_shutdown(self, app):
+        self._loop_lag_task.cancel()
+        if self.registry.shared:
+            self._registry_task.cancel()
+        for stream_id in list(self.remote_streams):
+            await self.detach_remote_stream(stream_id)
+        for stream_id in list(self.active_streams):
+            await self.end_stream(stream_id)
+        for pool in self.peer_pools.values():
+            await pool.stop()
+        await self.registry.stop()
+
+    def send_message(self, connection_id: str, message: dict) -> bool:
+        """Queue a message for one client without waiting for the network"""
+        connection = self.connections.get(connection_id)
+        if not connection:
+            return False
+        return connection["outbound"].send(json.dumps(message))
+
+    def broadcast(self, message: dict):
+        """Queue a message for every client, serializing it only once"""
+        payload = json.dumps(message)
+        for conn in self.connections.values():
+            conn["outbound"].send(payload)
+
+    def send_available_streams(self, connection_id: str):
+        """Send list of available streams to a client"""
+        stream_list = list(self.registry.streams())
+        logger.info(f"Sending available streams to {connection_id}: {stream_list}")
+        self.send_message(
+            connection_id, {"type": "available_streams", "streams": stream_list}
+        )
 
     async def broadcast_stream_available(self, stream_id: str):
         """Notify all clients about new stream"""
         logger.info(f"Broadcasting stream available: {stream_id}")
-        message = json.dumps({"type": "stream_available", "stream_id": stream_id})
-
-        # Send to all clients (to update their stream lists)
-        for conn_id, conn in self.connections.items():
-            try:
-                await conn["ws"].send_str(message)
-            except:
-                pass
+        self.broadcast({"type": "stream_available", "stream_id": stream_id})
 
     async def broadcast_stream_ended(self, stream_id: str):
         """Notify all clients about ended stream"""
-        message = json.dumps({"type": "stream_ended", "stream_id": stream_id})
+        self.broadcast({"type": "stream_ended", "stream_id": stream_id})
 
-        # Send to all clients (to update their stream lists)
-        for conn_id, conn in self.connections.items():
-            try:
-                await conn["ws"].send_str(message)
-            except:
-                pass
+    async def snapshot_history(
+        self, stream_id: str, seconds: float, fmt: str, end=None
+    ):
+        """Encode the last `seconds` of a stream's history off the event loop.
+
+        Returns (file bytes, start time, duration) or raises KeyError for an
+        unknown stream and ValueError for a bad request.
+        """
+        stream = self.active_streams.get(stream_id)
+        if not stream or not stream["history"]:
+            raise KeyError(stream_id)
+        if fmt not in SNAPSHOT_FORMATS:
+            raise ValueError(f"format must be one of {SNAPSHOT_FORMATS}")
+
+        history = stream["history"]
+        samples, start_time = history.snapshot(min(seconds, self.history_seconds), end)
+        body = await asyncio.get_event_loop().run_in_executor(
+            None,
+            encode_snapshot,
+            samples,
+            history.sample_rate,
+            history.channels,
+            fmt,
+        )
+        return body, start_time, samples.shape[0] / (history.sample_rate or 1)
+
+    async def handle_history_request(self, request):
+        """GET /api/streams/{stream_id}/history?seconds=10&format=wav[&end=unix time]"""
+        stream_id = request.match_info["stream_id"]
+        try:
+            seconds = float(request.query.get("seconds", 10))
+            end = float(request.query["end"]) if "end" in request.query else None
+            fmt = request.query.get("format", "wav")
+            body, start_time, duration = await self.snapshot_history(
+                stream_id, seconds, fmt, end
+            )
+        except KeyError:
+            raise web.HTTPNotFound(text=f"No history for stream {stream_id}")
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+        extension = "wav" if fmt == "wav" else "ogg"
+        return web.Response(
+            body=body,
+            content_type="audio/wav" if fmt == "wav" else "audio/ogg",
+            headers={
+                "X-Start-Time": f"{start_time:.6f}",
+                "X-Duration": f"{duration:.6f}",
+                "Content-Disposition": f'attachment; filename="{stream_id}.{extension}"',
+            },
+        )
+
+    async def send_history(self, connection_id: str, data: dict):
+        """Answer get_history with a JSON header followed by the file as a binary message"""
+        stream_id = data.get("stream_id")
+        fmt = data.get("format", "wav")
+        try:
+            body, start_time, duration = await self.snapshot_history(
+                stream_id, float(data.get("seconds", 10)), fmt, data.get("end")
+            )
+        except (KeyError, ValueError) as e:
+            self.send_message(
+                connection_id,
+                {"type": "error", "message": f"History unavailable: {e}"},
+            )
+            return
+
+        self.send_message(
+            connection_id,
+            {
+                "type": "history",
+                "stream_id": stream_id,
+                "format": fmt,
+                "start_time": start_time,
+                "duration": duration,
+                "bytes": len(body),
+            },
+        )
+        connection = self.connections.get(connection_id)
+        if connection:
+            connection["outbound"].send(body)
+
+    async def end_stream(self, stream_id: str):
+        """Tear down a sender's stream and tell every client, receivers included"""
+        stream = self.active_streams.pop(stream_id, None)
+        if not stream:
+            return
+
+        try:
+            self.registry.unpublish(stream_id)
+        except Exception as e:
+            logger.error(f"Could not unpublish {stream_id}: {e}")
+        stream["forwarder"].stop()
+        await stream["fanout"].stop()
+        await self.close_bridges(stream)
+        if stream["ring"]:
+            stream["ring"].close()
+        REGISTRY.forget_stream(stream_id)
+        await self.broadcast_stream_ended(stream_id)
 
     async def handle_webrtc_offer(self, connection_id: str, data: dict):
         connection = self.connections[connection_id]
@@ -236,21 +785,10 @@ class VoiceStreamingServer:
             sdp=data["offer"]["sdp"], type=data["offer"]["type"]
         )
         await pc.setRemoteDescription(offer)
+        await add_pending_candidates(pc, connection["pending_candidates"])
 
         answer = await pc.createAnswer()
-        await pc.setLocalDescription(answer)
-
-        await connection["ws"].send_str(
-            json.dumps(
-                {
-                    "type": "webrtc_answer",
-                    "answer": {
-                        "sdp": pc.localDescription.sdp,
-                        "type": pc.localDescription.type,
-                    },
-                }
-            )
-        )
+        await self.send_local_description(connection_id, answer)
 
     async def handle_webrtc_answer(self, connection_id: str, data: dict):
         connection = self.connections[connection_id]
@@ -259,34 +797,61 @@ class VoiceStreamingServer:
         if not pc:
             return
 
+        if connection["trace"]:
+            connection["trace"].mark(PHASE_ANSWER)
+
+        if connection.get("forwarded"):
+            self.select_receiver_track(connection_id, data["answer"]["sdp"])
+
         answer = RTCSessionDescription(
             sdp=data["answer"]["sdp"], type=data["answer"]["type"]
         )
         await pc.setRemoteDescription(answer)
+        await add_pending_candidates(pc, connection["pending_candidates"])
+
+    def select_receiver_track(self, connection_id: str, answer_sdp: str):
+        """Transcode only for receivers that cannot take the forwarded Opus packets"""
+        connection = self.connections[connection_id]
+        stream_id = connection["stream_id"]
+        stream = self.active_streams.get(stream_id)
+        if not stream:
+            # Streams from other workers cannot be transcoded here
+            return
+
+        if (
+            stream["forwarder"].forwarding
+            and negotiated_audio_codec(answer_sdp) == OPUS_MIME_TYPE
+        ):
+            return
+
+        logger.info(f"Transcoding {stream_id} for receiver {connection_id}")
+        forwarded_track = connection["track"]
+        connection["track"] = stream["fanout"].subscribe(connection_id)
+        connection["track"].on_first_frame = forwarded_track.on_first_frame
+        connection["forwarded"] = False
+        for sender in connection["pc"].getSenders():
+            if sender.track is forwarded_track:
+                sender.replaceTrack(connection["track"])
+        forwarded_track.stop()
 
     async def handle_ice_candidate(self, connection_id: str, data: dict):
         connection = self.connections[connection_id]
-        pc = connection["pc"]
+        try:
+            candidate = parse_candidate(data.get("candidate"))
+        except ValueError as e:
+            logger.error(str(e))
+            return
 
+        pc = connection["pc"]
         if pc and pc.remoteDescription:
-            # The candidate might be a dict, we need to convert it to RTCIceCandidate
-            candidate_data = data["candidate"]
-            if isinstance(candidate_data, dict):
-                # For aiortc, we can directly pass the dictionary
-                # aiortc will parse the candidate string automatically
-                # Check if the dictionary has the required keys
-                if 'candidate' in candidate_data:
-                    try:
-                        await pc.addIceCandidate(candidate_data)
-                    except Exception as e:
-                        logger.error(f"Error adding ICE candidate: {e}")
-                else:
-                    logger.error(f"Invalid ICE candidate format: {candidate_data}")
-            else:
-                try:
-                    await pc.addIceCandidate(candidate_data)
-                except Exception as e:
-                    logger.error(f"Error adding ICE candidate: {e}")
+            await add_candidate(pc, candidate)
+            return
+        # Too early: keep it until the offer or answer is set
+        pending = connection["pending_candidates"]
+        if len(pending) < MAX_PENDING_CANDIDATES:
+            pending.append(candidate)
+        else:
+            logger.warning(f"Dropping early ICE candidate from {connection_id}")
 
     async def cleanup_connection(self, connection_id: str):
         if connection_id in self.connections:
@@ -294,62 +859,184 @@ class VoiceStreamingServer:
 
             # If this was a sender, notify about stream ending
             if connection.get("role") == "sender" and connection.get("stream_id"):
-                stream_id = connection["stream_id"]
-                if stream_id in self.active_streams:
-                    # Notify receivers that stream ended
-                    for receiver_id in self.active_streams[stream_id]["receivers"]:
-                        if receiver_id in self.connections:
-                            try:
-                                await self.connections[receiver_id]["ws"].send_str(
-                                    json.dumps(
-                                        {"type": "stream_ended", "stream_id": stream_id}
-                                    )
-                                )
-                            except:
-                                pass
-                    del self.active_streams[stream_id]
-                await self.broadcast_stream_ended(stream_id)
+                await self.end_stream(connection["stream_id"])
 
             # If this was a receiver, remove from stream receivers list
             elif connection.get("role") == "receiver" and connection.get("stream_id"):
                 stream_id = connection["stream_id"]
-                if stream_id in self.active_streams:
-                    if connection_id in self.active_streams[stream_id]["receivers"]:
-                        self.active_streams[stream_id]["receivers"].remove(
-                            connection_id
-                        )
+                stream = self.find_stream(stream_id)
+                if stream and connection_id in stream["receivers"]:
+                    stream["receivers"].remove(connection_id)
+                if connection.get("track"):
+                    connection["track"].stop()
+                await self.release_remote_stream(stream_id)
 
             if connection.get("pc"):
                 await connection["pc"].close()
+            self.admission.end_negotiation(connection_id)
 
+            await connection["outbound"].close()
             del self.connections[connection_id]
 
-    async def run_server(self):
-        port = 8080
-        host = "0.0.0.0"
-
+    async def run_server(
+        self, host: str = "0.0.0.0", port: int = 8080, reuse_port: bool = False
+    ):
         runner = web.AppRunner(self.app)
         await runner.setup()
 
-        site = web.TCPSite(runner, host, port)
+        # Workers share the port; the kernel spreads connections over them
+        site = web.TCPSite(runner, host, port, reuse_port=reuse_port or None)
         await site.start()
 
         logger.info(f"Voice streaming relay server started on {host}:{port}")
 
         # Keep the server running
-        while True:
-            await asyncio.sleep(3600)  # Sleep for an hour, or until interrupted
+        try:
+            while True:
+                await asyncio.sleep(3600)  # Sleep for an hour, or until interrupted
+        finally:
+            await runner.cleanup()
 
 
 # Example usage
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WebRTC voice streaming relay")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="worker processes sharing the port (SO_REUSEPORT)",
+    )
+    parser.add_argument(
+        "--broker", help="registry broker HOST:PORT; joins the cluster using it"
+    )
+    parser.add_argument("--node-id", help="name of this node (default: hostname)")
+    parser.add_argument(
+        "--advertise-url",
+        help="base URL other nodes use to reach this one "
+        "(default: http://<hostname>:<port>)",
+    )
+    parser.add_argument(
+        "--transcode",
+        action="store_true",
+        help="re-encode for every receiver instead of forwarding the sender's "
+        "Opus packets",
+    )
+    parser.add_argument(
+        "--loop-lag-threshold",
+        type=float,
+        help="log the blocking stack when the event loop stalls this many seconds",
+    )
+    parser.add_argument(
+        "--profiler",
+        action="store_true",
+        help="serve GET /admin/profile?seconds=N, a collapsed-stack sampling profile",
+    )
+    parser.add_argument(
+        "--max-connections", type=int, help="refuse WebSocket clients beyond this"
+    )
+    parser.add_argument("--max-streams", type=int, help="refuse senders beyond this")
+    parser.add_argument(
+        "--max-receivers-per-stream",
+        type=int,
+        help="refuse receivers of a stream beyond this",
+    )
+    parser.add_argument(
+        "--max-negotiations",
+        type=int,
+        help="refuse new sessions while this many peer connections are connecting",
+    )
+    parser.add_argument(
+        "--max-loop-lag",
+        type=float,
+        help="refuse new sessions while the event loop lags this many seconds",
+    )
+    parser.add_argument(
+        "--max-cpu",
+        type=float,
+        help="refuse new sessions while the process uses this percent of a core",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=float,
+        default=DEFAULT_RETRY_AFTER,
+        help="seconds refused clients are told to wait",
+    )
+    parser.add_argument(
+        "--ice-server",
+        action="append",
+        dest="ice_servers",
+        help="STUN or TURN URL for peer connections, repeatable "
+        "(default: aiortc's public STUN server)",
+    )
+    parser.add_argument(
+        "--peer-pool",
+        type=int,
+        nargs="?",
+        const=DEFAULT_MAX_SIZE,
+        default=0,
+        help="prepare up to this many peer connections per role ahead of demand "
+        f"(default when given: {DEFAULT_MAX_SIZE})",
+    )
+    parser.add_argument(
+        "--peer-pool-no-gather",
+        action="store_true",
+        help="pooled peer connections only have their certificates, not ICE "
+        "candidates, ready",
+    )
+    parser.add_argument(
+        "--opus-profile",
+        choices=list(PROFILES),
+        help="Opus ptime, bitrate, DTX and FEC asked of senders and announced "
+        "to receivers (default: aiortc's)",
+    )
+    args = parser.parse_args()
+
     # Configure logging
     logging.basicConfig(level=logging.INFO)
 
-    # Create and run the server
-    server = VoiceStreamingServer()
+    server_kwargs = {
+        "forward_packets": not args.transcode,
+        "loop_lag_threshold": args.loop_lag_threshold,
+        "enable_profiler": args.profiler,
+        "ice_servers": args.ice_servers,
+        "peer_pool_size": args.peer_pool,
+        "peer_pool_gather": not args.peer_pool_no_gather,
+        "opus_profile": args.opus_profile,
+        "admission": AdmissionController(
+            max_connections=args.max_connections,
+            max_streams=args.max_streams,
+            max_receivers_per_stream=args.max_receivers_per_stream,
+            max_negotiations=args.max_negotiations,
+            max_loop_lag=args.max_loop_lag,
+            max_cpu_percent=args.max_cpu,
+            retry_after=args.retry_after,
+        ),
+    }
+    if args.broker:
+        server_kwargs.update(
+            node_id=args.node_id,
+            advertise_url=args.advertise_url
+            or f"http://{socket.gethostname()}:{args.port}",
+        )
+
+    if args.workers > 1:
+        run_workers(
+            VoiceStreamingServer,
+            args.workers,
+            broker=args.broker,
+            server_kwargs=server_kwargs,
+            run_kwargs={"host": args.host, "port": args.port},
+        )
+    else:
+        # Create and run the server
+        if args.broker:
+            server_kwargs["registry"] = BrokerStreamRegistry(args.broker)
+        server = VoiceStreamingServer(**server_kwargs)
 
-    try:
-        asyncio.run(server.run_server())
-    except KeyboardInterrupt:
-        print("Server stopped")
+        try:
+            asyncio.run(server.run_server(args.host, args.port))
+        except KeyboardInterrupt:
+            print("Server stopped")
@@ -0,0 +1,108 @@
+"""
+Multi-process worker mode.
+
+One event loop runs all DTLS, SRTP, Opus and signaling work on a single
+core. ``run_workers`` starts N worker processes that each run a complete
+server on their own event loop and bind the same port with SO_REUSEPORT,
+so the kernel spreads incoming connections over them. A WebSocket session
+and its peer connection stay on the worker that accepted them, which pins
+each stream to its sender's worker. Relay workers share a
+SharedStreamRegistry and read streams owned by other workers through
+shared-memory packet rings (see shared_ring). In cluster mode each
+worker instead connects its own BrokerStreamRegistry to the broker.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import signal
+import socket
+
+from stream_registry import BrokerStreamRegistry, SharedStreamRegistry
+
+logger = logging.getLogger(__name__)
+
+
+def _interrupt(*_):
+    raise KeyboardInterrupt
+
+
+def _run_worker(server_class, worker_id: int, table, broker, server_kwargs, run_kwargs):
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s worker-{worker_id} %(name)s %(levelname)s %(message)s",
+    )
+    # The parent handles Ctrl+C and stops the workers with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if broker:
+        server_kwargs = dict(
+            server_kwargs, registry=BrokerStreamRegistry(broker), worker_id=worker_id
+        )
+    elif table is not None:
+        server_kwargs = dict(
+            server_kwargs, registry=SharedStreamRegistry(table), worker_id=worker_id
+        )
+    server = server_class(**server_kwargs)
+
+    # Stop like on Ctrl+C, so the server shuts down cleanly
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        asyncio.run(server.run_server(reuse_port=True, **run_kwargs))
+    except KeyboardInterrupt:
+        pass
+
+
+def run_workers(
+    server_class,
+    workers: int,
+    shared_registry: bool = True,
+    broker: str = None,
+    server_kwargs: dict = None,
+    run_kwargs: dict = None,
+):
+    """Run `workers` copies of a server on one port until interrupted; blocks.
+
+    With `shared_registry`, each server is created with a shared
+    `registry` and its `worker_id`, as the relay expects. With a `broker`
+    address, each gets its own connection to that registry broker instead.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("Worker mode needs SO_REUSEPORT, which this platform lacks")
+
+    # Workers must not inherit the parent's event loop or aiortc state
+    context = multiprocessing.get_context("spawn")
+    manager = context.Manager() if shared_registry and not broker else None
+    table = manager.dict() if manager else None
+    processes = [
+        context.Process(
+            target=_run_worker,
+            args=(
+                server_class,
+                number,
+                table,
+                broker,
+                server_kwargs or {},
+                run_kwargs or {},
+            ),
+            name=f"worker-{number}",
+        )
+        for number in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    # SIGTERM to the parent stops the workers too, instead of orphaning them
+    signal.signal(signal.SIGTERM, _interrupt)
+    logger.info(f"Started {workers} workers")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        logger.info("Stopping workers")
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    finally:
+        if manager:
+            manager.shutdown()